@@ -0,0 +1,3 @@
+"""
+Benchmarks of the loader and clustering pipeline on synthetic rate beer files
+"""
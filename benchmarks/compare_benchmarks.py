@@ -0,0 +1,64 @@
+"""
+Compares two sets of benchmark results written by `run_benchmarks`
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+
+def compare_results(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float = 0.1) -> List[str]:
+    """
+    Compares the time and traced memory of each stage run in both results.
+
+    Args:
+        baseline: The results to compare against.
+        candidate: The new results.
+        threshold: The relative increase above which a stage is reported as a regression.
+
+    Returns:
+        The stages that regressed, with the measurement that regressed.
+    """
+    if baseline["parameters"] != candidate["parameters"]:
+        print("Warning: the results were run with different parameters.")
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    regressions = []
+    print(f"{'stage':<30}{'baseline s':>12}{'candidate s':>12}{'change':>9}{'memory change':>15}")
+    for stage in candidate["stages"]:
+        previous = baseline_stages.get(stage["stage"])
+        if previous is None:
+            continue
+        time_change = _get_change(previous["seconds"], stage["seconds"])
+        memory_change = _get_change(previous.get("peak_traced_bytes"), stage.get("peak_traced_bytes"))
+        print(f"{stage['stage']:<30}{previous['seconds']:>12.3f}{stage['seconds']:>12.3f}{time_change:>+9.1%}"
+              + (f"{memory_change:>+15.1%}" if memory_change is not None else f"{'-':>15}"))
+        if time_change > threshold:
+            regressions.append(f"{stage['stage']} time")
+        if memory_change is not None and memory_change > threshold:
+            regressions.append(f"{stage['stage']} memory")
+    return regressions
+
+
+def _get_change(previous, current):
+    if previous is None or current is None or previous == 0:
+        return None if previous is None or current is None else 0.0
+    return current / previous - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares two benchmark results.")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="The relative increase reported as a regression.")
+    arguments = parser.parse_args()
+    with arguments.baseline.open("r") as baseline_file, arguments.candidate.open("r") as candidate_file:
+        regressions = compare_results(json.load(baseline_file), json.load(candidate_file), arguments.threshold)
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
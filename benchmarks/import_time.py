@@ -0,0 +1,90 @@
+"""
+Times importing each core module in a fresh interpreter and checks that none of them imports
+the optional backends, so parsing a rate beer file never pays for PyTorch, PyKEEN or sklearn.
+
+Example:
+    python -m benchmarks.import_time
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+# The modules that parse the file and build the graph, these may only need NumPy.
+CORE_MODULES = ("clustering.rate_beer_loader",
+                "clustering.review_table",
+                "clustering.record_formats",
+                "clustering.compression",
+                "clustering.sequences",
+                "clustering.incremental",
+                "clustering.embeddings",
+                "clustering.similarity",
+                "clustering.segments",
+                "clustering.segment_service",
+                "clustering.customerclustering",
+                "clustering.preprocessing_cache",
+                "clustering.pykeen_version",
+                "clustering.training_config")
+# The backends that are only imported when a model is trained, a sequence dataset is made or
+# the reviewers are clustered.
+BACKEND_MODULES = ("torch", "pykeen", "sklearn")
+
+_MEASURE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+from clustering.instrumentation import get_peak_rss_bytes
+print(json.dumps({{"seconds": seconds,
+                  "max_rss_bytes": get_peak_rss_bytes(),
+                  "backends": [name for name in {backends!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module: str) -> Dict[str, Any]:
+    """
+    Imports a module in a fresh interpreter, so nothing imported before is counted.
+
+    Args:
+        module: The name of the module.
+
+    Returns:
+        The seconds the import took, the peak resident set size of the interpreter and the
+        backends the import loaded.
+    """
+    completed = subprocess.run([sys.executable, "-c", _MEASURE_IMPORT.format(module=module,
+                                                                               backends=BACKEND_MODULES)],
+                               capture_output=True, text=True, check=True, cwd=Path(__file__).parent.parent)
+    return {"stage": f"import {module}", **json.loads(completed.stdout)}
+
+
+def measure_imports(modules: Sequence[str] = CORE_MODULES) -> List[Dict[str, Any]]:
+    """
+    Returns:
+        The measurements of importing each module, see `measure_import`.
+    """
+    results = []
+    for module in modules:
+        result = measure_import(module)
+        print(f"{result['stage']}: {result['seconds']:.3f}s", file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times importing the core modules.")
+    parser.add_argument("modules", nargs="*", default=CORE_MODULES)
+    arguments = parser.parse_args()
+    results = measure_imports(arguments.modules)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    heavy_imports = [result["stage"] for result in results if result["backends"]]
+    if heavy_imports:
+        print("Imports the backends: " + ", ".join(heavy_imports), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Times and memory profiles each stage of the loader and clustering pipeline on a synthetic rate
+beer file, writing the results as JSON so they can be compared across commits.
+
+Example:
+    python -m benchmarks.run_benchmarks --reviews 200000 --output results.json
+    python -m benchmarks.compare_benchmarks baseline.json results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.import_time import measure_imports
+from benchmarks.synthetic_rate_beer import write_synthetic_rate_beer
+from clustering.instrumentation import get_peak_rss_bytes
+
+
+class StageTimer:
+    """
+    Records the wall time, the peak memory allocated by Python and the maximum resident set size
+    of each stage that is run within `measure`.
+
+    The traced peak only covers memory allocated through Python, which includes NumPy arrays but
+    not the internal allocations of torch. The maximum resident set size covers everything but
+    only ever grows, so a stage only shows in it when it uses more memory than every stage before.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self._trace_memory = trace_memory
+        self.results: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Measures the code run within the context, the stage can be given a count of the items it
+        produced by setting `result["count"]` on the yielded result.
+
+        Args:
+            stage: The name of the stage.
+        """
+        result: Dict[str, Any] = {"stage": stage}
+        if self._trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield result
+        finally:
+            result["seconds"] = time.perf_counter() - start
+            if self._trace_memory:
+                result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            result["max_rss_bytes"] = get_peak_rss_bytes()
+            self.results.append(result)
+            print(f"{stage}: {result['seconds']:.3f}s", file=sys.stderr)
+
+
+def run_benchmarks(rate_beer_location: Path,
+                   working_directory: Path,
+                   num_workers: int = 1,
+                   embedding_dim: int = 50,
+                   cluster_range: range = range(2, 10),
+                   trace_memory: bool = True) -> List[Dict[str, Any]]:
+    """
+    Times importing the core modules, then runs each stage of the pipeline once, in order, on
+    the rate beer file.
+
+    Args:
+        rate_beer_location: The rate beer file to load.
+        working_directory: A directory to write the embeddings to.
+        num_workers: The number of processes to parse the file with.
+        embedding_dim: The dimension of the entity embeddings.
+        cluster_range: The numbers of clusters to fit.
+        trace_memory: Whether to trace the memory allocated by Python, which slows each stage.
+
+    Returns:
+        The measurements of each stage.
+    """
+    from pykeen.models import model_resolver
+
+    from clustering.customerclustering import RateBeerCustomerClusterCreator
+    from clustering.dates import DATE_FIELD_PREFIXES
+    from clustering.embeddings import extract_reviewer_embeddings, get_embeddings_location
+    from clustering.rate_beer_loader import (RateBeerLoader, RateBeerLoaderPykeen, _create_date_details,
+                                             _create_review_id)
+
+    timer = StageTimer(trace_memory=trace_memory)
+    timer.results.extend(measure_imports())
+    # The constructor of RateBeerLoaderPykeen runs the whole pipeline, so the loader is set up
+    # without it to time each stage separately.
+    loader = RateBeerLoaderPykeen.__new__(RateBeerLoaderPykeen)
+    RateBeerLoader.__init__(loader, rate_beer_location, num_workers=num_workers)
+    loader.checkpoint_name = f"benchmark_checkpoint_{time.time_ns()}.pt"
+
+    with timer.measure("process_rate_beer_file") as result:
+        reviews = loader._process_rate_beer_file()
+        result["count"] = len(reviews)
+    # The reviews are parsed with their date details, so these are removed to time creating them.
+    for review in reviews:
+        for field in DATE_FIELD_PREFIXES:
+            del review["review"][field]
+    with timer.measure("create_date_details") as result:
+        reviews = _create_date_details(reviews, loader._timezone)
+        result["count"] = len(reviews)
+    with timer.measure("create_review_id") as result:
+        reviews = _create_review_id(reviews)
+        result["count"] = len(reviews)
+    with timer.measure("connect_reviews_using_id") as result:
+        reviews = loader._connect_reviews_using_id(reviews)
+        result["count"] = len(reviews)
+    loader._rate_beer_processed = reviews
+
+    with timer.measure("create_hrt_list") as result:
+        result["count"] = len(loader._create_hrt_list())
+    with timer.measure("create_triples_factory") as result:
+        training_factory = loader._create_training_factory()
+        result["count"] = training_factory.num_triples
+    del reviews, loader
+
+    model = model_resolver.make("TransE", triples_factory=training_factory, embedding_dim=embedding_dim,
+                                random_seed=0)
+    embeddings_directory = working_directory.joinpath("reviewer_embeddings")
+    with timer.measure("extract_reviewer_embeddings") as result:
+        _, reviewer_names = extract_reviewer_embeddings(model, training_factory, embeddings_directory)
+        result["count"] = len(reviewer_names)
+    with timer.measure("cluster_reviewers") as result:
+        cluster_creator = RateBeerCustomerClusterCreator(get_embeddings_location(embeddings_directory),
+                                                         reviewer_names,
+                                                         cluster_range=cluster_range,
+                                                         random_state=0)
+        cluster_creator.fit()
+        result["count"] = cluster_creator.number_of_clusters
+    return timer.results
+
+
+def _get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the rate beer pipeline on a synthetic file.")
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--reviewers", type=int, default=5000)
+    parser.add_argument("--beers", type=int, default=10000)
+    parser.add_argument("--reviewer-skew", type=float, default=1.0)
+    parser.add_argument("--beer-skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--embedding-dim", type=int, default=50)
+    parser.add_argument("--max-clusters", type=int, default=9)
+    parser.add_argument("--no-trace-memory", action="store_true",
+                        help="Skip tracing the Python allocations, giving more accurate times.")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results, otherwise stdout.")
+    arguments = parser.parse_args()
+
+    parameters = {"reviews": arguments.reviews,
+                  "reviewers": arguments.reviewers,
+                  "beers": arguments.beers,
+                  "reviewer_skew": arguments.reviewer_skew,
+                  "beer_skew": arguments.beer_skew,
+                  "seed": arguments.seed,
+                  "num_workers": arguments.num_workers,
+                  "embedding_dim": arguments.embedding_dim,
+                  "max_clusters": arguments.max_clusters,
+                  "trace_memory": not arguments.no_trace_memory}
+    with tempfile.TemporaryDirectory() as working_directory:
+        working_directory = Path(working_directory)
+        rate_beer_location = write_synthetic_rate_beer(working_directory.joinpath("synthetic_rate_beer.txt"),
+                                                       number_of_reviews=arguments.reviews,
+                                                       number_of_reviewers=arguments.reviewers,
+                                                       number_of_beers=arguments.beers,
+                                                       reviewer_skew=arguments.reviewer_skew,
+                                                       beer_skew=arguments.beer_skew,
+                                                       seed=arguments.seed)
+        parameters["file_size_bytes"] = rate_beer_location.stat().st_size
+        stages = run_benchmarks(rate_beer_location,
+                                working_directory,
+                                num_workers=arguments.num_workers,
+                                embedding_dim=arguments.embedding_dim,
+                                cluster_range=range(2, arguments.max_clusters + 1),
+                                trace_memory=not arguments.no_trace_memory)
+
+    results = {"commit": _get_git_commit(),
+               "created": datetime.now(timezone.utc).isoformat(),
+               "python": platform.python_version(),
+               "numpy": np.__version__,
+               "platform": platform.platform(),
+               "parameters": parameters,
+               "stages": stages}
+    if arguments.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with arguments.output.open("w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
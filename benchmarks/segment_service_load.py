@@ -0,0 +1,155 @@
+"""
+Load tests the segment service over TCP with many concurrent clients, looking up reviewers with
+a skewed popularity so the cache sees hot reviewers, and writes the client and service latency
+percentiles as JSON.
+
+Example:
+    python -m benchmarks.segment_service_load --reviewers 100000 --clients 64 --requests 2000
+    python -m benchmarks.segment_service_load --embeddings-directory embeddings --centroids centroids.npy
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from clustering.embeddings import load_reviewer_embeddings
+from clustering.segment_service import LATENCY_PERCENTILES, SegmentService
+
+
+def create_synthetic_service(num_reviewers: int,
+                             embedding_dim: int = 50,
+                             num_segments: int = 8,
+                             random_seed: int = 0,
+                             **kwargs) -> SegmentService:
+    """
+    Creates a service over random embeddings and centroids, so the service can be load tested
+    without a trained model.
+
+    Args:
+        num_reviewers: The number of reviewers.
+        embedding_dim: The dimension of the embeddings.
+        num_segments: The number of centroids.
+        random_seed: The seed of the embeddings.
+        **kwargs: The other arguments of `SegmentService`.
+
+    Returns:
+        The service, its reviewers are named "pro0", "pro1" and so on.
+    """
+    random_generator = np.random.default_rng(random_seed)
+    embeddings = random_generator.normal(size=(num_reviewers, embedding_dim)).astype(np.float32)
+    centroids = random_generator.normal(size=(num_segments, embedding_dim))
+    return SegmentService(lambda ids: embeddings[ids],
+                          {f"pro{i}": i for i in range(num_reviewers)},
+                          centroids,
+                          **kwargs)
+
+
+async def run_load(host: str,
+                   port: int,
+                   profile_names: Sequence[str],
+                   num_clients: int = 32,
+                   requests_per_client: int = 1000,
+                   zipf_exponent: float = 1.1,
+                   random_seed: int = 0) -> Dict[str, Any]:
+    """
+    Opens a connection for each client, each sending its requests one after another.
+
+    Args:
+        host: The address of the service.
+        port: The port of the service.
+        profile_names: The reviewers to look up.
+        num_clients: The number of concurrent connections.
+        requests_per_client: The number of lookups sent by each client.
+        zipf_exponent: The skew of the reviewers' popularity, the reviewer of rank r is looked
+            up in proportion to 1 / r ** zipf_exponent, 0 looks up every reviewer equally.
+        random_seed: The seed of the looked up reviewers.
+
+    Returns:
+        The number of requests and errors, the requests per second and the client latency
+        percentiles in seconds.
+    """
+    random_generator = np.random.default_rng(random_seed)
+    popularity = 1 / np.arange(1, len(profile_names) + 1) ** zipf_exponent
+    chosen = random_generator.choice(len(profile_names), size=(num_clients, requests_per_client),
+                                     p=popularity / popularity.sum())
+    profile_names = np.asarray(profile_names, dtype=object)
+
+    async def run_client(names: Sequence[str]) -> Tuple[List[float], int]:
+        reader, writer = await asyncio.open_connection(host, port)
+        latencies = []
+        errors = 0
+        for name in names:
+            start = time.perf_counter()
+            writer.write(name.encode("utf-8") + b"\n")
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            errors += "error" in response
+        writer.close()
+        await writer.wait_closed()
+        return latencies, errors
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_client(profile_names[client].tolist()) for client in chosen))
+    seconds = time.perf_counter() - start
+    latencies = np.concatenate([client_latencies for client_latencies, _ in results])
+    result = {"requests": len(latencies),
+              "errors": sum(errors for _, errors in results),
+              "seconds": seconds,
+              "requests_per_second": len(latencies) / seconds}
+    for percentile in LATENCY_PERCENTILES:
+        result[f"latency_p{percentile}_seconds"] = float(np.percentile(latencies, percentile))
+    return result
+
+
+async def _load_test(service: SegmentService, profile_names: Sequence[str], **kwargs) -> Dict[str, Any]:
+    server = await service.serve()
+    async with server:
+        port = server.sockets[0].getsockname()[1]
+        client = await run_load("127.0.0.1", port, profile_names, **kwargs)
+    return {"client": client, "service": service.get_statistics()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests the segment service.")
+    parser.add_argument("--embeddings-directory", default=None,
+                        help="The directory of extracted embeddings, random embeddings are used without it.")
+    parser.add_argument("--centroids", default=None, help="A .npy file of the centroids.")
+    parser.add_argument("--reviewers", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000, help="The requests sent by each client.")
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--max-wait", type=float, default=0.0)
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results, otherwise stdout.")
+    arguments = parser.parse_args()
+
+    service_kwargs = {"cache_size": arguments.cache_size, "max_wait_seconds": arguments.max_wait}
+    if arguments.embeddings_directory is None:
+        service = create_synthetic_service(arguments.reviewers, arguments.dim, arguments.segments, **service_kwargs)
+        profile_names = [f"pro{i}" for i in range(arguments.reviewers)]
+    else:
+        assert arguments.centroids is not None, "The centroids are needed with the embeddings."
+        _, profile_names = load_reviewer_embeddings(arguments.embeddings_directory)
+        service = SegmentService.from_embeddings_directory(arguments.embeddings_directory,
+                                                           np.load(arguments.centroids), **service_kwargs)
+    results = asyncio.run(_load_test(service, profile_names,
+                                     num_clients=arguments.clients,
+                                     requests_per_client=arguments.requests,
+                                     zipf_exponent=arguments.zipf))
+    if arguments.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with arguments.output.open("w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Writes synthetic files in the rate beer format at any scale
+"""
+import argparse
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+_STYLES = ["Traditional Ale", "India Pale Ale &#40;IPA&#41;", "Sour Ale/Wild Ale", "Imperial/Double IPA",
+           "Belgian Ale", "Pale Lager", "Sweet Stout", "Mild Ale", "Brown Ale", "Bohemian Pilsener",
+           "Belgian White &#40;Witbier&#41;", "Abbey Tripel", "Porter", "Imperial Stout", "Saison",
+           "Weizen", "Bitter", "Barley Wine", "Golden Ale/Blond Ale", "Fruit Beer"]
+_WORDS = ["poured", "hazy", "amber", "golden", "head", "lacing", "aroma", "citrus", "pine", "caramel",
+          "malt", "hops", "bitter", "sweet", "finish", "light", "medium", "body", "carbonation", "tap",
+          "bottle", "glass", "notes", "of", "and", "with", "a", "the", "nice", "decent"]
+# Reviews are between 2000-01-01 and 2012-01-01, as in the original data.
+_FIRST_TIME = 946684800
+_LAST_TIME = 1325376000
+# The number of reviews generated at a time, so the whole file is never held in memory.
+_BATCH_SIZE = 100000
+
+
+def write_synthetic_rate_beer(file_location: Union[Path, str],
+                              number_of_reviews: int,
+                              number_of_reviewers: int,
+                              number_of_beers: int,
+                              reviewer_skew: float = 1.0,
+                              beer_skew: float = 1.0,
+                              words_per_review: int = 40,
+                              seed: int = 0) -> Path:
+    """
+    Writes a rate beer file of randomly generated reviews. The reviewers and beers of the reviews
+    follow a Zipf like distribution, the i-th reviewer being chosen with a weight of
+    1 / i ** reviewer_skew, so a skew of 0 spreads the reviews evenly while a larger skew gives
+    a few very active reviewers and popular beers as in the real data.
+
+    Args:
+        file_location: Where to write the file.
+        number_of_reviews: The number of reviews to write.
+        number_of_reviewers: The number of distinct reviewers to choose from.
+        number_of_beers: The number of distinct beers to choose from.
+        reviewer_skew: The skew of the number of reviews per reviewer.
+        beer_skew: The skew of the number of reviews per beer.
+        words_per_review: The average number of words of the review text.
+        seed: The seed of the random generator, the same seed writes the same file.
+
+    Returns:
+        The location the file was written to.
+    """
+    file_location = Path(file_location)
+    rng = np.random.default_rng(seed)
+    reviewer_weights = _get_zipf_weights(number_of_reviewers, reviewer_skew)
+    beer_weights = _get_zipf_weights(number_of_beers, beer_skew)
+
+    beer_styles = rng.integers(len(_STYLES), size=number_of_beers)
+    beer_brewers = rng.integers(max(number_of_beers // 10, 1), size=number_of_beers)
+    beer_abvs = np.round(rng.uniform(3.0, 12.0, size=number_of_beers), 1)
+
+    with file_location.open("w", encoding="utf-8", newline="\n") as rate_beer_file:
+        for start in range(0, number_of_reviews, _BATCH_SIZE):
+            batch_size = min(_BATCH_SIZE, number_of_reviews - start)
+            reviewers = rng.choice(number_of_reviewers, size=batch_size, p=reviewer_weights)
+            beers = rng.choice(number_of_beers, size=batch_size, p=beer_weights)
+            times = rng.integers(_FIRST_TIME, _LAST_TIME, size=batch_size)
+            out_of_fives = rng.integers(1, 6, size=(batch_size, 2))
+            out_of_tens = rng.integers(1, 11, size=(batch_size, 2))
+            overalls = rng.integers(1, 21, size=batch_size)
+            text_lengths = rng.poisson(words_per_review, size=batch_size) + 1
+            words = rng.integers(len(_WORDS), size=int(text_lengths.sum()))
+            word_start = 0
+            for i in range(batch_size):
+                beer = beers[i]
+                text = " ".join(_WORDS[word] for word in words[word_start:word_start + text_lengths[i]])
+                word_start += text_lengths[i]
+                rate_beer_file.write(f"beer/name: Synthetic Beer {beer}\n"
+                                     f"beer/beerId: {beer}\n"
+                                     f"beer/brewerId: {beer_brewers[beer]}\n"
+                                     f"beer/ABV: {beer_abvs[beer]}\n"
+                                     f"beer/style: {_STYLES[beer_styles[beer]]}\n"
+                                     f"review/appearance: {out_of_fives[i, 0]}/5\n"
+                                     f"review/aroma: {out_of_tens[i, 0]}/10\n"
+                                     f"review/palate: {out_of_fives[i, 1]}/5\n"
+                                     f"review/taste: {out_of_tens[i, 1]}/10\n"
+                                     f"review/overall: {overalls[i]}/20\n"
+                                     f"review/time: {times[i]}\n"
+                                     f"review/profileName: reviewer{reviewers[i]}\n"
+                                     f"review/text: {text.capitalize()}.\n"
+                                     "\n")
+    return file_location
+
+
+def _get_zipf_weights(number_of_values: int, skew: float) -> np.ndarray:
+    """
+    Returns:
+        The probability of choosing each value, the i-th value having a weight of 1 / i ** skew.
+    """
+    weights = 1.0 / np.arange(1, number_of_values + 1, dtype=np.float64) ** skew
+    return weights / weights.sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic rate beer file.")
+    parser.add_argument("output", type=Path, help="Where to write the file.")
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--reviewers", type=int, default=5000)
+    parser.add_argument("--beers", type=int, default=10000)
+    parser.add_argument("--reviewer-skew", type=float, default=1.0)
+    parser.add_argument("--beer-skew", type=float, default=1.0)
+    parser.add_argument("--words-per-review", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    write_synthetic_rate_beer(arguments.output,
+                              number_of_reviews=arguments.reviews,
+                              number_of_reviewers=arguments.reviewers,
+                              number_of_beers=arguments.beers,
+                              reviewer_skew=arguments.reviewer_skew,
+                              beer_skew=arguments.beer_skew,
+                              words_per_review=arguments.words_per_review,
+                              seed=arguments.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Opens plain and compressed input files, decompressing in a background thread
+"""
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import threading
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Union
+
+# The first bytes of each compression format and the function opening it.
+_COMPRESSED_OPENERS: Dict[bytes, Callable[[Path], BinaryIO]] = {
+    b"\x1f\x8b": gzip.open,
+    b"BZh": bz2.open,
+    b"\xfd7zXZ\x00": lzma.open,
+}
+# The number of decompressed bytes handed from the decompression thread at a time.
+_BLOCK_SIZE = 1 << 20
+# The most decompressed blocks waiting to be parsed, bounding the memory the thread can use.
+_QUEUED_BLOCKS = 8
+# How long the decompression thread waits on a full queue before checking if it should stop.
+_PUT_TIMEOUT_SECONDS = 0.1
+
+
+def is_compressed(file_location: Union[Path, str]) -> bool:
+    """
+    Returns:
+        Whether the file is gzip, bz2 or xz compressed, found from its first bytes rather than
+        its name.
+    """
+    return _find_opener(Path(file_location)) is not None
+
+
+def open_input(file_location: Union[Path, str], threaded: bool = True) -> BinaryIO:
+    """
+    Opens a file for reading in binary mode, decompressing gzip, bz2 and xz files as they are
+    read so they never need to be decompressed to disk.
+
+    The decompression of a compressed file is done in its own thread, a block at a time, while
+    the caller parses the blocks before it. zlib, bz2 and lzma release the GIL as they
+    decompress, so the two overlap. Compressed files can't seek.
+
+    Args:
+        file_location: The file to read.
+        threaded: Whether to decompress in a separate thread.
+
+    Returns:
+        The open file, use it as a context manager so the thread is stopped.
+    """
+    file_location = Path(file_location)
+    opener = _find_opener(file_location)
+    if opener is None:
+        return file_location.open(mode="rb")
+    compressed_file = opener(file_location)
+    if not threaded:
+        return compressed_file
+    return io.BufferedReader(_DecompressionThreadReader(compressed_file), buffer_size=_BLOCK_SIZE)
+
+
+def _find_opener(file_location: Path) -> Optional[Callable[[Path], BinaryIO]]:
+    with file_location.open(mode="rb") as input_file:
+        first_bytes = input_file.read(max(len(magic) for magic in _COMPRESSED_OPENERS))
+    for magic, opener in _COMPRESSED_OPENERS.items():
+        if first_bytes.startswith(magic):
+            return opener
+    return None
+
+
+class _DecompressionThreadReader(io.RawIOBase):
+    """
+    Reads the blocks a thread decompresses into a bounded queue, so the decompression of the
+    next blocks runs while the current block is parsed. An error in the thread is raised by the
+    read that reaches it.
+    """
+
+    def __init__(self, compressed_file: BinaryIO):
+        super().__init__()
+        self._compressed_file = compressed_file
+        self._blocks = queue.Queue(maxsize=_QUEUED_BLOCKS)
+        self._stopped = threading.Event()
+        self._block = memoryview(b"")
+        self._finished = False
+        self._thread = threading.Thread(target=self._decompress, name="decompress", daemon=True)
+        self._thread.start()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._block:
+            if self._finished:
+                return 0
+            block = self._blocks.get()
+            if isinstance(block, BaseException):
+                self._finished = True
+                raise block
+            if not block:
+                self._finished = True
+                return 0
+            self._block = memoryview(block)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            self._thread.join()
+            self._compressed_file.close()
+        super().close()
+
+    def _decompress(self):
+        try:
+            while not self._stopped.is_set():
+                block = self._compressed_file.read(_BLOCK_SIZE)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as error:
+            self._put(error)
+
+    def _put(self, item):
+        # The reader may stop before the end of the file, so a full queue is waited on in steps.
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=_PUT_TIMEOUT_SECONDS)
+                return
+            except queue.Full:
+                continue
@@ -1,12 +1,302 @@
 """
 Cluster the resulting entities
 """
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Sequence, Tuple, Dict, List, Union
+
+import numpy as np
+
+# The embeddings each worker process clusters, these are set once per worker rather than
+# being sent with every number of clusters.
+_worker_embeddings: Optional[np.ndarray] = None
+
 
 class RateBeerCustomerClusterCreator:
     """
     This will aim to use the elbow method and Kmeans++ to cluster the
     Rate Beer customers for customer segmentation.
+
+    Each number of clusters in `cluster_range` is fitted in its own process when `num_workers`
+    is above one, and the elbow of the inertias is found automatically. With `warm_start` each
+    number of clusters instead starts from the centroids of the previous one, so they are fitted
+    in order.
+
+    The embeddings can be the location of a `.npy` file, which is memory mapped. Setting
+    `batch_size` uses mini-batch k-means, reading `batch_size` embeddings at a time, so the
+    embeddings never need to be fully in memory.
+
+    sklearn is only imported when the clusters are fitted.
+    """
+
+    def __init__(self,
+                 reviewer_embeddings: Union[np.ndarray, Path, str],
+                 reviewer_names: Optional[Sequence[str]] = None,
+                 cluster_range: Sequence[int] = range(2, 10),
+                 num_workers: int = 1,
+                 warm_start: bool = False,
+                 random_state: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 mini_batch_passes: int = 1):
+        self._embeddings_location = None
+        if isinstance(reviewer_embeddings, (Path, str)):
+            self._embeddings_location = Path(reviewer_embeddings)
+            reviewer_embeddings = np.load(self._embeddings_location, mmap_mode="r")
+        self._reviewer_embeddings = reviewer_embeddings
+        self._batch_size = batch_size
+        self._mini_batch_passes = mini_batch_passes
+        self._reviewer_names = reviewer_names
+        self._cluster_range = sorted(cluster_range)
+        self._num_workers = num_workers
+        self._warm_start = warm_start
+        self._random_state = random_state
+
+        self.inertias: Dict[int, float] = {}
+        self.number_of_clusters: Optional[int] = None
+        self.labels: Optional[np.ndarray] = None
+        self.centroids: Optional[np.ndarray] = None
+        self._fitted: Dict[int, Tuple[float, np.ndarray, np.ndarray]] = {}
+
+    def fit(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fits k-means for every number of clusters in the range and chooses the number of clusters
+        at the elbow of the inertias.
+
+        Returns:
+            The cluster of each reviewer and the centroids of the clusters.
+        """
+        if self._warm_start:
+            fitted = self._fit_warm_started()
+        elif self._num_workers > 1:
+            # A memory mapped file is opened by each worker rather than copied to it.
+            worker_embeddings = self._embeddings_location or self._reviewer_embeddings
+            number_of_fits = len(self._cluster_range)
+            with ProcessPoolExecutor(max_workers=self._num_workers,
+                                     initializer=_set_worker_embeddings,
+                                     initargs=(worker_embeddings,)) as executor:
+                fitted = list(executor.map(_fit_worker_kmeans,
+                                           self._cluster_range,
+                                           [self._random_state] * number_of_fits,
+                                           [self._batch_size] * number_of_fits,
+                                           [self._mini_batch_passes] * number_of_fits))
+        else:
+            fitted = [_fit_kmeans(self._reviewer_embeddings, number_of_clusters, self._random_state,
+                                  batch_size=self._batch_size, mini_batch_passes=self._mini_batch_passes)
+                      for number_of_clusters in self._cluster_range]
+
+        self._fitted = {number_of_clusters: result
+                        for number_of_clusters, result in zip(self._cluster_range, fitted)}
+        self.inertias = {number_of_clusters: inertia
+                         for number_of_clusters, (inertia, _, _) in self._fitted.items()}
+        self.number_of_clusters = _find_elbow(np.array(self._cluster_range),
+                                              np.array([self.inertias[k] for k in self._cluster_range]))
+        _, self.labels, self.centroids = self._fitted[self.number_of_clusters]
+        return self.labels, self.centroids
+
+    def get_clusters(self, number_of_clusters: Optional[int] = None) -> Dict[str, int]:
+        """
+        Gets the cluster of each reviewer by their name.
+
+        Args:
+            number_of_clusters: The number of clusters to use, defaults to the one at the elbow.
+
+        Returns:
+            The cluster of each reviewer.
+        """
+        assert self._reviewer_names is not None, "The reviewer names were not given."
+        assert self._fitted, "The clusters have not been fitted."
+        _, labels, _ = self._fitted[number_of_clusters or self.number_of_clusters]
+        return dict(zip(self._reviewer_names, labels.tolist()))
+
+    def assign(self, reviewer_embeddings: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """
+        Assigns reviewers to the nearest of the fitted centroids without refitting, for example
+        new reviewers.
+
+        Args:
+            reviewer_embeddings: The (n, d) embeddings of the reviewers, this can be memory mapped.
+            batch_size: The number of embeddings to assign at a time.
+
+        Returns:
+            The cluster of each reviewer.
+        """
+        assert self.centroids is not None, "The clusters have not been fitted."
+        labels, _ = _nearest_centroids(reviewer_embeddings, self.centroids, batch_size)
+        return labels
+
+    def _fit_warm_started(self) -> List[Tuple[float, np.ndarray, np.ndarray]]:
+        """
+        Fits each number of clusters starting from the centroids of the previous number of
+        clusters, with the extra centroids chosen in the same way as k-means++.
+
+        Returns:
+            The inertia, labels and centroids of each number of clusters.
+        """
+        random_generator = np.random.default_rng(self._random_state)
+        fitted = []
+        centroids = None
+        for number_of_clusters in self._cluster_range:
+            if centroids is None:
+                initial_centroids = "k-means++"
+            else:
+                initial_centroids = _add_centroids(self._reviewer_embeddings, centroids,
+                                                   number_of_clusters - len(centroids), random_generator,
+                                                   batch_size=self._batch_size or len(self._reviewer_embeddings))
+            result = _fit_kmeans(self._reviewer_embeddings, number_of_clusters, self._random_state,
+                                 initial_centroids=initial_centroids,
+                                 batch_size=self._batch_size,
+                                 mini_batch_passes=self._mini_batch_passes)
+            centroids = result[2]
+            fitted.append(result)
+        return fitted
+
+
+def _set_worker_embeddings(reviewer_embeddings: Union[np.ndarray, Path]):
+    global _worker_embeddings
+    if isinstance(reviewer_embeddings, Path):
+        reviewer_embeddings = np.load(reviewer_embeddings, mmap_mode="r")
+    _worker_embeddings = reviewer_embeddings
+
+
+def _fit_worker_kmeans(number_of_clusters: int,
+                       random_state: Optional[int],
+                       batch_size: Optional[int],
+                       mini_batch_passes: int) -> Tuple[float, np.ndarray, np.ndarray]:
+    from threadpoolctl import threadpool_limits
+
+    # Each process uses a single thread so the workers don't compete for the cores.
+    with threadpool_limits(limits=1):
+        return _fit_kmeans(_worker_embeddings, number_of_clusters, random_state,
+                           batch_size=batch_size, mini_batch_passes=mini_batch_passes)
+
+
+def _fit_kmeans(reviewer_embeddings: np.ndarray,
+                number_of_clusters: int,
+                random_state: Optional[int],
+                initial_centroids="k-means++",
+                batch_size: Optional[int] = None,
+                mini_batch_passes: int = 1) -> Tuple[float, np.ndarray, np.ndarray]:
+    """
+    Fits k-means with a number of clusters.
+
+    Args:
+        reviewer_embeddings: The (n, d) embeddings to cluster.
+        number_of_clusters: The number of clusters.
+        random_state: The seed of the k-means initialisation.
+        initial_centroids: "k-means++" or the initial centroids.
+        batch_size: If set mini-batch k-means is used, reading this many embeddings at a time.
+        mini_batch_passes: The number of passes over the embeddings for mini-batch k-means.
+
+    Returns:
+        The inertia, the cluster of each embedding and the centroids.
+    """
+    from sklearn.cluster import KMeans
+
+    if batch_size is not None:
+        return _fit_mini_batch_kmeans(reviewer_embeddings, number_of_clusters, random_state,
+                                      initial_centroids, batch_size, mini_batch_passes)
+    kmeans = KMeans(n_clusters=number_of_clusters,
+                    init=initial_centroids,
+                    n_init=1,
+                    random_state=random_state)
+    kmeans.fit(reviewer_embeddings)
+    return float(kmeans.inertia_), kmeans.labels_, kmeans.cluster_centers_
+
+
+def _fit_mini_batch_kmeans(reviewer_embeddings: np.ndarray,
+                           number_of_clusters: int,
+                           random_state: Optional[int],
+                           initial_centroids,
+                           batch_size: int,
+                           passes: int) -> Tuple[float, np.ndarray, np.ndarray]:
+    """
+    Fits mini-batch k-means reading the embeddings in chunks, so memory mapped embeddings are
+    never fully loaded.
+
+    Returns:
+        The inertia, the cluster of each embedding and the centroids.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    # The first chunk initialises the centroids, so it needs at least one embedding per cluster.
+    batch_size = max(batch_size, number_of_clusters)
+    kmeans = MiniBatchKMeans(n_clusters=number_of_clusters,
+                             init=initial_centroids,
+                             n_init=1,
+                             batch_size=batch_size,
+                             random_state=random_state)
+    for _ in range(passes):
+        for start in range(0, len(reviewer_embeddings), batch_size):
+            kmeans.partial_fit(np.asarray(reviewer_embeddings[start:start + batch_size]))
+    labels, squared_distances = _nearest_centroids(reviewer_embeddings, kmeans.cluster_centers_, batch_size)
+    return float(squared_distances.sum()), labels, kmeans.cluster_centers_
+
+
+def _nearest_centroids(embeddings: np.ndarray,
+                       centroids: np.ndarray,
+                       batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the nearest centroid of each embedding, batch_size embeddings at a time.
+
+    Returns:
+        The index of the nearest centroid of each embedding and the squared distance to it.
     """
+    labels = np.empty(len(embeddings), dtype=np.int32)
+    nearest_squared_distances = np.empty(len(embeddings), dtype=np.float64)
+    for start in range(0, len(embeddings), batch_size):
+        squared_distances = _squared_distances(np.asarray(embeddings[start:start + batch_size]), centroids)
+        labels[start:start + batch_size] = squared_distances.argmin(axis=1)
+        nearest_squared_distances[start:start + batch_size] = squared_distances.min(axis=1)
+    return labels, nearest_squared_distances
 
-    def __init__(self, training_file):
-        pass
+
+def _add_centroids(reviewer_embeddings: np.ndarray,
+                   centroids: np.ndarray,
+                   number_to_add: int,
+                   random_generator: np.random.Generator,
+                   batch_size: int) -> np.ndarray:
+    """
+    Adds centroids to the existing centroids, each chosen with a probability proportional to
+    its squared distance to the nearest centroid as in k-means++.
+
+    Returns:
+        The existing centroids followed by the new centroids.
+    """
+    for _ in range(number_to_add):
+        _, squared_distances = _nearest_centroids(reviewer_embeddings, centroids, batch_size)
+        new_centroid = random_generator.choice(len(reviewer_embeddings),
+                                               p=squared_distances / squared_distances.sum())
+        centroids = np.vstack([centroids, reviewer_embeddings[new_centroid]])
+    return centroids
+
+
+def _squared_distances(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        The (n, k) squared euclidean distances between each embedding and each centroid.
+    """
+    squared_distances = (np.einsum("ij,ij->i", embeddings, embeddings)[:, None]
+                         - 2 * embeddings @ centroids.T
+                         + np.einsum("ij,ij->i", centroids, centroids)[None, :])
+    return np.maximum(squared_distances, 0)
+
+
+def _find_elbow(numbers_of_clusters: np.ndarray, inertias: np.ndarray) -> int:
+    """
+    Finds the elbow of the inertia curve as the point furthest from the straight line between
+    the first and the last point, after scaling both axes to between 0 and 1.
+
+    Args:
+        numbers_of_clusters: The numbers of clusters in ascending order.
+        inertias: The inertia of each number of clusters.
+
+    Returns:
+        The number of clusters at the elbow.
+    """
+    if len(numbers_of_clusters) < 3:
+        return int(numbers_of_clusters[0])
+    x = (numbers_of_clusters - numbers_of_clusters[0]) / (numbers_of_clusters[-1] - numbers_of_clusters[0])
+    inertia_range = inertias[0] - inertias[-1]
+    y = (inertias[0] - inertias) / inertia_range if inertia_range > 0 else np.zeros_like(x)
+    # The line runs from (0, 0) to (1, 1), so the distance from it is proportional to y - x.
+    return int(numbers_of_clusters[np.argmax(y - x)])
@@ -0,0 +1,99 @@
+"""
+Expands the review times into the Year, Month and DayOfWeek fields
+"""
+from datetime import datetime, timezone as datetime_timezone, tzinfo
+from typing import Dict, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+# The timezone the dates are created in unless another is given, so the same file gives the
+# same dates on every machine.
+DEFAULT_TIMEZONE = "UTC"
+# The date fields, in the order they are added to a review, and the prefix of their entities.
+DATE_FIELD_PREFIXES = {"Year": "yr_", "DayOfWeek": "wk_", "Month": "mon_"}
+
+_SECONDS_PER_DAY = 86400
+
+
+def expand_times(times: np.ndarray,
+                 timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Converts the whole time column at once with NumPy datetime64 arithmetic.
+
+    Args:
+        times: The seconds since the epoch of each review.
+        timezone: The name of the timezone, a tzinfo, or None to use the local timezone of the
+            machine.
+
+    Returns:
+        The year, the month (1-12) and the day of the week (Monday is 0) of each review.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    if timezone != "UTC":
+        times = times + _get_utc_offsets(times, _get_tzinfo(timezone))
+    date_times = times.astype("datetime64[s]")
+    year = date_times.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = date_times.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    # The epoch was a Thursday.
+    day_of_week = (date_times.astype("datetime64[D]").astype(np.int64) + 3) % 7
+    return year, month, day_of_week
+
+
+def create_date_columns(times: np.ndarray,
+                        timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE
+                        ) -> Dict[str, Tuple[np.ndarray, List[str]]]:
+    """
+    Creates the integer coded Year, Month and DayOfWeek columns, the entity name of each
+    distinct value is only created once.
+
+    Args:
+        times: The seconds since the epoch of each review.
+        timezone: The name of the timezone, a tzinfo, or None to use the local timezone.
+
+    Returns:
+        The codes of each review and the entity names the codes refer to, for each date field.
+    """
+    year, month, day_of_week = expand_times(times, timezone)
+    field_values = {"Year": year, "DayOfWeek": day_of_week, "Month": month}
+    date_columns = {}
+    for field, prefix in DATE_FIELD_PREFIXES.items():
+        distinct_values, codes = np.unique(field_values[field], return_inverse=True)
+        date_columns[field] = (codes.reshape(-1), [prefix + str(value) for value in distinct_values.tolist()])
+    return date_columns
+
+
+def _get_tzinfo(timezone: Union[str, tzinfo, None]) -> Optional[tzinfo]:
+    if isinstance(timezone, str):
+        return ZoneInfo(timezone)
+    return timezone
+
+
+def _get_utc_offset(time: int, timezone: Optional[tzinfo]) -> int:
+    """
+    Returns:
+        The seconds the timezone is ahead of UTC at the time, None is the local timezone.
+    """
+    local_time = datetime.fromtimestamp(time, datetime_timezone.utc).astimezone(timezone)
+    return int(local_time.utcoffset().total_seconds())
+
+
+def _get_utc_offsets(times: np.ndarray, timezone: Optional[tzinfo]) -> np.ndarray:
+    """
+    Finds the offset from UTC of each time. The offset is looked up at the start and end of
+    each distinct day, only the times on days where these differ, because of a daylight saving
+    change, are looked up individually.
+
+    Returns:
+        The seconds to add to each time to give the local time.
+    """
+    days, day_of_time = np.unique(times // _SECONDS_PER_DAY, return_inverse=True)
+    day_of_time = day_of_time.reshape(-1)
+    day_starts = (days * _SECONDS_PER_DAY).tolist()
+    start_offsets = np.array([_get_utc_offset(start, timezone) for start in day_starts], dtype=np.int64)
+    end_offsets = np.array([_get_utc_offset(start + _SECONDS_PER_DAY - 1, timezone) for start in day_starts],
+                           dtype=np.int64)
+    offsets = start_offsets[day_of_time]
+    changing = (start_offsets != end_offsets)[day_of_time]
+    offsets[changing] = [_get_utc_offset(time, timezone) for time in times[changing].tolist()]
+    return offsets
@@ -0,0 +1,175 @@
+"""
+Extracts the reviewer embeddings from a trained model
+"""
+import csv
+import gzip
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from clustering.rate_beer_loader import REVIEWER_PREFIX
+
+_EMBEDDINGS_FILE = "reviewer_embeddings.npy"
+_NAMES_FILE = "reviewer_names.txt"
+# The names of the files and directories written by PyKEEN's `save_to_directory`.
+_TRAINED_MODEL_FILE = "trained_model.pkl"
+_TRAINING_TRIPLES_DIRECTORY = "training_triples"
+_ENTITY_TO_ID_FILE = "entity_to_id.tsv.gz"
+
+
+def find_reviewer_entities(triples_factory, prefix: str = REVIEWER_PREFIX) -> Tuple[List[str], np.ndarray]:
+    """
+    Finds the reviewers from the triples, without needing the rate beer file. The reviewers are
+    the tails of the `profileName` triples, so no other entity is taken for a reviewer however
+    it is named.
+
+    Args:
+        triples_factory: The triples factory of the trained model.
+        prefix: The prefix the loader gave the reviewer entities, removed from their names.
+
+    Returns:
+        The reviewer names, without the prefix, and their entity ids in ascending id order.
+    """
+    mapped_triples = np.asarray(triples_factory.mapped_triples)
+    profile_name = triples_factory.relation_to_id["profileName"]
+    reviewer_ids = np.unique(mapped_triples[mapped_triples[:, 1] == profile_name, 2]).astype(np.int64)
+    id_to_entity = {entity_id: entity for entity, entity_id in triples_factory.entity_to_id.items()}
+    return [id_to_entity[entity_id][len(prefix):] for entity_id in reviewer_ids.tolist()], reviewer_ids
+
+
+def read_entity_to_id(location: Union[Path, str]) -> Dict[str, int]:
+    """
+    Reads the entity to id mapping saved with a model, without loading the triples.
+
+    Args:
+        location: A directory saved by PyKEEN's `save_to_directory`, its `training_triples`
+            directory, or a PyKEEN checkpoint.
+
+    Returns:
+        The entity to id mapping.
+    """
+    location = Path(location)
+    if location.is_file():
+        import torch
+
+        return torch.load(location, weights_only=False)["entity_to_id_dict"]
+    if location.joinpath(_TRAINING_TRIPLES_DIRECTORY).is_dir():
+        location = location.joinpath(_TRAINING_TRIPLES_DIRECTORY)
+    with gzip.open(location.joinpath(_ENTITY_TO_ID_FILE), mode="rt", encoding="utf-8", newline="") as entity_file:
+        rows = csv.reader(entity_file, delimiter="\t")
+        next(rows)
+        return {label: int(entity_id) for entity_id, label in rows}
+
+
+def read_training_triples(pipeline_directory: Union[Path, str]):
+    """
+    Reads the training triples saved with a model.
+
+    Args:
+        pipeline_directory: A directory saved by PyKEEN's `save_to_directory` or
+            `TrainedRateBeerModel.save`.
+
+    Returns:
+        The triples factory of the training triples.
+    """
+    from pykeen.triples import TriplesFactory
+
+    return TriplesFactory.from_path_binary(Path(pipeline_directory).joinpath(_TRAINING_TRIPLES_DIRECTORY))
+
+
+def extract_reviewer_embeddings(model,
+                                triples_factory,
+                                output_directory: Union[Path, str],
+                                batch_size: int = 65536,
+                                prefix: str = REVIEWER_PREFIX) -> Tuple[np.memmap, List[str]]:
+    """
+    Writes the embeddings of the reviewers to a memory mapped `.npy` file along with the names
+    of the reviewers in the same order. The embeddings are taken batch_size at a time so only
+    a batch is ever held as a tensor.
+
+    Args:
+        model: The trained PyKEEN model.
+        triples_factory: The triples factory of the model, the reviewers are found from its
+            triples, see `find_reviewer_entities`.
+        output_directory: The directory to write `reviewer_embeddings.npy` and
+            `reviewer_names.txt` to.
+        batch_size: The number of embeddings to take at a time.
+        prefix: The prefix of the reviewer entities.
+
+    Returns:
+        The memory mapped embeddings and the reviewer names.
+    """
+    import torch
+
+    reviewer_names, reviewer_ids = find_reviewer_entities(triples_factory, prefix=prefix)
+    assert len(reviewer_ids), "There are no reviewers in the entities."
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    entity_representations = model.entity_representations[0]
+    embeddings = None
+    with torch.no_grad():
+        for start in range(0, len(reviewer_ids), batch_size):
+            indices = torch.as_tensor(reviewer_ids[start:start + batch_size], device=model.device)
+            batch = entity_representations(indices=indices).cpu().numpy()
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(output_directory.joinpath(_EMBEDDINGS_FILE), mode="w+",
+                                                       dtype=batch.dtype,
+                                                       shape=(len(reviewer_ids),) + batch.shape[1:])
+            embeddings[start:start + len(batch)] = batch
+    embeddings.flush()
+    _write_names(output_directory.joinpath(_NAMES_FILE), reviewer_names)
+    return embeddings, reviewer_names
+
+
+def extract_reviewer_embeddings_from_directory(pipeline_directory: Union[Path, str],
+                                               output_directory: Union[Path, str],
+                                               batch_size: int = 65536) -> Tuple[np.memmap, List[str]]:
+    """
+    Writes the reviewer embeddings of a model saved by PyKEEN's `save_to_directory`.
+
+    Args:
+        pipeline_directory: The directory the pipeline result was saved to.
+        output_directory: The directory to write the embeddings and names to.
+        batch_size: The number of embeddings to take at a time.
+
+    Returns:
+        The memory mapped embeddings and the reviewer names.
+    """
+    import torch
+
+    pipeline_directory = Path(pipeline_directory)
+    model = torch.load(pipeline_directory.joinpath(_TRAINED_MODEL_FILE), weights_only=False)
+    return extract_reviewer_embeddings(model, read_training_triples(pipeline_directory), output_directory,
+                                       batch_size=batch_size)
+
+
+def get_embeddings_location(directory: Union[Path, str]) -> Path:
+    """
+    Returns:
+        The location of the `.npy` file of the embeddings written to the directory.
+    """
+    return Path(directory).joinpath(_EMBEDDINGS_FILE)
+
+
+def load_reviewer_embeddings(directory: Union[Path, str]) -> Tuple[np.memmap, List[str]]:
+    """
+    Loads the reviewer embeddings written by `extract_reviewer_embeddings`.
+
+    Args:
+        directory: The directory the embeddings were written to.
+
+    Returns:
+        The memory mapped embeddings and the reviewer names.
+    """
+    directory = Path(directory)
+    embeddings = np.load(get_embeddings_location(directory), mmap_mode="r")
+    reviewer_names = directory.joinpath(_NAMES_FILE).read_bytes().decode("utf-8").split("\n")[:-1]
+    return embeddings, reviewer_names
+
+
+def _write_names(location: Path, names: List[str]):
+    with location.open("w", encoding="utf-8", newline="") as names_file:
+        for name in names:
+            names_file.write(name + "\n")
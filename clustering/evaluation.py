@@ -0,0 +1,211 @@
+"""
+Cheaper rank-based evaluation for graphs with many entities, this is kept apart from the loaders
+as it needs PyKEEN
+"""
+import logging
+import timeit
+from typing import Any, Collection, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import torch
+from pykeen.evaluation import RankBasedEvaluator
+from pykeen.evaluation.evaluator import prepare_filter_triples
+from pykeen.triples import CoreTriplesFactory
+
+logger = logging.getLogger(__name__)
+
+_TARGET_COLUMNS = {"head": 0, "tail": 2}
+_DEFAULT_BATCH_SIZE = 1024
+# The most triples scored at once, bounding the memory of relations with many candidates.
+_MAX_SCORED_TRIPLES = 2 ** 20
+
+
+class TypeRestrictedEvaluator(RankBasedEvaluator):
+    """
+    Ranks the true entity of each triple against the entities of the right type rather than
+    against every entity. The type of a relation's heads and tails is taken from the known
+    triples: the candidate tails of `profileName` are the reviewer entities, the candidate heads
+    of `pre` are the reviews, and so on. As every review is an entity, ranking a reviewer
+    against the reviews only measures how far the reviews are from being mistaken for one.
+
+    Only the candidates are scored. With `num_negatives` each triple is ranked against that many
+    candidates drawn, with replacement, from the candidates of its relation, so the cost of the
+    evaluation no longer grows with the number of reviews. The draws restart with every
+    evaluation, so an early stopper compares each evaluation against the same negatives.
+
+    Unlike PyKEEN's `SampledRankBasedEvaluator`, which scores every entity before picking out
+    the negatives, the negatives aren't fixed to one evaluation factory, so the same evaluator
+    can be used by the early stopper on the validation triples and by the pipeline on the
+    testing triples. The evaluation is always filtered.
+
+    Only PyKEEN's public evaluator interface is used: `evaluate` is overridden with the same
+    arguments and the scores of the candidates are ranked with `process_scores_` and
+    `finalize`.
+    """
+
+    def __init__(self,
+                 known_triples: Union[torch.Tensor, Sequence[torch.Tensor]],
+                 num_negatives: Optional[int] = None,
+                 seed: int = 0,
+                 **kwargs):
+        """
+        Args:
+            known_triples: The mapped triples the types of each relation's heads and tails are
+                taken from, usually those of the training, validation and testing factories.
+            num_negatives: The number of candidates each triple is ranked against, None ranks it
+                against every candidate of its relation.
+            seed: The seed of the drawn candidates.
+            **kwargs: The arguments of PyKEEN's `RankBasedEvaluator`.
+        """
+        kwargs["filtered"] = True
+        super().__init__(**kwargs)
+        if not isinstance(known_triples, torch.Tensor):
+            known_triples = torch.cat([torch.as_tensor(triples) for triples in known_triples])
+        self.num_negatives = num_negatives
+        self._seed = seed
+        self._generator = torch.Generator().manual_seed(seed)
+        self._candidates = _find_candidates(known_triples)
+
+    def get_candidates(self, relation: int, target: str) -> torch.Tensor:
+        """
+        Args:
+            relation: The id of the relation.
+            target: "head" or "tail".
+
+        Returns:
+            The ids of the entities seen as the target of the relation.
+        """
+        return self._candidates.get((relation, target), torch.empty(0, dtype=torch.long))
+
+    def finalize(self):
+        result = super().finalize()
+        self._generator.manual_seed(self._seed)
+        return result
+
+    def evaluate(self,
+                 model,
+                 mapped_triples: torch.Tensor,
+                 batch_size: Optional[int] = None,
+                 slice_size: Optional[int] = None,
+                 device: Optional[torch.device] = None,
+                 use_tqdm: bool = True,
+                 tqdm_kwargs: Optional[Mapping[str, Any]] = None,
+                 restrict_entities_to: Optional[Collection[int]] = None,
+                 restrict_relations_to: Optional[Collection[int]] = None,
+                 do_time_consuming_checks: bool = True,
+                 additional_filter_triples: Union[None, torch.Tensor, List[torch.Tensor]] = None,
+                 pre_filtered_triples: bool = True,
+                 targets: Collection[str] = ("head", "tail")):
+        """
+        Scores each triple and its candidates only, where PyKEEN's evaluation scores every entity
+        and then picks out the candidates. The arguments are those of PyKEEN's `evaluate`, the
+        entities and relations can't be restricted as the candidates already restrict them and
+        `slice_size` isn't needed as only the candidates are scored.
+
+        Returns:
+            The rank-based metric results.
+        """
+        assert restrict_entities_to is None and restrict_relations_to is None, \
+            "The candidates of each relation already restrict the entities."
+        start = timeit.default_timer()
+        device = device or model.device
+        model.eval()
+        model = model.to(device)
+        mapped_triples = mapped_triples.cpu()
+        filter_triples = prepare_filter_triples(mapped_triples=mapped_triples,
+                                                additional_filter_triples=additional_filter_triples)
+        known_keys = _get_triple_keys(filter_triples.cpu(), model.num_entities, model.num_relations)
+        batch_size = batch_size or _DEFAULT_BATCH_SIZE
+        with torch.inference_mode():
+            for target in targets:
+                column = _TARGET_COLUMNS[target]
+                for relation in torch.unique(mapped_triples[:, 1]).tolist():
+                    relation_triples = mapped_triples[mapped_triples[:, 1] == relation]
+                    candidates = self.get_candidates(relation, target)
+                    width = max(min(len(candidates), self.num_negatives or len(candidates)), 1)
+                    rows = max(1, min(batch_size, _MAX_SCORED_TRIPLES // width))
+                    for batch_start in range(0, len(relation_triples), rows):
+                        hrt_batch = relation_triples[batch_start:batch_start + rows]
+                        self._process_batch(model, hrt_batch, target, column, candidates, known_keys, device)
+        result = self.finalize()
+        logger.info("Evaluation took %.2fs seconds", timeit.default_timer() - start)
+        return result
+
+    def _process_batch(self,
+                       model,
+                       hrt_batch: torch.Tensor,
+                       target: str,
+                       column: int,
+                       candidates: torch.Tensor,
+                       known_keys: torch.Tensor,
+                       device: torch.device):
+        """
+        Ranks the true entity of each triple of a single relation against the candidates.
+        """
+        if self.num_negatives is not None and len(candidates) > self.num_negatives:
+            negatives = candidates[torch.randint(len(candidates), (len(hrt_batch), self.num_negatives),
+                                                 generator=self._generator)]
+        else:
+            negatives = candidates
+        expanded_negatives = negatives.expand(len(hrt_batch), -1)
+        corrupted = hrt_batch.unsqueeze(dim=1).repeat(1, expanded_negatives.shape[1], 1)
+        corrupted[:, :, column] = expanded_negatives
+        # The true entity and the other known triples aren't counted, NaN scores are ignored by the ranking.
+        ignored = (expanded_negatives == hrt_batch[:, column].unsqueeze(dim=-1)) \
+            | torch.isin(_get_triple_keys(corrupted, model.num_entities, model.num_relations), known_keys)
+        hrt_batch_on_device = hrt_batch.to(device)
+        true_scores = model.score_hrt(hrt_batch_on_device, mode=self.mode)
+        # Candidates shared by the whole batch are scored without repeating them for every triple.
+        if target == "head":
+            negative_scores = model.score_h(hrt_batch_on_device[:, 1:], mode=self.mode, heads=negatives.to(device))
+        else:
+            negative_scores = model.score_t(hrt_batch_on_device[:, :2], mode=self.mode, tails=negatives.to(device))
+        negative_scores = negative_scores.masked_fill(ignored.to(device), float("nan"))
+        self.process_scores_(hrt_batch=hrt_batch,
+                             target=target,
+                             scores=torch.cat([true_scores, negative_scores], dim=-1),
+                             true_scores=true_scores)
+
+
+def subsample_triples(factory: CoreTriplesFactory,
+                      num_triples: Optional[int],
+                      random_seed: Optional[int] = None) -> CoreTriplesFactory:
+    """
+    Takes a random subsample of the triples of a factory, keeping its entities and relations.
+
+    Args:
+        factory: The triples to subsample.
+        num_triples: The number of triples to keep, None or more than the factory has keeps them all.
+        random_seed: The seed of the subsample.
+
+    Returns:
+        The factory of the kept triples.
+    """
+    if num_triples is None or num_triples >= factory.num_triples:
+        return factory
+    generator = torch.Generator()
+    if random_seed is not None:
+        generator.manual_seed(random_seed)
+    kept = torch.randperm(factory.num_triples, generator=generator)[:num_triples]
+    logger.info("Subsampled %d of %d triples.", num_triples, factory.num_triples)
+    return factory.clone_and_exchange_triples(factory.mapped_triples[kept])
+
+
+def _get_triple_keys(triples: torch.Tensor, num_entities: int, num_relations: int) -> torch.Tensor:
+    """
+    Returns:
+        A single integer for each (..., 3) triple, so triples can be looked up with `torch.isin`.
+    """
+    return (triples[..., 0] * num_relations + triples[..., 1]) * num_entities + triples[..., 2]
+
+
+def _find_candidates(known_triples: torch.Tensor) -> Dict[Tuple[int, str], torch.Tensor]:
+    """
+    Returns:
+        The ids of the entities seen as the head and as the tail of each relation.
+    """
+    candidates = {}
+    for relation in torch.unique(known_triples[:, 1]).tolist():
+        relation_triples = known_triples[known_triples[:, 1] == relation]
+        for target, column in _TARGET_COLUMNS.items():
+            candidates[relation, target] = torch.unique(relation_triples[:, column])
+    return candidates
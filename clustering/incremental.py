@@ -0,0 +1,191 @@
+"""
+Appends new reviews to the graph without rebuilding it
+"""
+from array import array
+from datetime import tzinfo
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from clustering.dates import DEFAULT_TIMEZONE
+from clustering.preprocessing_cache import PreprocessingCache
+from clustering.rate_beer_loader import (RateBeerLoader, RateBeerLoaderPykeen, REVIEWER_PREFIX,
+                                         _create_review_triples, _create_triples_factory,
+                                         _get_triple_relationship_to_id)
+from clustering.record_formats import RecordFormat
+
+# The graph is kept apart from the loaders' cache so a loader's size limit can't evict it.
+_DEFAULT_CACHE_DIRECTORY = "rate_beer_incremental"
+
+
+class IncrementalRateBeerGraph:
+    """
+    Keeps the mapped triples of the rate beer reviews in a `PreprocessingCache` entry along with
+    the most recent review of each reviewer, so new reviews only need their own triples created.
+
+    Reviews are given ids in the order they are added, and within each batch of reviews in time
+    order, so the ids of entities never change and a model trained on the graph can be
+    continued. Each new review is connected by a "pre"/"suc" relationship to the reviewer's
+    latest review, even if that review was added in an earlier batch.
+
+    The new reviews are read with the same `timezone` and `record_format` as a loader would, so
+    give the options of the loader the graph was seeded from, see `from_loader`. The graph's
+    entry is never evicted from the cache.
+    """
+
+    def __init__(self, cache_directory: Union[Path, str] = _DEFAULT_CACHE_DIRECTORY,
+                 graph_name: str = "incremental_rate_beer",
+                 timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE,
+                 record_format: Optional[RecordFormat] = None):
+        self._preprocessing_cache = PreprocessingCache(Path(cache_directory).absolute())
+        self._graph_name = graph_name
+        self._timezone = timezone
+        self._record_format = record_format
+
+        saved = self._preprocessing_cache.load(graph_name)
+        if saved is None:
+            self.mapped_triples = np.empty((0, 3), dtype=np.int64)
+            self.entity_to_id: Dict[str, int] = {}
+            self.relation_to_id = _get_triple_relationship_to_id()
+            self._reviewers_latest_review: Dict[str, List[int]] = {}
+            self._next_review_id = 0
+        else:
+            self.mapped_triples, self.entity_to_id, self.relation_to_id = saved
+            metadata = self._preprocessing_cache.load_metadata(graph_name)
+            self._reviewers_latest_review = metadata["reviewers_latest_review"]
+            self._next_review_id = metadata["next_review_id"]
+
+    def __len__(self):
+        return self._next_review_id
+
+    @classmethod
+    def from_loader(cls,
+                    loader: RateBeerLoaderPykeen,
+                    cache_directory: Union[Path, str] = _DEFAULT_CACHE_DIRECTORY,
+                    graph_name: str = "incremental_rate_beer") -> "IncrementalRateBeerGraph":
+        """
+        Starts the graph from the triples factory a loader created or loaded from its cache, so
+        the reviews already in it aren't parsed again. The latest review of each reviewer is
+        the one with the highest id, as the loader numbers the reviews in time order, and its
+        time isn't known. The graph is saved, replacing any graph of the same name.
+
+        Args:
+            loader: The loader whose factory to extend, new reviews are read with its timezone
+                and record format.
+            cache_directory: The directory to keep the graph in.
+            graph_name: The name of the graph's entry.
+
+        Returns:
+            The graph.
+        """
+        factory = loader.get_rate_beer()
+        graph = cls(cache_directory, graph_name, timezone=loader._timezone, record_format=loader._record_format)
+        graph.mapped_triples = np.asarray(factory.mapped_triples.numpy(), dtype=np.int64)
+        graph.entity_to_id = dict(factory.entity_to_id)
+        graph.relation_to_id = dict(factory.relation_to_id)
+
+        id_to_entity = {entity_id: entity for entity, entity_id in graph.entity_to_id.items()}
+        reviewer_triples = graph.mapped_triples[graph.mapped_triples[:, 1] == graph.relation_to_id["profileName"]]
+        graph._reviewers_latest_review = {}
+        for review, reviewer in reviewer_triples[:, [0, 2]].tolist():
+            review_id = int(id_to_entity[review])
+            name = id_to_entity[reviewer][len(REVIEWER_PREFIX):]
+            latest_review = graph._reviewers_latest_review.get(name)
+            if latest_review is None or latest_review[0] < review_id:
+                graph._reviewers_latest_review[name] = [review_id, None]
+        graph._next_review_id = max((latest for latest, _ in graph._reviewers_latest_review.values()),
+                                    default=-1) + 1
+        graph._save()
+        return graph
+
+    def add_reviews(self, file_location: Union[Path, str], num_workers: int = 1) -> np.ndarray:
+        """
+        Adds the reviews in a rate beer file to the graph and saves it.
+
+        Args:
+            file_location: A rate beer file of only the new reviews.
+            num_workers: The number of processes to parse the file with.
+
+        Returns:
+            The new mapped triples that were appended to the graph.
+        """
+        new_reviews = _read_new_reviews(file_location, num_workers, self._timezone, self._record_format)
+        known_entities = len(self.entity_to_id)
+        new_triples = array("q")
+        for review in new_reviews:
+            review_time = int(review["review"].pop("time"))
+            reviewer = review["review"]["profileName"]
+            review_id = str(self._next_review_id)
+            self._next_review_id += 1
+
+            head_rel_tail = _create_review_triples(review_id, review)
+            latest_review = self._reviewers_latest_review.get(reviewer)
+            if latest_review is not None:
+                previous_review_id = str(latest_review[0])
+                head_rel_tail.append([previous_review_id, "pre", review_id])
+                head_rel_tail.append([review_id, "suc", previous_review_id])
+            self._reviewers_latest_review[reviewer] = [int(review_id), review_time]
+
+            for head, relationship, tail in head_rel_tail:
+                # The style of a beer that is already in the graph is already in the triples.
+                if relationship == "style" and self.entity_to_id.get(head, known_entities) < known_entities:
+                    continue
+                new_triples.extend((self.entity_to_id.setdefault(head, len(self.entity_to_id)),
+                                    self.relation_to_id.setdefault(relationship, len(self.relation_to_id)),
+                                    self.entity_to_id.setdefault(tail, len(self.entity_to_id))))
+
+        appended = np.unique(np.frombuffer(new_triples, dtype=np.int64).reshape(-1, 3), axis=0)
+        self.mapped_triples = np.concatenate([self.mapped_triples, appended])
+        self._save()
+        return appended
+
+    def get_latest_review(self, reviewer: str) -> Tuple[str, Optional[int]]:
+        """
+        Args:
+            reviewer: The profile name of the reviewer.
+
+        Returns:
+            The entity of the reviewer's latest review and the time of that review, None for a
+            review of the factory the graph was seeded from.
+        """
+        review_id, review_time = self._reviewers_latest_review[reviewer]
+        return str(review_id), review_time
+
+    def get_reviewer_entity_ids(self, reviewers: List[str]) -> np.ndarray:
+        """
+        Returns:
+            The entity ids of the reviewers.
+        """
+        return np.array([self.entity_to_id[REVIEWER_PREFIX + reviewer] for reviewer in reviewers], dtype=np.int64)
+
+    def get_triples_factory(self):
+        """
+        Returns:
+            The TriplesFactory of the whole graph.
+        """
+        return _create_triples_factory(np.asarray(self.mapped_triples), self.entity_to_id, self.relation_to_id)
+
+    def _save(self):
+        self._preprocessing_cache.save(self._graph_name,
+                                       self.mapped_triples,
+                                       self.entity_to_id,
+                                       self.relation_to_id,
+                                       pinned=True,
+                                       reviewers_latest_review=self._reviewers_latest_review,
+                                       next_review_id=self._next_review_id)
+
+
+def _read_new_reviews(file_location: Union[Path, str],
+                      num_workers: int,
+                      timezone: Union[str, tzinfo, None],
+                      record_format: Optional[RecordFormat]) -> List[Dict[str, Dict[str, str]]]:
+    """
+    Reads the reviews of a file in time order, with reviews at the same time kept in file order.
+
+    Returns:
+        The reviews, still with their "time" field.
+    """
+    reviews = RateBeerLoader(file_location, num_workers=num_workers, timezone=timezone,
+                             record_format=record_format).read_reviews()
+    return sorted(reviews, key=lambda review: int(review["review"]["time"]))
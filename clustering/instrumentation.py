@@ -0,0 +1,103 @@
+"""
+Measures each stage of loading so a slow load can be traced to the stage responsible
+"""
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak resident set size is then not recorded.
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class StageMetrics:
+    """
+    The measurements of a single stage. The counts are only set by the stages they apply to,
+    the others are left as None.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.seconds: Optional[float] = None
+        self.peak_rss_bytes: Optional[int] = None
+        self.reviews: Optional[int] = None
+        self.reviewers: Optional[int] = None
+        self.entities: Optional[int] = None
+        self.triples: Optional[int] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            The measurements that were recorded, ready to be exported as JSON.
+        """
+        return {name: value for name, value in vars(self).items() if value is not None}
+
+    def __repr__(self):
+        measurements = ", ".join(f"{name}={value}" for name, value in self.as_dict().items() if name != "stage")
+        return f"StageMetrics({self.stage}: {measurements})"
+
+
+class PipelineInstrumentation:
+    """
+    Records the wall time, the peak resident set size and the counts of each stage that is run
+    within `measure`. Each stage is logged at the INFO level of the `clustering.instrumentation`
+    logger once it finishes and is passed to `callback`, if one is given, to export it.
+
+    The peak resident set size is of the whole process up to the end of the stage, so a stage
+    only raises it when it uses more memory than every stage before it. Worker processes are not
+    included.
+    """
+
+    def __init__(self, callback: Optional[Callable[[StageMetrics], None]] = None):
+        self._callback = callback
+        self.stages: List[StageMetrics] = []
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[StageMetrics]:
+        """
+        Measures the code run within the context. The counts of the stage are set on the yielded
+        metrics.
+
+        Args:
+            stage: The name of the stage.
+
+        Returns:
+            The metrics of the stage.
+        """
+        metrics = StageMetrics(stage)
+        start = time.perf_counter()
+        yield metrics
+        metrics.seconds = time.perf_counter() - start
+        metrics.peak_rss_bytes = get_peak_rss_bytes()
+        self.stages.append(metrics)
+        logger.info("%r", metrics)
+        if self._callback is not None:
+            self._callback(metrics)
+
+    def get_stage(self, stage: str) -> Optional[StageMetrics]:
+        """
+        Returns:
+            The metrics of the latest run of the stage, or None if it hasn't been run.
+        """
+        for metrics in reversed(self.stages):
+            if metrics.stage == stage:
+                return metrics
+        return None
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+    """
+    Returns:
+        The peak resident set size of this process in bytes, or None where it isn't available.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes while macOS reports bytes.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
@@ -0,0 +1,90 @@
+"""
+Batches the reviewer sequences for an LSTM, this is kept apart from the loaders as it needs PyTorch
+"""
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from clustering.sequences import PADDING_CODE, RateBeerSequences
+
+
+class RateBeerSequenceDataset(IterableDataset):
+    """
+    Yields padded batches of the reviewer sequences. Sequences of similar lengths are batched
+    together so little of each batch is padding: the sequences are shuffled, taken
+    `batch_size * bucket_batches` at a time, sorted by length within these and split into
+    batches, then the order of the batches is shuffled.
+
+    Sequences longer than `max_length` are split into several segments, so the reviewers with
+    thousands of reviews never set the padded length of a batch above `max_length`.
+
+    Each batch is the (batch, longest segment, feature) codes with 0 as padding, the length of
+    each segment and the index of its reviewer. Use it with `DataLoader(dataset, batch_size=None)`
+    as the batches are already made, with several workers each worker yields its share of them.
+    """
+
+    def __init__(self,
+                 sequences: RateBeerSequences,
+                 batch_size: int = 64,
+                 max_length: Optional[int] = 256,
+                 bucket_batches: int = 50,
+                 shuffle: bool = True,
+                 seed: int = 0):
+        super().__init__()
+        self._sequences = sequences
+        self._batch_size = batch_size
+        self._bucket_batches = bucket_batches
+        self._shuffle = shuffle
+        self._seed = seed
+        self._epoch = 0
+        self._starts, self._ends, self._reviewers = sequences.get_segments(max_length)
+
+    def __len__(self):
+        return -(-len(self._starts) // self._batch_size)
+
+    def set_epoch(self, epoch: int):
+        """
+        Sets the epoch so each epoch is shuffled differently but reproducibly.
+        """
+        self._epoch = epoch
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        for batch in self._create_batches()[worker_id::num_workers]:
+            yield self._pad_batch(batch)
+
+    def _create_batches(self):
+        """
+        Returns:
+            The segments of each batch, the same for every worker of an epoch.
+        """
+        lengths = self._ends - self._starts
+        rng = np.random.default_rng((self._seed, self._epoch))
+        order = rng.permutation(len(lengths)) if self._shuffle else np.arange(len(lengths))
+        bucket_size = self._batch_size * self._bucket_batches
+        batches = []
+        for bucket_start in range(0, len(order), bucket_size):
+            bucket = order[bucket_start:bucket_start + bucket_size]
+            # Stable so that sequences of the same length keep the shuffled order.
+            bucket = bucket[np.argsort(lengths[bucket], kind="stable")]
+            batches.extend(bucket[start:start + self._batch_size]
+                           for start in range(0, len(bucket), self._batch_size))
+        if self._shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def _pad_batch(self, batch: np.ndarray) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        starts = self._starts[batch]
+        lengths = self._ends[batch] - starts
+        features = self._sequences.features
+        padded = np.full((len(batch), lengths.max(), features.shape[1]), PADDING_CODE, dtype=np.int64)
+        # The position of every review of the batch within the flat features.
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = np.repeat(np.arange(len(batch)), lengths)
+        padded[rows, positions] = features[np.repeat(starts, lengths) + positions]
+        return (torch.from_numpy(padded),
+                torch.from_numpy(lengths.astype(np.int64)),
+                torch.from_numpy(self._reviewers[batch].astype(np.int64)))
@@ -0,0 +1,179 @@
+"""
+Caches the preprocessed triples so the rate beer file only needs to be parsed once
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union, Any, List
+
+import numpy as np
+
+_MAPPED_TRIPLES_FILE = "mapped_triples.npy"
+_ENTITY_LABELS_FILE = "entity_labels.txt"
+_RELATION_LABELS_FILE = "relation_labels.txt"
+_METADATA_FILE = "metadata.json"
+
+
+class PreprocessingCache:
+    """
+    A directory of preprocessed triples, each entry is keyed by a hash of the metadata of the
+    input file and the parameters used to create it, so stale entries are never used.
+
+    Each entry holds the mapped triples as a `.npy` file that is memory mapped on load and
+    the entity and relationship labels in id order. When `max_size_bytes` is set the least
+    recently used entries are removed once the cache grows past it, except for the entries
+    saved with `pinned=True` in their metadata.
+    """
+
+    def __init__(self, cache_directory: Union[Path, str], max_size_bytes: Optional[int] = None):
+        self._cache_directory = Path(cache_directory)
+        self._max_size_bytes = max_size_bytes
+
+    def get_key(self, file_location: Union[Path, str], **parameters: Any) -> str:
+        """
+        Creates the key of an entry from the input file's path, size and modification time and
+        the parameters the triples depend on.
+
+        Args:
+            file_location: The input file.
+            **parameters: The JSON serialisable parameters used to create the triples.
+
+        Returns:
+            The key of the entry.
+        """
+        file_location = Path(file_location).absolute()
+        file_stat = file_location.stat()
+        key_values = {"file_location": str(file_location),
+                      "file_size": file_stat.st_size,
+                      "file_modified": file_stat.st_mtime_ns,
+                      "parameters": parameters}
+        return hashlib.sha256(json.dumps(key_values, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def load(self, key: str) -> Optional[Tuple[np.ndarray, Dict[str, int], Dict[str, int]]]:
+        """
+        Loads an entry with the mapped triples memory mapped.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The mapped triples and the entity to id and relationship to id mappings, or None if
+            there is no entry with this key.
+        """
+        entry = self._cache_directory.joinpath(key)
+        if not entry.joinpath(_METADATA_FILE).exists():
+            return None
+        # Copy on write lets the triples be handed to torch without reading the whole file.
+        mapped_triples = np.load(entry.joinpath(_MAPPED_TRIPLES_FILE), mmap_mode="c")
+        entity_to_id = _read_labels(entry.joinpath(_ENTITY_LABELS_FILE))
+        relation_to_id = _read_labels(entry.joinpath(_RELATION_LABELS_FILE))
+        _mark_used(entry)
+        return mapped_triples, entity_to_id, relation_to_id
+
+    def load_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Loads the metadata kept with an entry.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The metadata, or None if there is no entry with this key.
+        """
+        metadata_location = self._cache_directory.joinpath(key, _METADATA_FILE)
+        if not metadata_location.exists():
+            return None
+        with metadata_location.open("r") as metadata_file:
+            return json.load(metadata_file)
+
+    def save(self,
+             key: str,
+             mapped_triples: np.ndarray,
+             entity_to_id: Dict[str, int],
+             relation_to_id: Dict[str, int],
+             **metadata: Any):
+        """
+        Saves an entry, replacing any existing entry with the same key, then removes the least
+        recently used entries if the cache is over its size limit.
+
+        Args:
+            key: The key of the entry.
+            mapped_triples: The (n, 3) ids of the <head, relationship, tail> triples.
+            entity_to_id: The entity to id mapping, the ids must be 0 to n - 1.
+            relation_to_id: The relationship to id mapping, the ids must be 0 to n - 1.
+            **metadata: Any JSON serialisable values to keep with the entry.
+        """
+        entry = self._cache_directory.joinpath(key)
+        # The entry is written under a temporary name so a partial entry is never loaded.
+        partial_entry = self._cache_directory.joinpath(key + ".partial")
+        shutil.rmtree(partial_entry, ignore_errors=True)
+        partial_entry.mkdir(parents=True)
+        np.save(partial_entry.joinpath(_MAPPED_TRIPLES_FILE), np.asarray(mapped_triples, dtype=np.int64))
+        _write_labels(partial_entry.joinpath(_ENTITY_LABELS_FILE), entity_to_id)
+        _write_labels(partial_entry.joinpath(_RELATION_LABELS_FILE), relation_to_id)
+        with partial_entry.joinpath(_METADATA_FILE).open("w") as metadata_file:
+            json.dump({"created": time.time(), **metadata}, metadata_file)
+        _mark_used(partial_entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        partial_entry.rename(entry)
+        self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        """
+        Removes the least recently used entries until the cache is within its size limit.
+
+        Args:
+            keep: The key of an entry to never remove.
+        """
+        if self._max_size_bytes is None:
+            return
+        entries: List[Tuple[int, int, Path]] = []
+        for entry in self._cache_directory.iterdir():
+            metadata_file = entry.joinpath(_METADATA_FILE)
+            if entry.name == keep or not metadata_file.exists():
+                continue
+            with metadata_file.open("r") as metadata:
+                if json.load(metadata).get("pinned", False):
+                    continue
+            entry_size = sum(file.stat().st_size for file in entry.iterdir())
+            entries.append((metadata_file.stat().st_mtime_ns, entry_size, entry))
+        kept_entry = self._cache_directory.joinpath(keep)
+        total_size = sum(file.stat().st_size for file in kept_entry.iterdir()) \
+            + sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry in sorted(entries):
+            if total_size <= self._max_size_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= entry_size
+
+
+def _mark_used(entry: Path):
+    """
+    Marks the entry as recently used for the eviction. The time is set explicitly as the file
+    system's own timestamps can be too coarse to order entries used in quick succession.
+    """
+    used = time.time_ns()
+    os.utime(entry.joinpath(_METADATA_FILE), ns=(used, used))
+
+
+def _write_labels(location: Path, label_to_id: Dict[str, int]):
+    """
+    Writes the labels one per line in the order of their ids.
+    """
+    labels = sorted(label_to_id, key=label_to_id.__getitem__)
+    assert [label_to_id[label] for label in labels] == list(range(len(labels))), \
+        "The ids must be 0 to n - 1."
+    with location.open("w", encoding="utf-8", newline="") as labels_file:
+        for label in labels:
+            labels_file.write(label + "\n")
+
+
+def _read_labels(location: Path) -> Dict[str, int]:
+    """
+    Reads the labels written by `_write_labels`.
+    """
+    labels = location.read_bytes().decode("utf-8").split("\n")[:-1]
+    return {label: i for i, label in enumerate(labels)}
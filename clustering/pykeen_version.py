@@ -1,8 +1,12 @@
 from pathlib import Path
-from typing import Union
+from typing import Union, Optional, Dict, Any, Sequence, Tuple, List
 
-from pykeen.pipeline import pipeline
-from clustering.rate_beer_loader import RateBeerLoader
+import numpy as np
+
+from clustering.rate_beer_loader import RateBeerLoaderPykeen, REVIEWER_PREFIX
+from clustering.training_config import CPUTrainingConfig
+
+_REVIEWER_EMBEDDINGS_DIRECTORY = "reviewer_embeddings"
 
 
 class RateBeerPykeen:
@@ -14,20 +18,347 @@ class RateBeerPykeen:
         2. Turn into triple sets as used by pykeen
         3. Create a pipeline
         4. Use the data to group the customers
+
+    Creating this class only keeps the configuration, the file is loaded and the model is
+    trained when `fit` is called.
+
+    The threads, batch size, slicing and seed of the training are given either by
+    `training_config` or, for the common settings, by the arguments of the same names.
+
+    Every review is an entity, so ranking each validation triple against every entity soon takes
+    longer than the training. `type_restricted_evaluation` ranks against the entities of the
+    right type, `num_evaluation_negatives` against a sample of those, and
+    `num_validation_triples` has the early stopper check a subsample of the validation triples.
     """
 
-    def __init__(self, file_location: Union[str, Path]):
+    def __init__(self,
+                 file_location: Union[str, Path],
+                 checkpoint_name: str = "rate_beer_pykeen_checkpoint.pt",
+                 model: str = "TransE",
+                 embedding_dim: int = 50,
+                 num_epochs: int = 500,
+                 batch_size: Optional[int] = None,
+                 num_threads: Optional[int] = None,
+                 slice_size: Optional[int] = None,
+                 sub_batch_size: Optional[int] = None,
+                 negative_sampler: str = "basic",
+                 negative_sampler_kwargs: Optional[Dict[str, Any]] = None,
+                 checkpoint_frequency: int = 4,
+                 split_ratios: Sequence[float] = (0.8, 0.1, 0.1),
+                 stopper: Optional[str] = "early",
+                 stopper_kwargs: Optional[Dict[str, Any]] = None,
+                 random_seed: Optional[int] = None,
+                 loader_kwargs: Optional[Dict[str, Any]] = None,
+                 pipeline_kwargs: Optional[Dict[str, Any]] = None,
+                 training_config: Optional[CPUTrainingConfig] = None,
+                 type_restricted_evaluation: bool = False,
+                 num_evaluation_negatives: Optional[int] = None,
+                 num_validation_triples: Optional[int] = None):
         self._file_location = Path(file_location)
-        self._rate_beer_loader = RateBeerLoader(self._file_location)
+        self.checkpoint_name = checkpoint_name
+        self.model = model
+        self.embedding_dim = embedding_dim
+        self.num_epochs = num_epochs
+        self.negative_sampler = negative_sampler
+        self.negative_sampler_kwargs = negative_sampler_kwargs
+        self.checkpoint_frequency = checkpoint_frequency
+        self.split_ratios = split_ratios
+        self.stopper = stopper
+        self.stopper_kwargs = stopper_kwargs if stopper_kwargs is not None \
+            else dict(frequency=2, patience=2, relative_delta=0.002)
+        self.loader_kwargs = loader_kwargs or {}
+        self.pipeline_kwargs = pipeline_kwargs or {}
+        if training_config is None:
+            training_config = CPUTrainingConfig(num_threads=num_threads,
+                                                batch_size=batch_size,
+                                                slice_size=slice_size,
+                                                sub_batch_size=sub_batch_size,
+                                                random_seed=random_seed)
+        else:
+            assert all(value is None for value in (batch_size, num_threads, slice_size, sub_batch_size, random_seed)), \
+                "Give the training settings in the training config."
+        self.training_config = training_config
+        self.type_restricted_evaluation = type_restricted_evaluation or num_evaluation_negatives is not None
+        self.num_evaluation_negatives = num_evaluation_negatives
+        self.num_validation_triples = num_validation_triples
+        assert not (self.type_restricted_evaluation and "evaluator" in self.pipeline_kwargs), \
+            "Give either the type restricted evaluation or an evaluator in the pipeline arguments."
+
+    def fit(self) -> "TrainedRateBeerModel":
+        """
+        Loads the rate beer file, splits the triples into training, testing and validation sets
+        and trains the model, writing checkpoints as it goes.
+
+        Returns:
+            The trained model.
+        """
+        from pykeen.models import model_resolver
+        from pykeen.pipeline import pipeline
+
+        from clustering.evaluation import subsample_triples
+
+        self.training_config.apply()
+        rate_beer_loader = RateBeerLoaderPykeen(self._file_location, self.checkpoint_name, **self.loader_kwargs)
+        training, testing, validation = rate_beer_loader.get_rate_beer().split(
+            list(self.split_ratios), random_state=self.training_config.random_seed)
+        # The stopper evaluates the validation triples every few epochs, a subsample keeps this
+        # cheap. The testing triples are then only filtered by the subsample.
+        validation = subsample_triples(validation, self.num_validation_triples, self.training_config.random_seed)
+        # The model is created here so its size is known when choosing the batch size.
+        model = model_resolver.make(self.model, triples_factory=training, embedding_dim=self.embedding_dim,
+                                    random_seed=self.training_config.random_seed)
+        batch_size = self.training_config.get_batch_size(model, training.num_triples,
+                                                         self._get_num_negatives_per_positive())
 
         # The training loop 'sLCWA' is to use negative sampling for training.
-        self.pipeline_result = pipeline(dataset=self._rate_beer_loader.get_rate_beer_pykeen_format(),
-                                        model="TransE",
-                                        training_loop='sLCWA',
-                                        negative_sampler='basic')
+        pipeline_result = pipeline(training=training,
+                                   testing=testing,
+                                   validation=validation,
+                                   model=model,
+                                   training_loop="sLCWA",
+                                   negative_sampler=self.negative_sampler,
+                                   negative_sampler_kwargs=self.negative_sampler_kwargs,
+                                   training_kwargs=dict(num_epochs=self.num_epochs,
+                                                        checkpoint_name=self.checkpoint_name,
+                                                        checkpoint_frequency=self.checkpoint_frequency,
+                                                        **self.training_config.get_training_kwargs(
+                                                            batch_size, training.num_triples)),
+                                   stopper=self.stopper,
+                                   stopper_kwargs=self.stopper_kwargs if self.stopper is not None else None,
+                                   random_seed=self.training_config.random_seed,
+                                   **self._get_evaluator_kwargs(training, testing, validation),
+                                   **self.pipeline_kwargs)
+        return TrainedRateBeerModel(pipeline_result.model, training, pipeline_result=pipeline_result)
+
+    def refresh(self,
+                graph,
+                new_triples: np.ndarray,
+                num_epochs: int = 5,
+                refreshed_checkpoint_name: Optional[str] = None) -> Tuple["TrainedRateBeerModel", List[str]]:
+        """
+        Updates the model of the checkpoint with reviews appended to an `IncrementalRateBeerGraph`
+        rather than training from scratch. The embedding tables are grown for the new entities,
+        keeping the trained embeddings of the existing entities, and the model is trained only
+        on the new triples and the existing triples of the reviewers and reviews they connect to.
+
+        Args:
+            graph: The graph the new triples were appended to, its ids must extend the ids of
+                the checkpoint.
+            new_triples: The mapped triples returned by `IncrementalRateBeerGraph.add_reviews`.
+            num_epochs: The number of epochs to train on the new and affected triples.
+            refreshed_checkpoint_name: The name to save the refreshed model under in the PyKEEN
+                checkpoints directory, ready to be refreshed again.
+
+        Returns:
+            The refreshed model and the reviewers whose embeddings were updated.
+        """
+        import torch
+        from pykeen.constants import PYKEEN_CHECKPOINTS
+        from pykeen.models import model_resolver
+        from pykeen.training import SLCWATrainingLoop
+        from pykeen.triples import TriplesFactory
+
+        self.training_config.apply()
+        checkpoint = torch.load(PYKEEN_CHECKPOINTS.joinpath(self.checkpoint_name), weights_only=False)
+        assert all(graph.entity_to_id.get(entity) == entity_id
+                   for entity, entity_id in checkpoint["entity_to_id_dict"].items()), \
+            "The graph's entity ids don't extend the checkpoint's entity ids."
+
+        graph_factory = graph.get_triples_factory()
+        model = model_resolver.make(self.model, triples_factory=graph_factory, embedding_dim=self.embedding_dim)
+        model.load_state_dict(_grow_state_dict(checkpoint["model_state_dict"], model.state_dict()))
+
+        affected_entities, affected_reviewers = _find_affected_entities(
+            new_triples, graph_factory, len(checkpoint["entity_to_id_dict"]))
+        mapped_triples = torch.as_tensor(np.asarray(graph.mapped_triples))
+        touches_affected = torch.isin(mapped_triples[:, 0], affected_entities) \
+            | torch.isin(mapped_triples[:, 2], affected_entities)
+        refresh_triples = torch.unique(torch.cat([mapped_triples[touches_affected], torch.as_tensor(new_triples)]),
+                                       dim=0)
+        refresh_factory = TriplesFactory(mapped_triples=refresh_triples,
+                                         entity_to_id=graph_factory.entity_to_id,
+                                         relation_to_id=graph_factory.relation_to_id)
+
+        training_loop = SLCWATrainingLoop(model=model,
+                                          triples_factory=refresh_factory,
+                                          negative_sampler=self.negative_sampler,
+                                          negative_sampler_kwargs=self.negative_sampler_kwargs)
+        batch_size = self.training_config.get_batch_size(model, refresh_factory.num_triples,
+                                                         self._get_num_negatives_per_positive())
+        training_loop.train(triples_factory=refresh_factory,
+                            num_epochs=num_epochs,
+                            use_tqdm=False,
+                            **self.training_config.get_training_kwargs(batch_size, refresh_factory.num_triples))
+
+        if refreshed_checkpoint_name is not None:
+            torch.save({"model_state_dict": model.state_dict(),
+                        "entity_to_id_dict": graph_factory.entity_to_id,
+                        "relation_to_id_dict": graph_factory.relation_to_id},
+                       PYKEEN_CHECKPOINTS.joinpath(refreshed_checkpoint_name))
+        return TrainedRateBeerModel(model, graph_factory), affected_reviewers
+
+    def _get_num_negatives_per_positive(self) -> int:
+        return (self.negative_sampler_kwargs or {}).get("num_negs_per_pos", 1)
+
+    def _get_evaluator_kwargs(self, training, testing, validation) -> Dict[str, Any]:
+        """
+        Returns:
+            The pipeline's evaluator argument for the type restricted evaluation, otherwise none
+            so PyKEEN's default evaluator is used.
+        """
+        if not self.type_restricted_evaluation:
+            return {}
+        from clustering.evaluation import TypeRestrictedEvaluator
+
+        evaluator = TypeRestrictedEvaluator(
+            [training.mapped_triples, testing.mapped_triples, validation.mapped_triples],
+            num_negatives=self.num_evaluation_negatives,
+            seed=self.training_config.random_seed or 0)
+        return dict(evaluator=evaluator)
+
+
+class TrainedRateBeerModel:
+    """
+    A model trained by `RateBeerPykeen`, used to get the reviewer embeddings and cluster the
+    reviewers.
+    """
+
+    def __init__(self, model, training_factory, pipeline_result=None):
+        self.pipeline_result = pipeline_result
+        self.model = model
+        self.training_factory = training_factory
+
+    @property
+    def entity_to_id(self) -> Dict[str, int]:
+        return self.training_factory.entity_to_id
 
-    def fit(self):
+    def save(self, directory: Union[str, Path]):
         """
+        Saves the model and the training triples in the layout of PyKEEN's `save_to_directory`.
+        """
+        if self.pipeline_result is not None:
+            self.pipeline_result.save_to_directory(directory)
+            return
+        import torch
+
+        from clustering.embeddings import _TRAINED_MODEL_FILE, _TRAINING_TRIPLES_DIRECTORY
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        torch.save(self.model, directory.joinpath(_TRAINED_MODEL_FILE))
+        self.training_factory.to_path_binary(directory.joinpath(_TRAINING_TRIPLES_DIRECTORY))
+
+    def assign_reviewers(self, reviewers: Sequence[str], cluster_creator) -> Dict[str, int]:
+        """
+        Assigns reviewers to the clusters of a fitted `RateBeerCustomerClusterCreator` without
+        refitting it, for example the reviewers updated by `RateBeerPykeen.refresh`.
+
+        Args:
+            reviewers: The profile names of the reviewers.
+            cluster_creator: The fitted cluster creator.
+
+        Returns:
+            The cluster of each reviewer.
+        """
+        import torch
+
+        indices = torch.as_tensor([self.entity_to_id[REVIEWER_PREFIX + reviewer] for reviewer in reviewers],
+                                  device=self.model.device)
+        with torch.no_grad():
+            embeddings = self.model.entity_representations[0](indices=indices).cpu().numpy()
+        return dict(zip(reviewers, cluster_creator.assign(embeddings).tolist()))
+
+    def get_reviewer_embeddings(self, output_directory: Union[str, Path],
+                                batch_size: int = 65536) -> Tuple[np.memmap, List[str]]:
+        """
+        Writes the reviewer embeddings to a memory mapped file.
+
+        Args:
+            output_directory: The directory to write the embeddings and the reviewer names to.
+            batch_size: The number of embeddings to take at a time.
+
+        Returns:
+            The memory mapped embeddings and the reviewer names.
+        """
+        from clustering.embeddings import extract_reviewer_embeddings
+
+        return extract_reviewer_embeddings(self.model, self.training_factory, output_directory,
+                                           batch_size=batch_size)
+
+    def create_cluster_creator(self, output_directory: Union[str, Path], **cluster_kwargs):
+        """
+        Creates a `RateBeerCustomerClusterCreator` over the reviewer embeddings of this model.
+
+        Args:
+            output_directory: The directory to write the reviewer embeddings to.
+            **cluster_kwargs: The arguments of the `RateBeerCustomerClusterCreator`.
 
+        Returns:
+            The cluster creator, ready to fit.
         """
-        pass
+        from clustering.customerclustering import RateBeerCustomerClusterCreator
+        from clustering.embeddings import get_embeddings_location
+
+        output_directory = Path(output_directory).joinpath(_REVIEWER_EMBEDDINGS_DIRECTORY)
+        _, reviewer_names = self.get_reviewer_embeddings(output_directory)
+        return RateBeerCustomerClusterCreator(get_embeddings_location(output_directory),
+                                              reviewer_names, **cluster_kwargs)
+
+
+def _grow_state_dict(previous_state: Dict[str, Any], new_state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copies the previous parameters into the new parameters. Embedding tables that have grown
+    keep the previous rows, the new rows keep their new initialisation.
+
+    Args:
+        previous_state: The state dict of the trained model.
+        new_state: The state dict of the model with the grown embedding tables.
+
+    Returns:
+        The new state dict with the trained values.
+    """
+    grown_state = dict(new_state)
+    for name, previous in previous_state.items():
+        new = new_state[name]
+        if previous.shape == new.shape:
+            grown_state[name] = previous
+        else:
+            assert previous.shape[1:] == new.shape[1:] and previous.shape[0] <= new.shape[0], \
+                f"{name} can't grow from {tuple(previous.shape)} to {tuple(new.shape)}."
+            grown = new.clone()
+            grown[:previous.shape[0]] = previous
+            grown_state[name] = grown
+    return grown_state
+
+
+def _find_affected_entities(new_triples: np.ndarray,
+                            graph_factory,
+                            number_of_previous_entities: int):
+    """
+    Finds the reviewers in the new triples and the reviews they connect to that were already in
+    the graph, as the existing triples of these entities are affected by the new triples. The
+    reviewers are the tails of the `profileName` triples and the reviews are their heads, so no
+    other entity is taken for either however it is named.
+
+    Args:
+        new_triples: The mapped triples appended to the graph.
+        graph_factory: The triples factory of the graph, including the new triples.
+        number_of_previous_entities: The number of entities of the checkpoint.
+
+    Returns:
+        The ids of the affected entities as a tensor and the names of the affected reviewers.
+    """
+    import torch
+
+    profile_name = graph_factory.relation_to_id["profileName"]
+    new_triples = torch.as_tensor(new_triples)
+    reviewer_ids = torch.unique(new_triples[new_triples[:, 1] == profile_name, 2])
+    mapped_triples = graph_factory.mapped_triples
+    reviews = mapped_triples[mapped_triples[:, 1] == profile_name, 0]
+    new_entities = torch.unique(new_triples[:, [0, 2]])
+    # The previous reviews that the reviewers' new reviews are connected to.
+    previous_reviews = new_entities[torch.isin(new_entities, reviews)
+                                    & (new_entities < number_of_previous_entities)]
+    id_to_entity = {entity_id: entity for entity, entity_id in graph_factory.entity_to_id.items()}
+    affected_reviewers = [id_to_entity[entity_id][len(REVIEWER_PREFIX):] for entity_id in reviewer_ids.tolist()]
+    return torch.cat([reviewer_ids, previous_reviews]), affected_reviewers
@@ -1,12 +1,37 @@
 """
 Loads in files
 """
-from datetime import datetime
+import hashlib
+import logging
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, Union, List, Tuple, Optional, Any, Set
+from datetime import tzinfo
+from typing import (Dict, Union, List, Tuple, Optional, Any, Set, Iterable, Iterator, BinaryIO, Callable,
+                    Sequence, TYPE_CHECKING)
 from collections import Counter
 
-from pykeen.triples import TriplesFactory
+import numpy as np
+
+from clustering.compression import is_compressed, open_input
+from clustering.dates import DEFAULT_TIMEZONE, create_date_columns
+from clustering.instrumentation import PipelineInstrumentation, StageMetrics
+from clustering.preprocessing_cache import PreprocessingCache
+from clustering.record_formats import RateBeerRecordFormat, RecordFormat
+from clustering.review_table import RateBeerReviewTable
+from clustering.segments import SEGMENT_PROFILE_FILE, SegmentProfile, profile_segments
+from clustering.sequences import RateBeerSequences
+
+if TYPE_CHECKING:
+    # PyKEEN and PyTorch take seconds to import, so parsing the file doesn't import them.
+    from pykeen.triples import TriplesFactory
+
+# Increase this whenever the triples created from the same file change, so previously
+# cached triples are no longer used.
+_LOADER_VERSION = 5
 
 _relationship_to_id_mapper = {
     "precedes": 0,
@@ -24,6 +49,25 @@ _relationship_to_id_mapper = {
     "Month": 12
 }
 
+# The reviewer entities are the profile names with this prefix, so they can't be confused with
+# the other entities.
+REVIEWER_PREFIX = "pro"
+# The prefix of the beer entities, the head of the style triples.
+_BEER_PREFIX = "bee"
+
+# The relationships connecting reviews are abbreviated in the triples.
+_triple_relationship_names = {
+    "precedes": "pre",
+    "succeeds": "suc"
+}
+
+# Each worker is given several chunks of the file so that uneven chunks balance out.
+_CHUNKS_PER_WORKER = 4
+# The number of reviews given their date fields at a time when the file is streamed.
+_STREAMED_DATE_BATCH_SIZE = 1024
+
+logger = logging.getLogger(__name__)
+
 
 def _remove_beer_specific_details(rate_beer):
     """
@@ -47,10 +91,43 @@ def _remove_beer_specific_details(rate_beer):
 
 
 class RateBeerLoader:
+    """
+    Loads the rate beer reviews. With `num_workers` above one the file is split into byte
+    ranges on the empty lines between reviews and each range is parsed in its own process.
+
+    The reviewers can be filtered by their number of reviews with `limit_reviews_per_reviewer`,
+    `min_reviews_per_reviewer` and `top_reviewers`. When any of these are set the profile names
+    are first counted in a cheap pass over the file, so the reviews of the reviewers that are
+    filtered out are never kept.
+
+    The time, peak memory and counts of each stage are recorded by `instrumentation`, pass a
+    `PipelineInstrumentation` with a callback to export them.
+
+    The Year, Month and DayOfWeek fields are created in `timezone`, UTC unless another timezone
+    name or tzinfo is given, None uses the local timezone of the machine.
+
+    The file may be gzip, bz2 or xz compressed, it is then decompressed as it is read, in its
+    own thread, rather than to disk. A compressed file can't be split into byte ranges so it is
+    read by a single process. `record_format` reads files of other formats, such as the My
+    Anime List lists with `AnimeListRecordFormat`, into the same reviews.
+    """
+
     def __init__(self,
                  file_location: Union[Path, str],
-                 limit_reviews_per_reviewer: Optional[int] = None):
+                 limit_reviews_per_reviewer: Optional[int] = None,
+                 num_workers: int = 1,
+                 min_reviews_per_reviewer: Optional[int] = None,
+                 top_reviewers: Optional[int] = None,
+                 instrumentation: Optional[PipelineInstrumentation] = None,
+                 timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE,
+                 record_format: Optional[RecordFormat] = None):
+        self._timezone = timezone
+        self._record_format = record_format if record_format is not None else RateBeerRecordFormat()
+        self.instrumentation = instrumentation if instrumentation is not None else PipelineInstrumentation()
         self._limit_reviews_per_reviewer = limit_reviews_per_reviewer
+        self._min_reviews_per_reviewer = min_reviews_per_reviewer
+        self._top_reviewers = top_reviewers
+        self._num_workers = num_workers
         self.all_reviewers = Counter()
         self._file_location = Path(file_location)
         self._rate_beer_processed = []
@@ -66,8 +143,8 @@ class RateBeerLoader:
         Loads and transforms raw data into a processable form following the article framework,
         with the following steps:
 
-        1. Loads the raw data
-        2. Transforms the time field into `Year`, `Month`, `DayOfWeek`.
+        1. Loads the raw data of the reviewers that are not filtered out
+        2. Transforms the time field into `Year`, `Month`, `DayOfWeek` as each review is read.
         3. Sorts the reviews by time giving each review an id based on this.
         4. Deletes the time fields as it is now in the prior information.
         5. Connects each of the reviews by a precedes or a succeeds relationship.
@@ -75,58 +152,209 @@ class RateBeerLoader:
         Returns:
             The processed rate_beer.
         """
-        raw_rate_beer_dict, to_remove = self._process_rate_beer_file()
-        if self._limit_reviews_per_reviewer is not None and to_remove:
-            raw_rate_beer_dict = self._remove_profiles(raw_rate_beer_dict, to_remove)
-        rate_beer = _create_date_details(raw_rate_beer_dict)
-        rate_beer = _create_review_id(rate_beer)
-        rate_beer = self._connect_reviews_using_id(rate_beer)
+        raw_rate_beer_dict = self.read_reviews()
+        with self.instrumentation.measure("create_review_id") as metrics:
+            rate_beer = _create_review_id(raw_rate_beer_dict)
+            metrics.reviews = len(rate_beer)
+        with self.instrumentation.measure("connect_reviews_using_id") as metrics:
+            rate_beer = self._connect_reviews_using_id(rate_beer)
+            metrics.reviews = len(rate_beer)
+            metrics.reviewers = len(self.all_reviewers)
         return rate_beer
 
-    def _process_rate_beer_file(self) -> tuple[list[dict[str, dict[Any, Any]]], set[str]]:
+    def read_reviews(self) -> List[Dict[str, Dict[str, str]]]:
+        """
+        Reads the reviews of the reviewers that are not filtered out with their date fields, in
+        the order of the file and still with their "time" field, see `_process_rate_beer_file`.
+
+        Returns:
+            The reviews in the form {"beer": {name: value}, "review": {name: value}}.
+        """
+        with self.instrumentation.measure("process_rate_beer_file") as metrics:
+            reviews = self._process_rate_beer_file()
+            metrics.reviews = len(reviews)
+            metrics.reviewers = len(self.all_reviewers)
+        return reviews
+
+    def load_rate_beer_table(self) -> RateBeerReviewTable:
+        """
+        Loads the raw data into a columnar table rather than a list of dictionaries, following
+        the same steps as `load_rate_beer`. The reviews are sorted by time so that the row of
+        each review is its id, the date fields and the precedes/succeeds links are available
+        from `RateBeerReviewTable.date_details` and `RateBeerReviewTable.link_reviews`, give
+        `date_details` the loader's `timezone` to match `load_rate_beer`.
+
+        Returns:
+            The reviews as a table sorted by time.
+        """
+        with self.instrumentation.measure("read_rate_beer_table") as metrics:
+            # The counts are of this load only, not added to those of an earlier load.
+            self.all_reviewers.clear()
+            reviewer_filter = self._create_reviewer_filter()
+            table = RateBeerReviewTable.concatenate(
+                self._map_file_chunks(partial(_read_rate_beer_table_chunk, reviewer_filter=reviewer_filter)))
+            if reviewer_filter is None:
+                reviewer_counts = table.reviewer_counts()
+                self.all_reviewers.update(dict(zip(table.profile_vocabulary, reviewer_counts.tolist())))
+            metrics.reviews = len(table)
+            metrics.reviewers = len(self.all_reviewers)
+        with self.instrumentation.measure("sort_by_time") as metrics:
+            table = table.sort_by_time()
+            metrics.reviews = len(table)
+        return table
+
+    def get_segment_profile(self,
+                            reviewer_labels: np.ndarray,
+                            reviewer_names: Optional[Sequence[str]] = None,
+                            top_n: int = 10,
+                            cache_directory: Union[Path, str, None] = None) -> SegmentProfile:
+        """
+        Profiles the reviews of each segment of reviewers, see `profile_segments`. With a
+        `cache_directory` the profile is kept keyed by the file, the loader's parameters and the
+        labels, so the file is only read the first time a segmentation is profiled.
+
+        Args:
+            reviewer_labels: The segment of each reviewer.
+            reviewer_names: The reviewer of each label, None when the labels are in the order of
+                the profile vocabulary of `load_rate_beer_table`.
+            top_n: The number of top styles and beers of each segment.
+            cache_directory: The directory to keep the profiles in, None doesn't keep them.
+
+        Returns:
+            The profile of each segment.
+        """
+        reviewer_labels = np.asarray(reviewer_labels)
+        profile_location = None
+        if cache_directory is not None:
+            names_hash = None if reviewer_names is None \
+                else hashlib.sha256("\n".join(reviewer_names).encode("utf-8")).hexdigest()
+            key = PreprocessingCache(cache_directory).get_key(
+                self._file_location,
+                loader_version=_LOADER_VERSION,
+                limit_reviews_per_reviewer=self._limit_reviews_per_reviewer,
+                min_reviews_per_reviewer=self._min_reviews_per_reviewer,
+                top_reviewers=self._top_reviewers,
+                timezone=_get_timezone_key(self._timezone),
+                record_format=self._record_format.get_parameters(),
+                labels=hashlib.sha256(reviewer_labels.astype(np.int64).tobytes()).hexdigest(),
+                names=names_hash,
+                top_n=top_n)
+            profile_location = Path(cache_directory).joinpath(key, SEGMENT_PROFILE_FILE)
+            if profile_location.exists():
+                with self.instrumentation.measure("load_segment_profile"):
+                    return SegmentProfile.load(profile_location)
+
+        table = self.load_rate_beer_table()
+        with self.instrumentation.measure("profile_segments") as metrics:
+            profile = profile_segments(table, reviewer_labels, reviewer_names, top_n=top_n, timezone=self._timezone)
+            metrics.reviews = int(profile.review_counts.sum())
+            metrics.reviewers = int(profile.reviewer_counts.sum())
+        if profile_location is not None:
+            profile.save(profile_location)
+        return profile
+
+    def iterate_rate_beer(self) -> Iterator[Dict[str, Dict[str, str]]]:
+        """
+        Lazily reads the rate beer file one review at a time, with the `Year`, `Month` and
+        `DayOfWeek` fields already created. Only a small batch of reviews, which are given their
+        date fields together, is held in memory at a time, which allows stages that do not need
+        the full dataset to run incrementally.
+
+        Returns:
+            A generator of the reviews in the form {"beer": {name: value}, "review": {name: value}}.
+        """
+        record_format = self._get_record_format()
+        with open_input(self._file_location) as rate_beer_file:
+            batch = []
+            for review in record_format.iterate_reviews(
+                    _iterate_chunk_lines(rate_beer_file, record_format.records_start, None)):
+                batch.append(review)
+                if len(batch) == _STREAMED_DATE_BATCH_SIZE:
+                    yield from _create_date_details(batch, self._timezone)
+                    batch = []
+            yield from _create_date_details(batch, self._timezone)
+
+    def _process_rate_beer_file(self) -> List[Dict[str, Dict[str, str]]]:
         """
-        Loads in the rate beer file and fields.
+        Loads in the rate beer file and fields. The file is streamed so the raw lines are never
+        all held in memory and the date fields are created as each review is read. The reviews
+        of the reviewers that are filtered out are skipped as they are read.
 
         Returns:
             The reviews as a list of dictionaries of reviews, everything is just in string format.
             Each review is a dictionary of dictionaries in the form:
             {"beer": {name: value}, "review": {name: value}}
         """
-        path_to_file = Path(self._file_location)
+        self.all_reviewers.clear()
+        reviewer_filter = self._create_reviewer_filter()
         reviews = []
-        current_rating = {"review": {}, "beer": {}}
-        reviewers_to_remove = set()
-        with path_to_file.open(mode="r",
-                               encoding="utf-8",
-                               errors="replace") as rate_beer_file:
-            # Reads in all the lines until an empty line, then combine those into a dictionary.
-            for line_raw in rate_beer_file.readlines():
-                line = line_raw.rstrip().lstrip()
-                if line == "" and len(current_rating["review"]) > 0:
-                    # Append the current rating and append a new one.
-                    reviews.append(current_rating)
-                    current_rating = {"review": {}, "beer": {}}
-                elif line.startswith("beer"):
-                    key, value = _get_line_key_value(line, "beer")
-                    if key in ["ABV", "name", "brewerId"]:
-                        continue
-                    current_rating["beer"][key] = value
-                else:
-                    key, value = _get_line_key_value(line, "review")
+        for chunk_reviews, chunk_reviewers in self._map_file_chunks(
+                partial(_read_rate_beer_chunk, reviewer_filter=reviewer_filter, timezone=self._timezone)):
+            reviews.extend(chunk_reviews)
+            if reviewer_filter is None:
+                self.all_reviewers.update(chunk_reviewers)
+        return reviews
 
-                    # We ignore the text reviews for this paper.
-                    if key == "text":
-                        continue
-                    if key == "profileName":
-                        self.all_reviewers[value] += 1
-                        if self._limit_reviews_per_reviewer is not None \
-                                and self.all_reviewers[value] > self._limit_reviews_per_reviewer:
-                            reviewers_to_remove.add(value)
+    def _create_reviewer_filter(self) -> Optional["_ReviewerFilter"]:
+        """
+        Counts the reviews of each reviewer, without parsing the reviews, to find the reviewers
+        to keep. `all_reviewers` is set to the counts of the reviewers that are kept.
 
-                    current_rating["review"][key] = value
-            if len(current_rating["review"]) > 0:
-                reviews.append(current_rating)
-        return reviews, reviewers_to_remove
+        Returns:
+            The reviewers to keep, or None if no reviewers are filtered out.
+        """
+        if self._limit_reviews_per_reviewer is None and self._min_reviews_per_reviewer is None \
+                and self._top_reviewers is None:
+            return None
+        with self.instrumentation.measure("count_reviewers") as metrics:
+            reviewer_counts = Counter()
+            for chunk_counts in self._map_file_chunks(_count_reviewers_chunk):
+                reviewer_counts.update(chunk_counts)
+            metrics.reviews = sum(reviewer_counts.values())
+            metrics.reviewers = len(reviewer_counts)
+
+        kept = {reviewer: count for reviewer, count in reviewer_counts.items()
+                if (self._limit_reviews_per_reviewer is None or count <= self._limit_reviews_per_reviewer)
+                and (self._min_reviews_per_reviewer is None or count >= self._min_reviews_per_reviewer)}
+        if self._top_reviewers is not None:
+            most_reviews = {reviewer for reviewer, _ in Counter(kept).most_common(self._top_reviewers)}
+            kept = {reviewer: count for reviewer, count in kept.items() if reviewer in most_reviews}
+        self.all_reviewers.update(kept)
+        return _ReviewerFilter(reviewer_counts.keys(), kept.keys())
+
+    def _get_record_format(self) -> RecordFormat:
+        """
+        Returns:
+            The record format with anything it needs from the start of the file read.
+        """
+        with open_input(self._file_location) as rate_beer_file:
+            return self._record_format.for_file(rate_beer_file)
+
+    def _map_file_chunks(self, read_chunk: Callable[..., Any]) -> List[Any]:
+        """
+        Reads the rate beer file in chunks, using a process for each chunk when there is more
+        than one worker and the file isn't compressed.
+
+        Args:
+            read_chunk: A picklable function taking the file location, the start and end byte
+                of the chunk and the `record_format` keyword.
+
+        Returns:
+            The result of each chunk in the order of the file.
+        """
+        record_format = self._get_record_format()
+        read_chunk = partial(read_chunk, record_format=record_format)
+        if self._num_workers <= 1 or is_compressed(self._file_location):
+            if self._num_workers > 1:
+                logger.info("A compressed file can't be split, so it is read by a single process.")
+            return [read_chunk(self._file_location, record_format.records_start, None)]
+        boundaries = _find_chunk_boundaries(self._file_location, self._num_workers * _CHUNKS_PER_WORKER,
+                                            record_format)
+        with ProcessPoolExecutor(max_workers=self._num_workers) as executor:
+            return list(executor.map(read_chunk,
+                                     [self._file_location] * (len(boundaries) - 1),
+                                     boundaries[:-1],
+                                     boundaries[1:]))
 
     def _connect_reviews_using_id(self, rate_beer):
         """
@@ -166,15 +394,6 @@ class RateBeerLoader:
                     rate_beer[index_of_review]["precedes"] = str(rate_beer[index_of_next_review]["id"])
         return rate_beer
 
-    def _remove_profiles(self, ratings: List[Dict[str, Dict[str, str]]], reviewers_to_remove: Set[str]):
-        to_return = []
-        for rating in ratings:
-            if rating["review"]["profileName"] not in reviewers_to_remove:
-                to_return.append(rating)
-        for reviewer in reviewers_to_remove:
-            del self.all_reviewers[reviewer]
-        return to_return
-
 
 def write_to_tsv(head_relationship_tail_representation: List[Tuple[str, str, str]]) -> Path:
     """
@@ -197,8 +416,13 @@ def write_to_tsv(head_relationship_tail_representation: List[Tuple[str, str, str
 class RateBeerLoaderPykeen(RateBeerLoader):
     """
     Deals with pytorch and pykeen specific setup of the dataset.
-    The data is loaded and the information is written to a TSV file for the TriplesFactory to
-    use.
+    The data is loaded and the information is written to a temporary TSV file for the
+    TriplesFactory to use, the file is deleted once the TriplesFactory is loaded. Setting `write_training_file` to False instead maps the entities and relationships to
+    ids as the triples are generated and builds the TriplesFactory directly from them.
+
+    The mapped triples are kept in a `PreprocessingCache` keyed by the input file, the loader
+    parameters and version and the checkpoint, so they are only reused when they would be
+    recreated the same way.
 
     Imports are kept local to ensure that not having Pykeen or Pytorch installed
     doesn't cause issues if you attempt to try Tensorflow approach.
@@ -207,50 +431,211 @@ class RateBeerLoaderPykeen(RateBeerLoader):
     def __init__(self, file_location: Union[Path, str],
                  checkpoint_name: str,
                  accept_previous_saves: bool = True,
-                 limit_reviews_per_reviewer: Optional[int] = None):
-        super().__init__(file_location, limit_reviews_per_reviewer=limit_reviews_per_reviewer)
+                 limit_reviews_per_reviewer: Optional[int] = None,
+                 write_training_file: bool = True,
+                 cache_directory: Union[Path, str] = "rate_beer_cache",
+                 cache_size_limit: Optional[int] = None,
+                 num_workers: int = 1,
+                 min_reviews_per_reviewer: Optional[int] = None,
+                 top_reviewers: Optional[int] = None,
+                 instrumentation: Optional[PipelineInstrumentation] = None,
+                 timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE,
+                 record_format: Optional[RecordFormat] = None):
+        super().__init__(file_location,
+                         limit_reviews_per_reviewer=limit_reviews_per_reviewer,
+                         num_workers=num_workers,
+                         min_reviews_per_reviewer=min_reviews_per_reviewer,
+                         top_reviewers=top_reviewers,
+                         instrumentation=instrumentation,
+                         timezone=timezone,
+                         record_format=record_format)
 
         self.checkpoint_name = checkpoint_name
-        self._temporary_training_location = Path("training_file.tsv").absolute()
-        self._head_relationship_tail_representation: List[Tuple[str, str, str]] = []
-        if accept_previous_saves and self._temporary_training_location.exists():
-            print("Found a previous save")
+        self._preprocessing_cache = PreprocessingCache(Path(cache_directory).absolute(),
+                                                       max_size_bytes=cache_size_limit)
+        cache_key = self._get_cache_key()
+        cached = None
+        if accept_previous_saves:
+            with self.instrumentation.measure("load_cached_triples") as metrics:
+                cached = self._preprocessing_cache.load(cache_key)
+                if cached is not None:
+                    self._training_triples_factory = _create_triples_factory(*cached)
+                    self._set_factory_counts(metrics)
+        if cached is not None:
+            logger.info("Found a previous save")
+            return
+
+        logger.info("Beginning a new read.")
+        self._rate_beer_processed = self.load_rate_beer()
+        if write_training_file:
+            with tempfile.TemporaryDirectory() as temporary_directory:
+                training_location = Path(temporary_directory).joinpath("training_file.tsv")
+                with self.instrumentation.measure("write_training_file") as metrics:
+                    metrics.triples = self._write_temporary_training_file(self._iterate_hrt(), training_location)
+                logger.info("Loading Triples from the path downloaded.")
+                with self.instrumentation.measure("load_training_factory") as metrics:
+                    self._training_triples_factory = self._load_training_factory(training_location)
+                    self._set_factory_counts(metrics)
         else:
-            print("Beginning a new read.")
-            self._rate_beer_processed = self.load_rate_beer()
-            self._head_relationship_tail_representation = self._create_hrt_list()
-            self._write_temporary_training_file()
+            with self.instrumentation.measure("create_training_factory") as metrics:
+                self._training_triples_factory = self._create_training_factory()
+                self._set_factory_counts(metrics)
+        with self.instrumentation.measure("save_cached_triples") as metrics:
+            self._preprocessing_cache.save(cache_key,
+                                           self._training_triples_factory.mapped_triples.numpy(),
+                                           self._training_triples_factory.entity_to_id,
+                                           self._training_triples_factory.relation_to_id,
+                                           file_location=str(self._file_location))
+            self._set_factory_counts(metrics)
+
+    def _set_factory_counts(self, metrics: StageMetrics):
+        metrics.entities = self._training_triples_factory.num_entities
+        metrics.triples = self._training_triples_factory.num_triples
+
+    def _get_cache_key(self) -> str:
+        """
+        Returns:
+            The key of the preprocessed triples in the cache, this depends on the input file,
+            the parameters of the loader and the ids taken from the checkpoint. The checkpoint is
+            keyed on its entity and relationship ids rather than its file, which changes every
+            time training saves it.
+        """
+        entity_to_id, relationship_to_id = self._load_checkpoint_mappings()
+        checkpoint_mappings = None
+        if entity_to_id is not None:
+            mappings = "\n".join(f"{name}\t{name_id}" for mapping in (entity_to_id, relationship_to_id)
+                                 for name, name_id in sorted(mapping.items()))
+            checkpoint_mappings = hashlib.sha256(mappings.encode("utf-8")).hexdigest()
+        return self._preprocessing_cache.get_key(self._file_location,
+                                                 loader_version=_LOADER_VERSION,
+                                                 limit_reviews_per_reviewer=self._limit_reviews_per_reviewer,
+                                                 min_reviews_per_reviewer=self._min_reviews_per_reviewer,
+                                                 top_reviewers=self._top_reviewers,
+                                                 timezone=_get_timezone_key(self._timezone),
+                                                 record_format=self._record_format.get_parameters(),
+                                                 checkpoint_name=self.checkpoint_name,
+                                                 checkpoint_mappings=checkpoint_mappings)
 
-        print("Loading Triples from the path downloaded.")
-        self._training_triples_factory = self._load_training_factory()
+    def _load_checkpoint_mappings(self) -> Tuple[Optional[Dict[str, int]], Optional[Dict[str, int]]]:
+        """
+        Finds the entity and relationship ids used by a previous checkpoint so that a model can
+        continue to be trained on the same ids.
 
-    def _load_training_factory(self):
+        Returns:
+            The entity to id and relationship to id mappings, or None if there is no checkpoint.
+        """
         from pykeen.constants import PYKEEN_CHECKPOINTS
         import torch
 
         previous_checkpoint = PYKEEN_CHECKPOINTS.joinpath(self.checkpoint_name)
-        entity_to_id = None
-        relationship_to_id = None
-        if previous_checkpoint.exists():
-            loaded = torch.load(previous_checkpoint)
-            entity_to_id = loaded["entity_to_id_dict"]
-            relationship_to_id = loaded["relation_to_id_dict"]
-        return TriplesFactory.from_path(self._temporary_training_location,
+        if not previous_checkpoint.exists():
+            return None, None
+        loaded = torch.load(previous_checkpoint, weights_only=False)
+        return loaded["entity_to_id_dict"], loaded["relation_to_id_dict"]
+
+    def _load_training_factory(self, training_location: Path) -> "TriplesFactory":
+        from pykeen.triples import TriplesFactory
+
+        entity_to_id, relationship_to_id = self._load_checkpoint_mappings()
+        return TriplesFactory.from_path(training_location,
                                         entity_to_id=entity_to_id,
                                         relation_to_id=relationship_to_id)
 
-    def _write_temporary_training_file(self):
+    def _create_training_factory(self) -> "TriplesFactory":
+        """
+        Builds the TriplesFactory from the ids assigned while generating the triples, avoiding
+        writing and re-parsing the training file.
+
+        Returns:
+            The triples factory of the training set.
+        """
+        entity_to_id, relationship_to_id = self._load_checkpoint_mappings()
+        mapped_triples, entity_to_id, relationship_to_id = self._create_mapped_triples(
+            entity_to_id=entity_to_id, relationship_to_id=relationship_to_id)
+        # Each triple is already only generated once, so unlike reading the training file they
+        # don't need to be deduplicated.
+        return _create_triples_factory(mapped_triples, entity_to_id, relationship_to_id)
+
+    @property
+    def num_entities(self) -> int:
+        """
+        Returns:
+            The number of entities of the training triples.
+        """
+        return self._training_triples_factory.num_entities
+
+    @property
+    def num_triples(self) -> int:
+        """
+        Returns:
+            The number of training triples.
+        """
+        return self._training_triples_factory.num_triples
+
+    def _create_mapped_triples(self,
+                               entity_to_id: Optional[Dict[str, int]] = None,
+                               relationship_to_id: Optional[Dict[str, int]] = None
+                               ) -> Tuple[np.ndarray, Dict[str, int], Dict[str, int]]:
+        """
+        Generates the triples as ids, assigning each new entity the next id as it is seen.
+        The entities are interned by `_EntityVocabulary`, so the name of an entity is only built
+        the first time it is seen. The relationship ids follow `_relationship_to_id_mapper`.
+
+        Args:
+            entity_to_id: The fixed entity ids to use, triples with other entities are dropped.
+            relationship_to_id: The fixed relationship ids to use, triples with other
+                relationships are dropped.
+
+        Returns:
+            The <head, relationship, tail> ids as an (n, 3) int64 array and the entity to id and
+            relationship to id mappings used.
+        """
+        entities = _EntityVocabulary(entity_to_id)
+        fixed_relationships = relationship_to_id is not None
+        relationship_to_id = dict(relationship_to_id) if fixed_relationships \
+            else _get_triple_relationship_to_id()
+
+        mapped_triples = array("q")
+        number_dropped = 0
+        for head_prefix, head, relationship, tail_prefix, tail in self._iterate_triple_parts():
+            head_id = entities.get_id(head_prefix, head)
+            tail_id = entities.get_id(tail_prefix, tail)
+            if fixed_relationships:
+                relationship_id = relationship_to_id.get(relationship)
+            else:
+                relationship_id = relationship_to_id.setdefault(relationship, len(relationship_to_id))
+            if head_id is None or tail_id is None or relationship_id is None:
+                number_dropped += 1
+                continue
+            mapped_triples.extend((head_id, relationship_id, tail_id))
+        if number_dropped:
+            logger.warning("Dropped %d triples not found in the previous checkpoint.", number_dropped)
+        return np.frombuffer(mapped_triples, dtype=np.int64).reshape(-1, 3), entities.entity_to_id, relationship_to_id
+
+    def _write_temporary_training_file(self, head_relationship_tail: Iterable[List[str]],
+                                       training_location: Path) -> int:
         """
         Writes the <h,r,t> as a tab separated file to use.
+
+        Args:
+            head_relationship_tail: The triples to write, these are written as they are generated
+                so the full list never needs to be held in memory.
+            training_location: The file to write the triples to.
+
+        Returns:
+            The number of triples written.
         """
-        with self._temporary_training_location.open("w") as training_file:
-            for line in self._head_relationship_tail_representation:
+        number_written = 0
+        with training_location.open("w") as training_file:
+            for line in head_relationship_tail:
                 tsv_line = "\t".join(line)
                 training_file.write(tsv_line + "\n")
-        print("Written Temporary File")
+                number_written += 1
+        logger.info("Written Temporary File")
+        return number_written
 
-    def get_rate_beer(self) -> Union[tuple[TriplesFactory, TriplesFactory, TriplesFactory],
-                                     TriplesFactory]:
+    def get_rate_beer(self) -> Union[Tuple["TriplesFactory", "TriplesFactory", "TriplesFactory"],
+                                     "TriplesFactory"]:
         """
         Gets the triples factory of the training set.
 
@@ -275,62 +660,333 @@ class RateBeerLoaderPykeen(RateBeerLoader):
         Returns:
             A list of the graph nodes.
         """
-        head_rel_tail = []
+        return list(self._iterate_hrt())
 
+    def _iterate_hrt(self) -> Iterator[List[str]]:
+        """
+        Lazily generates the triples in the form <head, relationship, tail> one review at a time.
+
+        Returns:
+            A generator of the graph triples.
+        """
+        for head_prefix, head, relationship, tail_prefix, tail in self._iterate_triple_parts():
+            yield [head_prefix + head, relationship, tail_prefix + tail]
+
+    def _iterate_triple_parts(self) -> Iterator[Tuple[str, str, str, str, str]]:
+        """
+        Lazily generates the triples of every review, including the precedes and succeeds
+        triples, with the head and tail split into their prefix and value. The style triple of
+        each beer is only generated once rather than once per review.
+
+        Returns:
+            A generator of the (head prefix, head, relationship, tail prefix, tail) of each triple.
+        """
         assert self._rate_beer_processed, "The graph list is empty."
+        beer_styles: Set[Tuple[str, str]] = set()
         for review in self._rate_beer_processed:
             review_id = review["id"]
-            head_rel_tail = _add_triples("review", head_rel_tail, review_id, review)
-            head_rel_tail = _add_triples("beer", head_rel_tail, review_id, review)
-
-            if "precedes" in review.keys():
-                triple = [review_id, "pre", review["precedes"]]
-                head_rel_tail.append(triple)
-            if "succeeds" in review.keys():
-                triple = [review_id, "suc", review["succeeds"]]
-                head_rel_tail.append(triple)
-        return head_rel_tail
+            yield from _iterate_review_triple_parts(review_id, review, beer_styles)
+            for neighbour in ("precedes", "succeeds"):
+                if neighbour in review:
+                    yield "", review_id, _triple_relationship_names[neighbour], "", review[neighbour]
 
 
 class RateBeerLoaderLSTM(RateBeerLoader):
-    def __init__(self, file_location: Union[Path, str]):
+    """
+    Turns the reviews of each reviewer into a time ordered sequence of integer encoded reviews
+    for an LSTM. The reviews are in the same order as they are connected in by
+    `_connect_reviews_using_id`.
+
+    The PyTorch dataset is imported locally so the sequences can be created without PyTorch.
+    """
+
+    def __init__(self,
+                 file_location: Union[Path, str],
+                 limit_reviews_per_reviewer: Optional[int] = None,
+                 num_workers: int = 1,
+                 min_reviews_per_reviewer: Optional[int] = None,
+                 top_reviewers: Optional[int] = None,
+                 instrumentation: Optional[PipelineInstrumentation] = None,
+                 timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE,
+                 record_format: Optional[RecordFormat] = None):
+        super().__init__(file_location,
+                         limit_reviews_per_reviewer=limit_reviews_per_reviewer,
+                         num_workers=num_workers,
+                         min_reviews_per_reviewer=min_reviews_per_reviewer,
+                         top_reviewers=top_reviewers,
+                         instrumentation=instrumentation,
+                         timezone=timezone,
+                         record_format=record_format)
+        self._sequences: Optional[RateBeerSequences] = None
+
+    def get_sequences(self) -> RateBeerSequences:
+        """
+        Loads the reviews as a table and encodes the sequences of the reviewers, this is only
+        done the first time.
+
+        Returns:
+            The sequences of every reviewer in flat offset indexed arrays.
+        """
+        if self._sequences is None:
+            table = self.load_rate_beer_table()
+            with self.instrumentation.measure("create_sequences") as metrics:
+                self._sequences = RateBeerSequences.from_table(table, self._timezone)
+                metrics.reviews = len(self._sequences.features)
+                metrics.reviewers = len(self._sequences)
+        return self._sequences
+
+    def get_dataset(self,
+                    batch_size: int = 64,
+                    max_length: Optional[int] = 256,
+                    bucket_batches: int = 50,
+                    shuffle: bool = True,
+                    seed: int = 0):
         """
-        This requires load in the data turn the graph into sequences for each person and then load them.
+        Creates the PyTorch dataset of padded batches of the sequences.
+
+        Args:
+            batch_size: The number of sequences of each batch.
+            max_length: The most reviews of a sequence, longer sequences are split into several.
+                None keeps every sequence whole.
+            bucket_batches: The number of batches worth of sequences sorted by length together,
+                more gives less padding but less random batches.
+            shuffle: Whether to shuffle the sequences and batches each epoch.
+            seed: The seed of the shuffling.
+
+        Returns:
+            The `RateBeerSequenceDataset`, use it with a DataLoader with `batch_size=None`.
         """
-        super().__init__(file_location)
+        from clustering.lstm_dataset import RateBeerSequenceDataset
+
+        return RateBeerSequenceDataset(self.get_sequences(),
+                                       batch_size=batch_size,
+                                       max_length=max_length,
+                                       bucket_batches=bucket_batches,
+                                       shuffle=shuffle,
+                                       seed=seed)
+
+
+def _create_triples_factory(mapped_triples: np.ndarray,
+                            entity_to_id: Dict[str, int],
+                            relationship_to_id: Dict[str, int]) -> "TriplesFactory":
+    """
+    Creates a TriplesFactory from triples that are already mapped to ids.
+
+    Args:
+        mapped_triples: The (n, 3) ids of the <head, relationship, tail> triples.
+        entity_to_id: The entity to id mapping.
+        relationship_to_id: The relationship to id mapping.
+
+    Returns:
+        The triples factory.
+    """
+    import torch
+    from pykeen.triples import TriplesFactory
+
+    return TriplesFactory(mapped_triples=torch.from_numpy(mapped_triples),
+                          entity_to_id=entity_to_id,
+                          relation_to_id=relationship_to_id)
+
+
+def _get_triple_relationship_to_id() -> Dict[str, int]:
+    """
+    Returns:
+        The relationship ids of `_relationship_to_id_mapper` using the relationship names found
+        in the triples.
+    """
+    return {_triple_relationship_names.get(relationship, relationship): relationship_id
+            for relationship, relationship_id in _relationship_to_id_mapper.items()}
+
+
+def _find_chunk_boundaries(file_location: Path, number_of_chunks: int, record_format: RecordFormat) -> List[int]:
+    """
+    Splits the file into roughly equal byte ranges that start at the beginning of a review.
+
+    Args:
+        file_location: The rate beer file, this can't be compressed.
+        number_of_chunks: The number of byte ranges to aim for.
+        record_format: The format of the file's records.
+
+    Returns:
+        The sorted start of each byte range followed by the size of the file.
+    """
+    file_size = file_location.stat().st_size
+    boundaries = [record_format.records_start]
+    with file_location.open(mode="rb") as rate_beer_file:
+        for i in range(1, number_of_chunks):
+            rate_beer_file.seek(max(file_size * i // number_of_chunks, boundaries[-1]))
+            record_format.skip_to_record(rate_beer_file)
+            boundary = rate_beer_file.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+    return boundaries
+
+
+def _iterate_chunk_lines(rate_beer_file: BinaryIO, start: int, end: Optional[int]) -> Iterator[bytes]:
+    """
+    Reads the lines of the file from the start byte up to the end byte.
+
+    Args:
+        rate_beer_file: The rate beer file opened in binary mode.
+        start: The byte to start at, this should be the beginning of a line.
+        end: The byte to stop at, or None to read to the end of the file.
+
+    Returns:
+        A generator of the lines.
+    """
+    if rate_beer_file.seekable():
+        rate_beer_file.seek(start)
+    else:
+        # A compressed file is only read from its start, so the bytes before the start are skipped.
+        rate_beer_file.read(start)
+    position = start
+    for line in rate_beer_file:
+        yield line
+        position += len(line)
+        if end is not None and position >= end:
+            break
+
+
+class _ReviewerFilter:
+    """
+    The reviewers to keep. Only the smaller of the kept and the removed reviewers is stored, as
+    this is sent to each worker.
+    """
+
+    def __init__(self, all_reviewers: Iterable[str], kept_reviewers: Iterable[str]):
+        kept_reviewers = frozenset(kept_reviewers)
+        removed_reviewers = frozenset(all_reviewers) - kept_reviewers
+        self._stores_kept = len(kept_reviewers) <= len(removed_reviewers)
+        self._reviewers = kept_reviewers if self._stores_kept else removed_reviewers
+
+    def __contains__(self, reviewer: Optional[str]) -> bool:
+        return (reviewer in self._reviewers) == self._stores_kept
+
+
+def _count_reviewers_chunk(file_location: Path, start: int, end: Optional[int], record_format: RecordFormat) -> Counter:
+    """
+    Counts the reviews of each reviewer in a byte range of the file, for rate beer files by
+    only decoding the profileName lines.
+
+    Args:
+        file_location: The rate beer file.
+        start: The byte to start at.
+        end: The byte to stop at, or None to read to the end of the file.
+        record_format: The format of the file's records.
 
+    Returns:
+        The number of reviews of each reviewer in this range.
+    """
+    with open_input(file_location) as rate_beer_file:
+        return Counter(record_format.iterate_profile_names(_iterate_chunk_lines(rate_beer_file, start, end)))
+
+
+def _iterate_kept_reviews(rate_beer_file: Iterable[bytes],
+                          reviewer_filter: Optional[_ReviewerFilter],
+                          record_format: RecordFormat) -> Iterator[Dict[str, Dict[str, str]]]:
+    """
+    Reads the reviews, skipping those of reviewers that are filtered out.
+
+    Args:
+        rate_beer_file: The lines of whole records of the file.
+        reviewer_filter: The reviewers to keep, or None to keep every reviewer.
+        record_format: The format of the file's records.
 
-def _get_line_key_value(line, category):
-    stripped = line.replace(f"{category}/", "")
-    # The format will now be "key: value" so split based on this.
-    key_value_pair = stripped.split(":")
-    key = key_value_pair[0]
-    # There could have been ':'s in the value.
-    value = ":".join(key_value_pair[1:]).lstrip()
-    return key, value
+    Returns:
+        A generator of the reviews that are kept.
+    """
+    for review in record_format.iterate_reviews(rate_beer_file):
+        if reviewer_filter is None or review["review"].get("profileName") in reviewer_filter:
+            yield review
 
 
-def _create_date_details(rate_beer_review_list):
+def _read_rate_beer_chunk(file_location: Path,
+                          start: int,
+                          end: Optional[int],
+                          record_format: RecordFormat,
+                          reviewer_filter: Optional[_ReviewerFilter] = None,
+                          timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE
+                          ) -> Tuple[List[Dict[str, Dict[str, str]]], Counter]:
     """
-    Creates the fields of Year, Month and DayOfWeek for each review.
+    Reads the reviews in a byte range of the file with the date fields created.
+
+    Args:
+        file_location: The rate beer file.
+        start: The byte to start at.
+        end: The byte to stop at, or None to read to the end of the file.
+        record_format: The format of the file's records.
+        reviewer_filter: The reviewers to keep, or None to keep every reviewer.
+        timezone: The timezone to create the date fields in.
+
+    Returns:
+        The reviews and the number of reviews of each reviewer in this range.
+    """
+    reviews = []
+    reviewers = Counter()
+    with open_input(file_location) as rate_beer_file:
+        for review in _iterate_kept_reviews(_iterate_chunk_lines(rate_beer_file, start, end), reviewer_filter,
+                                            record_format):
+            reviewer = review["review"].get("profileName")
+            if reviewer is not None:
+                reviewers[reviewer] += 1
+            reviews.append(review)
+    return _create_date_details(reviews, timezone), reviewers
+
+
+def _read_rate_beer_table_chunk(file_location: Path,
+                                start: int,
+                                end: Optional[int],
+                                record_format: RecordFormat,
+                                reviewer_filter: Optional[_ReviewerFilter] = None) -> RateBeerReviewTable:
+    """
+    Reads the reviews in a byte range of the file into a table.
+
+    Args:
+        file_location: The rate beer file.
+        start: The byte to start at.
+        end: The byte to stop at, or None to read to the end of the file.
+        record_format: The format of the file's records.
+        reviewer_filter: The reviewers to keep, or None to keep every reviewer.
+
+    Returns:
+        The reviews in this range as a table.
+    """
+    with open_input(file_location) as rate_beer_file:
+        return RateBeerReviewTable.from_reviews(
+            _iterate_kept_reviews(_iterate_chunk_lines(rate_beer_file, start, end), reviewer_filter, record_format))
+
+
+def _create_date_details(rate_beer_review_list, timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE):
+    """
+    Creates the fields of Year, Month and DayOfWeek for each review. The times are converted
+    together and each review's fields share the entity name of their distinct value.
 
     Args:
         rate_beer_review_list: A list of the reviews.
+        timezone: The name of the timezone, a tzinfo, or None to use the local timezone.
 
     Returns:
         The list of reviews with information extracted from the time field's value.
     """
-    rate_beer = rate_beer_review_list.copy()
-    for i in range(len(rate_beer_review_list)):
-        time_value_as_int = int(rate_beer_review_list[i]["review"]["time"])
-        date_timestamp = datetime.fromtimestamp(time_value_as_int)
-        weekday = date_timestamp.weekday()
-        year = date_timestamp.year
-        month = date_timestamp.month
-        rate_beer[i]["review"]["Year"] = "yr_" + str(year)
-        rate_beer[i]["review"]["DayOfWeek"] = "wk_" + str(weekday)
-        rate_beer[i]["review"]["Month"] = "mon_" + str(month)
-    return rate_beer
+    times = np.fromiter((int(review["review"]["time"]) for review in rate_beer_review_list),
+                        dtype=np.int64, count=len(rate_beer_review_list))
+    for field, (codes, names) in create_date_columns(times, timezone).items():
+        for review, code in zip(rate_beer_review_list, codes.tolist()):
+            review["review"][field] = names[code]
+    return rate_beer_review_list
+
+
+def _get_timezone_key(timezone: Union[str, tzinfo, None]) -> Optional[str]:
+    """
+    Returns:
+        The timezone as it is kept in the cache key, the local timezone is kept as its names.
+    """
+    if timezone is None:
+        return "local:" + ",".join(time.tzname)
+    return str(timezone)
 
 
 def _create_review_id(rate_beer):
@@ -353,26 +1009,93 @@ def _create_review_id(rate_beer):
     return sorted_reviews
 
 
-def _add_triples(key, list_of_head_rel_tail, review_id, review):
+class _EntityVocabulary:
     """
-    Adds a triple in the format of <entity1, relationship, entity2>
+    Interns the entities into ids by their prefix and value. The name of an entity, its prefix
+    and value joined, is only built the first time the value is seen with that prefix.
+    """
+
+    def __init__(self, entity_to_id: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            entity_to_id: The fixed entity ids to use, other entities are given no id. Without
+                this each new entity is given the next id.
+        """
+        self._fixed = entity_to_id is not None
+        self.entity_to_id: Dict[str, int] = dict(entity_to_id) if self._fixed else {}
+        self._prefix_value_ids: Dict[str, Dict[str, Optional[int]]] = {}
+
+    def get_id(self, prefix: str, value: str) -> Optional[int]:
+        """
+        Returns:
+            The id of the entity, or None if the ids are fixed and the entity isn't one of them.
+        """
+        value_ids = self._prefix_value_ids.get(prefix)
+        if value_ids is None:
+            value_ids = self._prefix_value_ids[prefix] = {}
+        try:
+            return value_ids[value]
+        except KeyError:
+            entity = prefix + value
+            if self._fixed:
+                entity_id = self.entity_to_id.get(entity)
+            else:
+                entity_id = self.entity_to_id.setdefault(entity, len(self.entity_to_id))
+            value_ids[value] = entity_id
+            return entity_id
+
+
+def _iterate_review_triple_parts(review_id: str,
+                                 review: Dict[str, Dict[str, str]],
+                                 beer_styles: Optional[Set[Tuple[str, str]]] = None
+                                 ) -> Iterator[Tuple[str, str, str, str, str]]:
+    """
+    Generates the triples of the review and beer fields of a review with the head and tail split
+    into their prefix and value.
+
     Args:
-        key:
-        list_of_head_rel_tail: The list to add the triple to.
-        review_id: The id of the review to add to.
-        review: The review.
+        review_id: The id of the review.
+        review: The review, without its "time" field.
+        beer_styles: The (beer, style) pairs whose style triple has already been generated, the
+            style triple is skipped for these and this review's pair is added. None always
+            generates the style triple.
 
     Returns:
+        A generator of the (head prefix, head, relationship, tail prefix, tail) of each triple.
     """
-    for field, value in review[key].items():
-        if field == "style":
-            beer_id = "bee" + review["beer"]["beerId"]
-            list_of_head_rel_tail.append([beer_id, field, value])
-        elif field == "profileName":
-            list_of_head_rel_tail.append([review_id, field, value])
-        else:
-            list_of_head_rel_tail.append([review_id, field, field[:3] + value])
-    return list_of_head_rel_tail
+    for key in ("review", "beer"):
+        for field, value in review[key].items():
+            if field == "style":
+                beer_id = review["beer"]["beerId"]
+                if beer_styles is not None:
+                    if (beer_id, value) in beer_styles:
+                        continue
+                    beer_styles.add((beer_id, value))
+                yield _BEER_PREFIX, beer_id, field, "", value
+            elif field == "profileName":
+                yield "", review_id, field, REVIEWER_PREFIX, value
+            else:
+                yield "", review_id, field, field[:3], value
+
+
+def _create_review_triples(review_id: str,
+                           review: Dict[str, Dict[str, str]],
+                           beer_styles: Optional[Set[Tuple[str, str]]] = None) -> List[List[str]]:
+    """
+    Creates the triples of the review and beer fields of a review.
+
+    Args:
+        review_id: The id of the review.
+        review: The review, without its "time" field.
+        beer_styles: The (beer, style) pairs whose style triple has already been created, see
+            `_iterate_review_triple_parts`.
+
+    Returns:
+        The triples in the form <head, relationship, tail>.
+    """
+    return [[head_prefix + head, relationship, tail_prefix + tail]
+            for head_prefix, head, relationship, tail_prefix, tail
+            in _iterate_review_triple_parts(review_id, review, beer_styles)]
 
 
 def split_and_strip_line(line):
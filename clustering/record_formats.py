@@ -0,0 +1,246 @@
+"""
+The formats of the review files, each read into the same reviews so they share the loaders'
+streaming, id mapping and triple building
+"""
+import abc
+import copy
+import csv
+import hashlib
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional
+
+# Beer fields that are not part of the graph used by the paper.
+_REMOVED_BEER_FIELDS = ("ABV", "name", "brewerId")
+# The text reviews are ignored for this paper, so these lines are skipped before being decoded.
+_REVIEW_TEXT_PREFIX = b"review/text"
+_PROFILE_NAME_PREFIX = b"review/profileName"
+
+# The columns of the My Anime List user anime lists used by `AnimeListRecordFormat`.
+_ANIME_USER_COLUMN = "username"
+_ANIME_ID_COLUMN = "anime_id"
+_ANIME_EPISODES_COLUMN = "my_watched_episodes"
+_ANIME_SCORE_COLUMN = "my_score"
+_ANIME_TIME_COLUMN = "my_last_updated"
+# The columns of the My Anime List anime list read by `read_anime_genres`.
+_ANIME_GENRE_COLUMN = "genre"
+# The style of anime without a genre.
+UNKNOWN_GENRE = "Unknown"
+# My Anime List scores are out of 10, with 0 meaning the anime wasn't scored.
+_ANIME_SCORE_DENOMINATOR = 10
+_EPOCH = datetime(1970, 1, 1)
+
+
+class RecordFormat(abc.ABC):
+    """
+    Reads the records of a review file into reviews of the form
+    {"beer": {name: value}, "review": {name: value}}. The "review" fields must hold the
+    "profileName" and "time", in seconds since the epoch, and may hold the scores as
+    "numerator/denominator", the "beer" fields must hold the "beerId" and "style". Other fields
+    each become a relationship of the graph.
+
+    A file may be split into byte ranges that are each read by a separate process, so a format
+    must be able to find the start of the next record from any byte, see `skip_to_record`.
+    """
+
+    # The byte the records start at, after any header.
+    records_start = 0
+
+    def get_parameters(self) -> Dict[str, Any]:
+        """
+        Returns:
+            The JSON serialisable parameters of the format, kept in the cache keys.
+        """
+        return {"format": type(self).__name__}
+
+    def for_file(self, review_file: BinaryIO) -> "RecordFormat":
+        """
+        Reads anything the format needs from the start of the file, such as a header.
+
+        Args:
+            review_file: The file opened in binary mode at its start.
+
+        Returns:
+            The format to read the file's records with.
+        """
+        return self
+
+    def skip_to_record(self, review_file: BinaryIO):
+        """
+        Moves the file from part way through a line to the start of the next record.
+
+        Args:
+            review_file: The file opened in binary mode.
+        """
+        review_file.readline()
+
+    @abc.abstractmethod
+    def iterate_reviews(self, lines: Iterable[bytes]) -> Iterator[Dict[str, Dict[str, str]]]:
+        """
+        Args:
+            lines: The lines of whole records.
+
+        Returns:
+            A generator of the reviews, everything is just in string format.
+        """
+
+    def iterate_profile_names(self, lines: Iterable[bytes]) -> Iterator[str]:
+        """
+        Finds the reviewer of each review to count the reviews of each reviewer, formats
+        override this when the reviewers can be found without parsing the whole review.
+
+        Args:
+            lines: The lines of whole records.
+
+        Returns:
+            A generator of the reviewer of each review.
+        """
+        for review in self.iterate_reviews(lines):
+            yield review["review"]["profileName"]
+
+
+class RateBeerRecordFormat(RecordFormat):
+    """
+    The rate beer format, a block of "beer/key: value" and "review/key: value" lines for each
+    review with an empty line between the blocks. The `review/text` lines are skipped without
+    being decoded.
+    """
+
+    def skip_to_record(self, review_file: BinaryIO):
+        # Finish the current line, then move past the next empty line.
+        review_file.readline()
+        for line in iter(review_file.readline, b""):
+            if line.strip() == b"":
+                break
+
+    def iterate_reviews(self, lines: Iterable[bytes]) -> Iterator[Dict[str, Dict[str, str]]]:
+        current_rating = {"review": {}, "beer": {}}
+        for line_raw in lines:
+            if line_raw.startswith(_REVIEW_TEXT_PREFIX):
+                continue
+            line = line_raw.decode("utf-8", errors="replace").strip()
+            if line == "":
+                if len(current_rating["review"]) > 0:
+                    yield current_rating
+                    current_rating = {"review": {}, "beer": {}}
+            elif line.startswith("beer"):
+                key, value = _get_line_key_value(line, "beer")
+                if key in _REMOVED_BEER_FIELDS:
+                    continue
+                current_rating["beer"][key] = value
+            else:
+                key, value = _get_line_key_value(line, "review")
+                if key == "text":
+                    continue
+                current_rating["review"][key] = value
+        if len(current_rating["review"]) > 0:
+            yield current_rating
+
+    def iterate_profile_names(self, lines: Iterable[bytes]) -> Iterator[str]:
+        # Only the profileName lines are decoded.
+        for line_raw in lines:
+            if line_raw.lstrip().startswith(_PROFILE_NAME_PREFIX):
+                key, value = _get_line_key_value(line_raw.decode("utf-8", errors="replace").strip(), "review")
+                if key == "profileName":
+                    yield value
+
+
+class AnimeListRecordFormat(RecordFormat):
+    """
+    The user anime lists of the My Anime List dataset, a CSV file with a row for each anime on a
+    user's list such as `UserAnimeList.csv` or `animelists_cleaned.csv`. Each row becomes a
+    review: the user is the "profileName", the anime takes the place of the beer with its genre
+    as the "style", the score out of 10 is the "overall" score and the time is when the list
+    entry was last updated.
+
+    Anime on a list that weren't watched, such as those planned to be watched, are skipped with
+    `min_watched_episodes`, as are rows without a valid time. The file is split between rows, so
+    the rows must not contain quoted line breaks when it is read by several processes.
+    """
+
+    def __init__(self, anime_genres: Optional[Mapping[str, str]] = None, min_watched_episodes: int = 1):
+        """
+        Args:
+            anime_genres: The genre of each anime id, see `read_anime_genres`. Anime without a
+                genre are given `UNKNOWN_GENRE`.
+            min_watched_episodes: The fewest episodes watched for a row to be a review.
+        """
+        self._anime_genres = dict(anime_genres) if anime_genres is not None else {}
+        self._min_watched_episodes = min_watched_episodes
+        self._columns: Optional[List[str]] = None
+
+    def get_parameters(self) -> Dict[str, Any]:
+        genres = "\n".join(f"{anime}\t{genre}" for anime, genre in sorted(self._anime_genres.items()))
+        return {**super().get_parameters(),
+                "anime_genres": hashlib.sha256(genres.encode("utf-8")).hexdigest(),
+                "min_watched_episodes": self._min_watched_episodes}
+
+    def for_file(self, review_file: BinaryIO) -> "AnimeListRecordFormat":
+        header = review_file.readline()
+        record_format = copy.copy(self)
+        record_format._columns = next(csv.reader([header.decode("utf-8-sig")]))
+        record_format.records_start = len(header)
+        missing = {_ANIME_USER_COLUMN, _ANIME_ID_COLUMN, _ANIME_EPISODES_COLUMN, _ANIME_SCORE_COLUMN,
+                   _ANIME_TIME_COLUMN} - set(record_format._columns)
+        assert not missing, f"The anime list is missing the columns {sorted(missing)}."
+        return record_format
+
+    def iterate_reviews(self, lines: Iterable[bytes]) -> Iterator[Dict[str, Dict[str, str]]]:
+        assert self._columns is not None, "The header hasn't been read, see `for_file`."
+        user, anime, episodes, score, updated = (self._columns.index(column) for column in (
+            _ANIME_USER_COLUMN, _ANIME_ID_COLUMN, _ANIME_EPISODES_COLUMN, _ANIME_SCORE_COLUMN, _ANIME_TIME_COLUMN))
+        for row in csv.reader(line.decode("utf-8", errors="replace") for line in lines):
+            if len(row) != len(self._columns):
+                continue
+            review_time = _parse_anime_time(row[updated])
+            if review_time is None or not row[episodes].isdigit() \
+                    or int(row[episodes]) < self._min_watched_episodes:
+                continue
+            review_fields = {}
+            if row[score].isdigit() and int(row[score]) > 0:
+                review_fields["overall"] = f"{row[score]}/{_ANIME_SCORE_DENOMINATOR}"
+            review_fields["time"] = str(review_time)
+            review_fields["profileName"] = row[user]
+            yield {"review": review_fields,
+                   "beer": {"beerId": row[anime], "style": self._anime_genres.get(row[anime], UNKNOWN_GENRE)}}
+
+
+def read_anime_genres(anime_list_file: BinaryIO) -> Dict[str, str]:
+    """
+    Reads the genre of each anime from the My Anime List anime list, `AnimeList.csv`.
+
+    Args:
+        anime_list_file: The anime list opened in binary mode, see `open_input`.
+
+    Returns:
+        The first of the genres listed for each anime id, anime without a genre are left out.
+    """
+    rows = csv.DictReader(line.decode("utf-8-sig", errors="replace") for line in anime_list_file)
+    genres = {}
+    for row in rows:
+        genre = (row.get(_ANIME_GENRE_COLUMN) or "").split(",")[0].strip()
+        if genre:
+            genres[row[_ANIME_ID_COLUMN]] = genre
+    return genres
+
+
+def _parse_anime_time(value: str) -> Optional[int]:
+    """
+    Returns:
+        The seconds since the epoch of a UTC "YYYY-MM-DD HH:MM:SS" time, or of a time that is
+        already in seconds, None for an invalid time such as "0000-00-00 00:00:00".
+    """
+    if value.isdigit():
+        return int(value)
+    try:
+        return int((datetime.fromisoformat(value) - _EPOCH).total_seconds())
+    except ValueError:
+        return None
+
+
+def _get_line_key_value(line, category):
+    # The format is "category/key: value", there could be ':'s in the value.
+    prefix = f"{category}/"
+    if line.startswith(prefix):
+        line = line[len(prefix):]
+    key, _, value = line.partition(":")
+    return key, value.lstrip()
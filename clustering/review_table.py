@@ -0,0 +1,257 @@
+"""
+Columnar representation of the rate beer reviews
+"""
+from array import array
+from datetime import tzinfo
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from clustering.dates import DEFAULT_TIMEZONE, expand_times
+
+SCORE_FIELDS = ("appearance", "aroma", "palate", "taste", "overall")
+
+
+class RateBeerReviewTable:
+    """
+    Holds the rate beer reviews as columns instead of a list of dictionaries of strings.
+    The profileName, beerId and style fields are integer coded against a vocabulary, the
+    scores are kept as numerator and denominator columns and the time is kept as int64.
+
+    This allows the date expansion, the sorting by time and the precedes/succeeds linking
+    to be a single vectorised operation each.
+    """
+
+    def __init__(self,
+                 profile_names: np.ndarray,
+                 profile_vocabulary: List[str],
+                 beer_ids: np.ndarray,
+                 beer_vocabulary: List[str],
+                 styles: np.ndarray,
+                 style_vocabulary: List[str],
+                 scores: np.ndarray,
+                 score_denominators: np.ndarray,
+                 time: np.ndarray):
+        self.profile_names = profile_names
+        self.profile_vocabulary = profile_vocabulary
+        self.beer_ids = beer_ids
+        self.beer_vocabulary = beer_vocabulary
+        self.styles = styles
+        self.style_vocabulary = style_vocabulary
+        self.scores = scores
+        self.score_denominators = score_denominators
+        self.time = time
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_reviews(cls, reviews: Iterable[Dict[str, Dict[str, str]]]) -> "RateBeerReviewTable":
+        """
+        Builds the table from the reviews, these can be streamed as only the coded values
+        are kept.
+
+        Args:
+            reviews: The reviews in the form {"beer": {name: value}, "review": {name: value}}.
+
+        Returns:
+            The reviews as a table.
+        """
+        profile_vocabulary: Dict[str, int] = {}
+        beer_vocabulary: Dict[str, int] = {}
+        style_vocabulary: Dict[str, int] = {}
+        profile_names = array("i")
+        beer_ids = array("i")
+        styles = array("i")
+        scores = array("h")
+        score_denominators = array("h")
+        time = array("q")
+
+        for review in reviews:
+            review_fields = review["review"]
+            beer_fields = review["beer"]
+            profile_names.append(profile_vocabulary.setdefault(review_fields["profileName"],
+                                                               len(profile_vocabulary)))
+            beer_ids.append(beer_vocabulary.setdefault(beer_fields["beerId"], len(beer_vocabulary)))
+            styles.append(style_vocabulary.setdefault(beer_fields["style"], len(style_vocabulary)))
+            for field in SCORE_FIELDS:
+                numerator, denominator = _split_score(review_fields.get(field, ""))
+                scores.append(numerator)
+                score_denominators.append(denominator)
+            time.append(int(review_fields["time"]))
+
+        return cls(profile_names=np.frombuffer(profile_names, dtype=np.int32),
+                   profile_vocabulary=list(profile_vocabulary),
+                   beer_ids=np.frombuffer(beer_ids, dtype=np.int32),
+                   beer_vocabulary=list(beer_vocabulary),
+                   styles=np.frombuffer(styles, dtype=np.int32),
+                   style_vocabulary=list(style_vocabulary),
+                   scores=np.frombuffer(scores, dtype=np.int16).reshape(-1, len(SCORE_FIELDS)),
+                   score_denominators=np.frombuffer(score_denominators,
+                                                    dtype=np.int16).reshape(-1, len(SCORE_FIELDS)),
+                   time=np.frombuffer(time, dtype=np.int64))
+
+    @classmethod
+    def concatenate(cls, tables: List["RateBeerReviewTable"]) -> "RateBeerReviewTable":
+        """
+        Joins tables one after the other, merging their vocabularies.
+
+        Args:
+            tables: The tables to join.
+
+        Returns:
+            A single table with the rows of each table in order.
+        """
+        profile_names, profile_vocabulary = _merge_coded_columns(
+            [(table.profile_names, table.profile_vocabulary) for table in tables])
+        beer_ids, beer_vocabulary = _merge_coded_columns([(table.beer_ids, table.beer_vocabulary) for table in tables])
+        styles, style_vocabulary = _merge_coded_columns([(table.styles, table.style_vocabulary) for table in tables])
+        return cls(profile_names=profile_names,
+                   profile_vocabulary=profile_vocabulary,
+                   beer_ids=beer_ids,
+                   beer_vocabulary=beer_vocabulary,
+                   styles=styles,
+                   style_vocabulary=style_vocabulary,
+                   scores=np.concatenate([table.scores for table in tables]),
+                   score_denominators=np.concatenate([table.score_denominators for table in tables]),
+                   time=np.concatenate([table.time for table in tables]))
+
+    def take(self, indices: np.ndarray) -> "RateBeerReviewTable":
+        """
+        Selects the rows of the table, keeping the same vocabularies.
+
+        Args:
+            indices: The row indices or a boolean mask of the rows to keep.
+
+        Returns:
+            A new table with only the selected rows.
+        """
+        return RateBeerReviewTable(profile_names=self.profile_names[indices],
+                                   profile_vocabulary=self.profile_vocabulary,
+                                   beer_ids=self.beer_ids[indices],
+                                   beer_vocabulary=self.beer_vocabulary,
+                                   styles=self.styles[indices],
+                                   style_vocabulary=self.style_vocabulary,
+                                   scores=self.scores[indices],
+                                   score_denominators=self.score_denominators[indices],
+                                   time=self.time[indices])
+
+    def reviewer_counts(self) -> np.ndarray:
+        """
+        Returns:
+            The number of reviews of each reviewer, indexed by the profile code.
+        """
+        return np.bincount(self.profile_names, minlength=len(self.profile_vocabulary))
+
+    def sort_by_time(self) -> "RateBeerReviewTable":
+        """
+        Sorts the reviews by ascending time, reviews with the same time keep the file order.
+        The row index of the sorted table is the id of the review.
+
+        Returns:
+            The sorted table.
+        """
+        return self.take(np.argsort(self.time, kind="stable"))
+
+    def date_details(self, timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Creates the Year, Month and DayOfWeek columns from the time column.
+
+        Args:
+            timezone: The name of the timezone, a tzinfo, or None to use the local timezone.
+
+        Returns:
+            The year, the month (1-12) and the day of the week (Monday is 0) of each review.
+        """
+        return expand_times(self.time, timezone)
+
+    def link_reviews(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Connects each review to the next and previous review of the same reviewer. The table is
+        expected to be sorted by time.
+
+        Returns:
+            The row of the review each review precedes and the row of the review each review
+            succeeds, with -1 where there is no such review.
+        """
+        number_of_reviews = len(self)
+        precedes = np.full(number_of_reviews, -1, dtype=np.int64)
+        succeeds = np.full(number_of_reviews, -1, dtype=np.int64)
+        # Group the rows by reviewer while keeping them in time order within the reviewer.
+        order = np.lexsort((np.arange(number_of_reviews), self.profile_names))
+        same_reviewer = self.profile_names[order[1:]] == self.profile_names[order[:-1]]
+        earlier = order[:-1][same_reviewer]
+        later = order[1:][same_reviewer]
+        precedes[earlier] = later
+        succeeds[later] = earlier
+        return precedes, succeeds
+
+    def to_reviews(self, timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE) -> List[Dict[str, Dict[str, str]]]:
+        """
+        Converts the table back into the list of dictionaries created by
+        `RateBeerLoader.load_rate_beer`, the table is expected to be sorted by time.
+
+        Args:
+            timezone: The timezone to create the date fields in.
+
+        Returns:
+            The reviews with their "id", "precedes" and "succeeds" values.
+        """
+        year, month, day_of_week = self.date_details(timezone)
+        precedes, succeeds = self.link_reviews()
+        reviews = []
+        for i in range(len(self)):
+            review_fields = {}
+            for j, field in enumerate(SCORE_FIELDS):
+                if self.score_denominators[i, j] >= 0:
+                    review_fields[field] = f"{self.scores[i, j]}/{self.score_denominators[i, j]}"
+            review_fields["profileName"] = self.profile_vocabulary[self.profile_names[i]]
+            review_fields["Year"] = f"yr_{year[i]}"
+            review_fields["DayOfWeek"] = f"wk_{day_of_week[i]}"
+            review_fields["Month"] = f"mon_{month[i]}"
+            review = {"review": review_fields,
+                      "beer": {"beerId": self.beer_vocabulary[self.beer_ids[i]],
+                               "style": self.style_vocabulary[self.styles[i]]},
+                      "id": str(i)}
+            if precedes[i] >= 0:
+                review["precedes"] = str(precedes[i])
+            if succeeds[i] >= 0:
+                review["succeeds"] = str(succeeds[i])
+            reviews.append(review)
+        return reviews
+
+
+def _merge_coded_columns(coded_columns: List[Tuple[np.ndarray, List[str]]]) -> Tuple[np.ndarray, List[str]]:
+    """
+    Joins integer coded columns that each have their own vocabulary.
+
+    Args:
+        coded_columns: The codes and the vocabulary of each column.
+
+    Returns:
+        The joined codes against the merged vocabulary, and the merged vocabulary.
+    """
+    vocabulary: Dict[str, int] = {}
+    merged_codes = []
+    for codes, column_vocabulary in coded_columns:
+        recode = np.array([vocabulary.setdefault(value, len(vocabulary)) for value in column_vocabulary],
+                          dtype=np.int32)
+        merged_codes.append(recode[codes] if len(recode) else codes)
+    return np.concatenate(merged_codes), list(vocabulary)
+
+
+def _split_score(score: str) -> Tuple[int, int]:
+    """
+    Splits a score such as "4/5" into its numerator and denominator.
+
+    Args:
+        score: The score as found in the rate beer file.
+
+    Returns:
+        The numerator and the denominator, both are -1 if the score is missing.
+    """
+    numerator, _, denominator = score.partition("/")
+    if not denominator:
+        return -1, -1
+    return int(numerator), int(denominator)
@@ -0,0 +1,334 @@
+"""
+Answers which segment a reviewer is in while the service is running, from the embeddings of a
+trained model and the centroids of the clustered reviewers
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from clustering.embeddings import (_TRAINED_MODEL_FILE, find_reviewer_entities, load_reviewer_embeddings,
+                                   read_training_triples)
+from clustering.rate_beer_loader import REVIEWER_PREFIX
+
+# The percentiles of the lookup latencies reported by `get_statistics`.
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class SegmentService:
+    """
+    Assigns reviewers to their nearest centroids as they are asked for, without a model call for
+    each lookup.
+
+    Lookups of reviewers that aren't cached are queued and, once the event loop gets to them,
+    every queued reviewer is gathered with a single call to `gather`, so many concurrent lookups
+    cost one embedding gather rather than one each. The embeddings of the most recently looked
+    up reviewers are kept in an LRU cache and are assigned without waiting for a gather.
+
+    The latency of each lookup, from the call to the assignment, is kept for the last
+    `latency_window` lookups, see `get_statistics`.
+    """
+
+    def __init__(self,
+                 gather: Callable[[np.ndarray], np.ndarray],
+                 name_to_id: Mapping[str, int],
+                 centroids: np.ndarray,
+                 num_nearest: int = 3,
+                 cache_size: int = 100000,
+                 max_batch_size: int = 4096,
+                 max_wait_seconds: float = 0.0,
+                 latency_window: int = 100000):
+        """
+        Args:
+            gather: Takes an array of ids and returns the (n, d) embeddings of those ids.
+            name_to_id: The id of each reviewer's name.
+            centroids: The (k, d) centroids of the segments, for example those of a fitted
+                `RateBeerCustomerClusterCreator`.
+            num_nearest: The number of nearest centroids returned with each assignment.
+            cache_size: The number of reviewer embeddings kept in the LRU cache, 0 keeps none.
+            max_batch_size: The most reviewers gathered at once, a full batch is gathered
+                straight away.
+            max_wait_seconds: How long to wait for more lookups before gathering a batch, 0
+                only batches the lookups made before the event loop next runs.
+            latency_window: The number of most recent lookup latencies kept.
+        """
+        self._gather = gather
+        self._name_to_id = name_to_id
+        self._centroids = _as_real(np.asarray(centroids)).astype(np.float64)
+        self._centroid_squared_norms = np.einsum("ij,ij->i", self._centroids, self._centroids)
+        self._num_nearest = min(num_nearest, len(self._centroids))
+        self._cache_size = cache_size
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_seconds
+
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._latencies = deque(maxlen=latency_window)
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._batches = 0
+        self._gathered = 0
+
+    @classmethod
+    def from_model(cls,
+                   model,
+                   triples_factory,
+                   centroids: np.ndarray,
+                   prefix: str = REVIEWER_PREFIX,
+                   **kwargs) -> "SegmentService":
+        """
+        Gathers the embeddings from the entity representations of a trained model.
+
+        Args:
+            model: The trained PyKEEN model.
+            triples_factory: The triples factory of the model, the reviewers are found from its
+                triples, see `find_reviewer_entities`.
+            centroids: The (k, d) centroids of the segments.
+            prefix: The prefix of the reviewer entities.
+            **kwargs: The other arguments of `SegmentService`.
+
+        Returns:
+            The service.
+        """
+        import torch
+
+        reviewer_names, reviewer_ids = find_reviewer_entities(triples_factory, prefix=prefix)
+        entity_representations = model.entity_representations[0]
+
+        def gather(ids: np.ndarray) -> np.ndarray:
+            with torch.no_grad():
+                return entity_representations(indices=torch.as_tensor(ids, device=model.device)).cpu().numpy()
+
+        return cls(gather, dict(zip(reviewer_names, reviewer_ids.tolist())), centroids, **kwargs)
+
+    @classmethod
+    def from_pipeline_directory(cls,
+                                pipeline_directory: Union[Path, str],
+                                centroids: np.ndarray,
+                                **kwargs) -> "SegmentService":
+        """
+        Loads the model saved by PyKEEN's `save_to_directory`, see `from_model`.
+
+        Args:
+            pipeline_directory: The directory the pipeline result was saved to.
+            centroids: The (k, d) centroids of the segments.
+            **kwargs: The other arguments of `from_model`.
+
+        Returns:
+            The service.
+        """
+        import torch
+
+        pipeline_directory = Path(pipeline_directory)
+        model = torch.load(pipeline_directory.joinpath(_TRAINED_MODEL_FILE), weights_only=False)
+        return cls.from_model(model, read_training_triples(pipeline_directory), centroids, **kwargs)
+
+    @classmethod
+    def from_embeddings_directory(cls,
+                                  directory: Union[Path, str],
+                                  centroids: np.ndarray,
+                                  **kwargs) -> "SegmentService":
+        """
+        Gathers the embeddings from those written by `extract_reviewer_embeddings`, which are
+        memory mapped so neither PyTorch nor the model is needed.
+
+        Args:
+            directory: The directory the embeddings were written to.
+            centroids: The (k, d) centroids of the segments.
+            **kwargs: The other arguments of `SegmentService`.
+
+        Returns:
+            The service.
+        """
+        embeddings, reviewer_names = load_reviewer_embeddings(directory)
+
+        def gather(ids: np.ndarray) -> np.ndarray:
+            # Reading the rows in file order is faster for memory mapped embeddings.
+            order = np.argsort(ids)
+            gathered = np.empty((len(ids),) + embeddings.shape[1:], dtype=embeddings.dtype)
+            gathered[order] = embeddings[ids[order]]
+            return gathered
+
+        return cls(gather, {name: i for i, name in enumerate(reviewer_names)}, centroids, **kwargs)
+
+    async def assign(self, profile_name: str) -> Dict[str, Any]:
+        """
+        Args:
+            profile_name: The name of the reviewer.
+
+        Returns:
+            The reviewer's segment and its nearest segments with their euclidean distances,
+            nearest first.
+
+        Raises:
+            KeyError: If the reviewer isn't one of the model's entities.
+        """
+        start = time.perf_counter()
+        try:
+            embedding = self._cache.get(profile_name)
+            if embedding is None:
+                self._cache_misses += 1
+                embedding = await self._queue(profile_name)
+            else:
+                self._cache_hits += 1
+                self._cache.move_to_end(profile_name)
+            return self._assign_embeddings([profile_name], embedding[None])[0]
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+
+    async def assign_many(self, profile_names: Sequence[str]) -> List[Dict[str, Any]]:
+        """
+        Assigns the reviewers concurrently, so the reviewers that aren't cached are gathered
+        together.
+
+        Args:
+            profile_names: The names of the reviewers.
+
+        Returns:
+            The assignment of each reviewer, see `assign`.
+        """
+        return list(await asyncio.gather(*(self.assign(profile_name) for profile_name in profile_names)))
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """
+        Returns:
+            The number of lookups, cache hits and misses, gathers and reviewers gathered, and
+            the latency percentiles of the most recent lookups in seconds.
+        """
+        statistics = {"lookups": self._cache_hits + self._cache_misses,
+                      "cache_hits": self._cache_hits,
+                      "cache_misses": self._cache_misses,
+                      "cached_reviewers": len(self._cache),
+                      "batches": self._batches,
+                      "gathered_reviewers": self._gathered,
+                      "mean_batch_size": self._gathered / self._batches if self._batches else 0.0}
+        latencies = np.fromiter(self._latencies, dtype=np.float64, count=len(self._latencies))
+        for percentile in LATENCY_PERCENTILES:
+            statistics[f"latency_p{percentile}_seconds"] = \
+                float(np.percentile(latencies, percentile)) if len(latencies) else None
+        return statistics
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        """
+        Serves lookups over TCP. Each request is a line holding a reviewer's name and is
+        answered by a line of JSON holding the assignment, or the name and an "error" for an
+        unknown reviewer. The requests of a connection are answered in order.
+
+        Args:
+            host: The address to listen on, the default only accepts local connections.
+            port: The port to listen on, 0 picks a free port.
+
+        Returns:
+            The started server, its port is in `server.sockets[0].getsockname()[1]`.
+        """
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            async for line in reader:
+                profile_name = line.decode("utf-8").rstrip("\r\n")
+                try:
+                    response = await self.assign(profile_name)
+                except KeyError:
+                    response = {"profileName": profile_name, "error": "unknown reviewer"}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _queue(self, profile_name: str) -> asyncio.Future:
+        """
+        Returns:
+            A future of the reviewer's embedding, set by the next gather.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(profile_name, []).append(future)
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_wait_seconds, self._flush)
+        return future
+
+    def _flush(self):
+        """
+        Gathers the embeddings of every queued reviewer at once and sets their futures.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        names = []
+        for profile_name, futures in pending.items():
+            if profile_name in self._name_to_id:
+                names.append(profile_name)
+            else:
+                _set_futures(futures, exception=KeyError(profile_name))
+        if not names:
+            return
+        try:
+            embeddings = np.asarray(self._gather(np.array([self._name_to_id[name] for name in names],
+                                                          dtype=np.int64)))
+        except Exception as error:
+            for profile_name in names:
+                _set_futures(pending[profile_name], exception=error)
+            return
+        self._batches += 1
+        self._gathered += len(names)
+        for profile_name, embedding in zip(names, embeddings):
+            self._cache_embedding(profile_name, embedding)
+            _set_futures(pending[profile_name], result=embedding)
+
+    def _cache_embedding(self, profile_name: str, embedding: np.ndarray):
+        if self._cache_size <= 0:
+            return
+        self._cache[profile_name] = embedding
+        self._cache.move_to_end(profile_name)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _assign_embeddings(self, profile_names: List[str], embeddings: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            The nearest centroids of each embedding, see `assign`.
+        """
+        embeddings = _as_real(embeddings).astype(np.float64)
+        squared_distances = np.maximum(np.einsum("ij,ij->i", embeddings, embeddings)[:, None]
+                                       - 2 * embeddings @ self._centroids.T
+                                       + self._centroid_squared_norms[None, :], 0)
+        nearest = np.argsort(squared_distances, axis=1)[:, :self._num_nearest]
+        distances = np.sqrt(np.take_along_axis(squared_distances, nearest, axis=1))
+        return [{"profileName": profile_name,
+                 "segment": int(segments[0]),
+                 "nearest_segments": segments.tolist(),
+                 "distances": segment_distances.tolist()}
+                for profile_name, segments, segment_distances in zip(profile_names, nearest, distances)]
+
+
+def _as_real(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        The embeddings as real vectors, the euclidean distance of complex vectors is that of
+        their real and imaginary parts.
+    """
+    if np.iscomplexobj(embeddings):
+        return np.concatenate([embeddings.real, embeddings.imag], axis=-1)
+    return embeddings
+
+
+def _set_futures(futures: List[asyncio.Future], result: Any = None, exception: Optional[BaseException] = None):
+    # A lookup that was cancelled while waiting has nothing to set.
+    for future in futures:
+        if future.done():
+            continue
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
@@ -0,0 +1,249 @@
+"""
+Profiles the reviews of each customer segment
+"""
+import os
+from datetime import tzinfo
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from clustering.dates import DEFAULT_TIMEZONE, expand_times
+from clustering.review_table import SCORE_FIELDS, RateBeerReviewTable
+
+SEGMENT_PROFILE_FILE = "segment_profile.npz"
+# The segment of the reviewers that weren't clustered.
+UNASSIGNED_SEGMENT = -1
+
+
+class SegmentProfile:
+    """
+    The aggregates of the reviews of each segment, each array has a row per segment in the order
+    of `segments`. The reviews of reviewers without a segment aren't counted.
+
+    The mean scores are fractions of the most a score can be, as the scores of each field are
+    out of different totals, and are NaN for a segment without any such score. The top styles
+    and beers are padded with empty names and zero counts for segments with fewer of them.
+    """
+
+    def __init__(self,
+                 segments: np.ndarray,
+                 review_counts: np.ndarray,
+                 reviewer_counts: np.ndarray,
+                 mean_scores: np.ndarray,
+                 top_styles: np.ndarray,
+                 top_style_counts: np.ndarray,
+                 top_beers: np.ndarray,
+                 top_beer_counts: np.ndarray,
+                 years: np.ndarray,
+                 year_activity: np.ndarray,
+                 month_activity: np.ndarray,
+                 day_of_week_activity: np.ndarray):
+        self.segments = segments
+        self.review_counts = review_counts
+        self.reviewer_counts = reviewer_counts
+        self.mean_scores = mean_scores
+        self.top_styles = top_styles
+        self.top_style_counts = top_style_counts
+        self.top_beers = top_beers
+        self.top_beer_counts = top_beer_counts
+        self.years = years
+        self.year_activity = year_activity
+        self.month_activity = month_activity
+        self.day_of_week_activity = day_of_week_activity
+
+    def __len__(self):
+        return len(self.segments)
+
+    def get_segment(self, segment: int) -> Dict[str, object]:
+        """
+        Args:
+            segment: The segment.
+
+        Returns:
+            The profile of a single segment with plain Python values, ready for a dashboard.
+        """
+        row = int(np.flatnonzero(self.segments == segment)[0])
+        return {"segment": segment,
+                "reviews": int(self.review_counts[row]),
+                "reviewers": int(self.reviewer_counts[row]),
+                "mean_scores": {field: float(score) for field, score in zip(SCORE_FIELDS, self.mean_scores[row])},
+                "top_styles": _get_named_counts(self.top_styles[row], self.top_style_counts[row]),
+                "top_beers": _get_named_counts(self.top_beers[row], self.top_beer_counts[row]),
+                "years": dict(zip(self.years.tolist(), self.year_activity[row].tolist())),
+                # Months are 1 to 12 and the days of the week are 0 to 6 with Monday as 0.
+                "months": dict(zip(range(1, 13), self.month_activity[row].tolist())),
+                "days_of_week": dict(zip(range(7), self.day_of_week_activity[row].tolist()))}
+
+    def save(self, location: Union[Path, str]):
+        """
+        Saves the profile as a single `.npz` file, written under a temporary name first so a
+        partial file is never loaded.
+
+        Args:
+            location: The file to write.
+        """
+        location = Path(location)
+        location.parent.mkdir(parents=True, exist_ok=True)
+        partial_location = location.with_name(location.name + ".partial")
+        with partial_location.open("wb") as profile_file:
+            np.savez(profile_file, **vars(self))
+        os.replace(partial_location, location)
+
+    @classmethod
+    def load(cls, location: Union[Path, str]) -> "SegmentProfile":
+        """
+        Loads a profile written by `save`.
+
+        Args:
+            location: The file the profile was written to.
+
+        Returns:
+            The profile.
+        """
+        with np.load(location) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+
+def profile_segments(table: RateBeerReviewTable,
+                     reviewer_labels: np.ndarray,
+                     reviewer_names: Optional[Sequence[str]] = None,
+                     top_n: int = 10,
+                     timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE) -> SegmentProfile:
+    """
+    Computes the aggregates of every segment at once, each aggregate is a single grouped count
+    or sum over the review table rather than a pass over the reviews of each segment.
+
+    Args:
+        table: The reviews.
+        reviewer_labels: The segment of each reviewer, for example the labels of a fitted
+            `RateBeerCustomerClusterCreator`.
+        reviewer_names: The reviewer of each label, None when the labels are in the order of
+            the table's profile vocabulary.
+        top_n: The number of top styles and beers of each segment.
+        timezone: The timezone the Year, Month and DayOfWeek activity is counted in.
+
+    Returns:
+        The profile of each segment.
+    """
+    reviewer_segments = _get_reviewer_segments(table, np.asarray(reviewer_labels), reviewer_names)
+    has_segment = reviewer_segments != UNASSIGNED_SEGMENT
+    segments, segment_rows = np.unique(reviewer_segments[has_segment], return_inverse=True)
+    # The row of each reviewer's segment in the profile, -1 for reviewers without a segment.
+    profile_rows = np.full(len(reviewer_segments), -1, dtype=np.int64)
+    profile_rows[has_segment] = segment_rows
+    review_rows = profile_rows[table.profile_names]
+    assigned = review_rows >= 0
+    review_rows = review_rows[assigned]
+    number_of_segments = len(segments)
+
+    review_counts = np.bincount(review_rows, minlength=number_of_segments)
+    reviewer_counts = np.bincount(profile_rows[profile_rows >= 0], minlength=number_of_segments)
+    mean_scores = _mean_scores(review_rows, table.scores[assigned], table.score_denominators[assigned],
+                               number_of_segments)
+    top_styles, top_style_counts = _top_values(review_rows, table.styles[assigned], table.style_vocabulary,
+                                               number_of_segments, top_n)
+    top_beers, top_beer_counts = _top_values(review_rows, table.beer_ids[assigned], table.beer_vocabulary,
+                                             number_of_segments, top_n)
+
+    year, month, day_of_week = expand_times(table.time[assigned], timezone)
+    first_year, last_year = (int(year.min()), int(year.max())) if len(year) else (0, -1)
+    years = np.arange(first_year, last_year + 1)
+    year_activity = _count_by_segment(review_rows, year - first_year, number_of_segments, len(years))
+    month_activity = _count_by_segment(review_rows, month - 1, number_of_segments, 12)
+    day_of_week_activity = _count_by_segment(review_rows, day_of_week, number_of_segments, 7)
+    return SegmentProfile(segments=segments,
+                          review_counts=review_counts,
+                          reviewer_counts=reviewer_counts,
+                          mean_scores=mean_scores,
+                          top_styles=top_styles,
+                          top_style_counts=top_style_counts,
+                          top_beers=top_beers,
+                          top_beer_counts=top_beer_counts,
+                          years=years,
+                          year_activity=year_activity,
+                          month_activity=month_activity,
+                          day_of_week_activity=day_of_week_activity)
+
+
+def _get_reviewer_segments(table: RateBeerReviewTable,
+                          reviewer_labels: np.ndarray,
+                          reviewer_names: Optional[Sequence[str]]) -> np.ndarray:
+    """
+    Returns:
+        The segment of each reviewer of the table's profile vocabulary, `UNASSIGNED_SEGMENT` for
+        the reviewers without a label.
+    """
+    if reviewer_names is None:
+        assert len(reviewer_labels) == len(table.profile_vocabulary), \
+            "Without the reviewer names there must be a label for each reviewer of the table."
+        return reviewer_labels.astype(np.int64)
+    assert len(reviewer_labels) == len(reviewer_names), "There must be a name for each label."
+    name_to_label = dict(zip(reviewer_names, reviewer_labels.tolist()))
+    return np.array([name_to_label.get(name, UNASSIGNED_SEGMENT) for name in table.profile_vocabulary],
+                    dtype=np.int64)
+
+
+def _count_by_segment(review_rows: np.ndarray,
+                      values: np.ndarray,
+                      number_of_segments: int,
+                      number_of_values: int) -> np.ndarray:
+    """
+    Returns:
+        The (segments, values) number of reviews of each segment with each value.
+    """
+    counts = np.bincount(review_rows * number_of_values + values, minlength=number_of_segments * number_of_values)
+    return counts.reshape(number_of_segments, number_of_values)
+
+
+def _mean_scores(review_rows: np.ndarray,
+                 scores: np.ndarray,
+                 denominators: np.ndarray,
+                 number_of_segments: int) -> np.ndarray:
+    """
+    Returns:
+        The (segments, score fields) mean of the present scores as a fraction of their totals.
+    """
+    mean_scores = np.empty((number_of_segments, len(SCORE_FIELDS)))
+    for i in range(len(SCORE_FIELDS)):
+        present = denominators[:, i] > 0
+        fractions = scores[present, i] / denominators[present, i]
+        totals = np.bincount(review_rows[present], weights=fractions, minlength=number_of_segments)
+        counts = np.bincount(review_rows[present], minlength=number_of_segments)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_scores[:, i] = totals / counts
+    return mean_scores
+
+
+def _top_values(review_rows: np.ndarray,
+                codes: np.ndarray,
+                vocabulary: List[str],
+                number_of_segments: int,
+                top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the most reviewed values of each segment from the counts of the (segment, value)
+    pairs that occur, rather than a dense segments by vocabulary table.
+
+    Returns:
+        The (segments, top_n) names of the top values, most reviewed first, and their counts.
+    """
+    pairs, counts = np.unique(review_rows * len(vocabulary) + codes.astype(np.int64), return_counts=True)
+    pair_rows, pair_codes = np.divmod(pairs, max(len(vocabulary), 1))
+    # Most reviewed first within each segment, ties in vocabulary order.
+    order = np.lexsort((pair_codes, -counts, pair_rows))
+    pair_rows, pair_codes, counts = pair_rows[order], pair_codes[order], counts[order]
+    first_of_segment = np.searchsorted(pair_rows, np.arange(number_of_segments))
+    rank = np.arange(len(pair_rows)) - first_of_segment[pair_rows]
+    kept = rank < top_n
+
+    top_names = np.full((number_of_segments, top_n), "", dtype=object)
+    top_counts = np.zeros((number_of_segments, top_n), dtype=np.int64)
+    names = np.array(vocabulary, dtype=object)
+    top_names[pair_rows[kept], rank[kept]] = names[pair_codes[kept]]
+    top_counts[pair_rows[kept], rank[kept]] = counts[kept]
+    # Fixed width strings, so the profile can be saved without pickling.
+    return top_names.astype(str), top_counts
+
+
+def _get_named_counts(names: np.ndarray, counts: np.ndarray) -> List[Tuple[str, int]]:
+    return [(name, count) for name, count in zip(names.tolist(), counts.tolist()) if count > 0]
@@ -0,0 +1,134 @@
+"""
+Turns the reviews of each reviewer into an integer encoded sequence
+"""
+from datetime import tzinfo
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from clustering.dates import DEFAULT_TIMEZONE, create_date_columns
+from clustering.review_table import SCORE_FIELDS, RateBeerReviewTable
+
+# Code 0 of every feature is padding, and a missing score.
+PADDING_CODE = 0
+
+
+class RateBeerSequences:
+    """
+    The time ordered reviews of every reviewer as integer encoded features. The sequences are
+    stored one after the other in a single flat array, the reviews of reviewer i being
+    `features[offsets[i]:offsets[i + 1]]`, rather than as a list per reviewer.
+
+    Each feature is a categorical code, code 0 being padding so the codes of a feature run from
+    1 to `vocabulary_sizes[feature] - 1`.
+    """
+
+    def __init__(self,
+                 features: np.ndarray,
+                 offsets: np.ndarray,
+                 reviewers: List[str],
+                 feature_names: List[str],
+                 vocabulary_sizes: List[int]):
+        self.features = features
+        self.offsets = offsets
+        self.reviewers = reviewers
+        self.feature_names = feature_names
+        self.vocabulary_sizes = vocabulary_sizes
+
+    def __len__(self):
+        return len(self.reviewers)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        Returns:
+            The number of reviews of each reviewer.
+        """
+        return np.diff(self.offsets)
+
+    def get_sequence(self, reviewer_index: int) -> np.ndarray:
+        """
+        Returns:
+            The (number of reviews, number of features) codes of the reviewer's reviews in time order.
+        """
+        return self.features[self.offsets[reviewer_index]:self.offsets[reviewer_index + 1]]
+
+    @classmethod
+    def from_table(cls,
+                   table: RateBeerReviewTable,
+                   timezone: Union[str, tzinfo, None] = DEFAULT_TIMEZONE) -> "RateBeerSequences":
+        """
+        Encodes the reviews of a table. The reviews of each reviewer are in the order of the
+        table's rows, which is the order they are connected in by
+        `RateBeerLoader._connect_reviews_using_id` when the table is sorted by time.
+
+        The features are the beer, the style, each score and the Year, Month and DayOfWeek.
+
+        Args:
+            table: The reviews, sorted by time.
+            timezone: The timezone to create the date features in.
+
+        Returns:
+            The sequences of the reviewers in the order of the table's profile vocabulary,
+            reviewers without reviews have an empty sequence.
+        """
+        feature_names = ["beerId", "style"]
+        columns = [table.beer_ids.astype(np.int64) + 1, table.styles.astype(np.int64) + 1]
+        vocabulary_sizes = [len(table.beer_vocabulary) + 1, len(table.style_vocabulary) + 1]
+
+        for i, field in enumerate(SCORE_FIELDS):
+            codes, size = _encode_scores(table.scores[:, i], table.score_denominators[:, i])
+            feature_names.append(field)
+            columns.append(codes)
+            vocabulary_sizes.append(size)
+        for field, (codes, names) in create_date_columns(table.time, timezone).items():
+            feature_names.append(field)
+            columns.append(codes.astype(np.int64) + 1)
+            vocabulary_sizes.append(len(names) + 1)
+
+        # Group the rows by reviewer while keeping them in table order within the reviewer.
+        order = np.lexsort((np.arange(len(table)), table.profile_names))
+        features = np.stack(columns, axis=1)[order]
+        smallest_dtype = np.min_scalar_type(max(vocabulary_sizes))
+        offsets = np.zeros(len(table.profile_vocabulary) + 1, dtype=np.int64)
+        np.cumsum(table.reviewer_counts(), out=offsets[1:])
+        return cls(features=features.astype(smallest_dtype),
+                   offsets=offsets,
+                   reviewers=list(table.profile_vocabulary),
+                   feature_names=feature_names,
+                   vocabulary_sizes=vocabulary_sizes)
+
+    def get_segments(self, max_length: Union[int, None] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Splits the sequences into segments of at most `max_length` reviews, so a reviewer with
+        thousands of reviews becomes several segments rather than a single very long sequence.
+
+        Args:
+            max_length: The most reviews of a segment, or None to keep each sequence whole.
+
+        Returns:
+            The start and end of each segment in `features` and the reviewer of each segment.
+            Empty sequences have no segments.
+        """
+        lengths = self.lengths
+        if max_length is None:
+            kept = lengths > 0
+            return self.offsets[:-1][kept], self.offsets[1:][kept], np.flatnonzero(kept)
+        segments_per_reviewer = -(-lengths // max_length)
+        reviewers = np.repeat(np.arange(len(lengths)), segments_per_reviewer)
+        first_segment = np.cumsum(segments_per_reviewer) - segments_per_reviewer
+        segment_of_reviewer = np.arange(len(reviewers)) - np.repeat(first_segment, segments_per_reviewer)
+        starts = self.offsets[reviewers] + segment_of_reviewer * max_length
+        ends = np.minimum(starts + max_length, self.offsets[reviewers + 1])
+        return starts, ends, reviewers
+
+
+def _encode_scores(scores: np.ndarray, denominators: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Returns:
+        The code of each score, the score plus one with missing scores as the padding code, and
+        the size of the vocabulary of the codes.
+    """
+    present = denominators >= 0
+    codes = np.where(present, scores.astype(np.int64) + 1, PADDING_CODE)
+    return codes, int(codes.max(initial=PADDING_CODE)) + 1
@@ -0,0 +1,337 @@
+"""
+Finds the reviewers most similar to a reviewer from their embeddings
+"""
+import json
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from clustering.embeddings import _write_names, load_reviewer_embeddings
+
+_INDEX_FILE = "index.json"
+_EMBEDDINGS_FILE = "embeddings.npy"
+_SQUARED_NORMS_FILE = "squared_norms.npy"
+_IDS_FILE = "ids.npy"
+_CENTROIDS_FILE = "centroids.npy"
+_LIST_OFFSETS_FILE = "list_offsets.npy"
+_NAMES_FILE = "reviewer_names.txt"
+_METRICS = ("euclidean", "cosine")
+# The most embeddings compared with a batch of queries at once, bounding the memory of the
+# distances to the block size times the query batch size.
+_BLOCK_SIZE = 8192
+
+
+class ReviewerSimilarityIndex:
+    """
+    Finds the nearest reviewers to query embeddings, either exactly or approximately.
+
+    The exact search compares each batch of queries with a block of embeddings at a time as a
+    single matrix product, keeping the nearest found so far, so the distances are never fully in
+    memory. Building an index copies the embeddings into memory, grouped by centroid, while an
+    index opened with `load` memory maps them, so a search only reads the blocks it compares.
+
+    Given centroids, for example those of `RateBeerCustomerClusterCreator`, the index is an
+    inverted file: the embeddings are stored grouped by their nearest centroid and a search with
+    `num_probes` only compares each query with the embeddings of its `num_probes` nearest
+    centroids. This misses neighbours that are in other clusters, more probes miss fewer.
+
+    The distances are euclidean, or with the cosine metric 1 minus the cosine similarity. The
+    index is saved as `.npy` files that are memory mapped when loaded.
+    """
+
+    def __init__(self,
+                 embeddings: np.ndarray,
+                 reviewer_names: Sequence[str],
+                 metric: str = "euclidean",
+                 centroids: Optional[np.ndarray] = None,
+                 labels: Optional[np.ndarray] = None,
+                 batch_size: int = 65536):
+        """
+        Args:
+            embeddings: The (n, d) embeddings of the reviewers, this can be memory mapped.
+            reviewer_names: The name of each reviewer.
+            metric: "euclidean" or "cosine".
+            centroids: The (k, d) centroids of the inverted file, None only allows exact searches.
+            labels: The centroid of each embedding, None assigns each embedding to its nearest
+                centroid.
+            batch_size: The number of embeddings read at a time when building the index.
+        """
+        assert metric in _METRICS, f"The metric must be one of {_METRICS}."
+        assert len(embeddings) == len(reviewer_names), "There must be a name for each embedding."
+        self.metric = metric
+        self.reviewer_names = list(reviewer_names)
+        if centroids is None:
+            self._ids = np.arange(len(embeddings), dtype=np.int64)
+            self._list_offsets = np.array([0, len(embeddings)], dtype=np.int64)
+            self._centroids = None
+        else:
+            self._centroids = self._prepare(np.asarray(centroids))
+            if labels is None:
+                labels = self._nearest_centroids(embeddings, batch_size)
+            self._ids = np.argsort(labels, kind="stable").astype(np.int64)
+            self._list_offsets = np.zeros(len(self._centroids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(labels, minlength=len(self._centroids)), out=self._list_offsets[1:])
+
+        first = self._prepare(np.asarray(embeddings[:1]))
+        self._embeddings = np.empty((len(embeddings), first.shape[1]), dtype=first.dtype)
+        for start in range(0, len(embeddings), batch_size):
+            ids = self._ids[start:start + batch_size]
+            # Reading the rows in file order is faster when the embeddings are memory mapped.
+            order = np.argsort(ids)
+            self._embeddings[start + order] = self._prepare(np.asarray(embeddings[ids[order]]))
+        self._squared_norms = np.einsum("ij,ij->i", self._embeddings, self._embeddings)
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    @property
+    def num_lists(self) -> int:
+        """
+        Returns:
+            The number of centroids of the inverted file, 1 without centroids.
+        """
+        return len(self._list_offsets) - 1
+
+    @classmethod
+    def from_directory(cls,
+                       embeddings_directory: Union[Path, str],
+                       metric: str = "euclidean",
+                       cluster_creator=None) -> "ReviewerSimilarityIndex":
+        """
+        Builds the index from the embeddings written by `extract_reviewer_embeddings`.
+
+        Args:
+            embeddings_directory: The directory the embeddings were written to.
+            metric: "euclidean" or "cosine".
+            cluster_creator: A fitted `RateBeerCustomerClusterCreator` of these embeddings, whose
+                centroids and clusters become the inverted file.
+
+        Returns:
+            The index.
+        """
+        embeddings, reviewer_names = load_reviewer_embeddings(embeddings_directory)
+        if cluster_creator is None:
+            return cls(embeddings, reviewer_names, metric=metric)
+        assert cluster_creator.centroids is not None, "The clusters have not been fitted."
+        # The clusters were fitted on the raw embeddings, so with the cosine metric the
+        # embeddings are reassigned to the normalised centroids.
+        labels = cluster_creator.labels if metric == "euclidean" else None
+        return cls(embeddings, reviewer_names, metric=metric, centroids=cluster_creator.centroids, labels=labels)
+
+    def search(self,
+               queries: np.ndarray,
+               k: int = 10,
+               num_probes: Optional[int] = None,
+               batch_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the nearest reviewers to each query.
+
+        Args:
+            queries: The (q, d) query embeddings.
+            k: The number of reviewers to find for each query.
+            num_probes: The number of nearest centroids whose reviewers are compared with each
+                query, None compares every reviewer, which is exact.
+            batch_size: The number of queries searched at a time.
+
+        Returns:
+            The (q, k) indices of the nearest reviewers, nearest first, and their distances. When
+            fewer than k reviewers are compared the remainder is -1 with an infinite distance.
+        """
+        queries = self._prepare(np.atleast_2d(np.asarray(queries)))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float64)
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            if num_probes is None or self._centroids is None or num_probes >= self.num_lists:
+                rows, squared_distances = self._search_exact(batch, k)
+            else:
+                rows, squared_distances = self._search_lists(batch, k, num_probes)
+            order = np.argsort(squared_distances, axis=1, kind="stable")
+            rows = np.take_along_axis(rows, order, axis=1)
+            indices[start:start + len(batch)] = np.where(rows >= 0, self._ids[rows], -1)
+            distances[start:start + len(batch)] = self._to_distances(np.take_along_axis(squared_distances, order,
+                                                                                        axis=1))
+        return indices, distances
+
+    def search_reviewers(self,
+                         reviewer_names: Sequence[str],
+                         k: int = 10,
+                         num_probes: Optional[int] = None,
+                         batch_size: int = 1024) -> List[List[Tuple[str, float]]]:
+        """
+        Finds the reviewers most like each of the reviewers, leaving out the reviewer itself.
+
+        Args:
+            reviewer_names: The reviewers to find similar reviewers for.
+            k: The number of similar reviewers to find for each.
+            num_probes: See `search`.
+            batch_size: The number of reviewers searched at a time.
+
+        Returns:
+            The names of the similar reviewers of each reviewer, most similar first, and their
+            distances.
+        """
+        name_to_index = {name: index for index, name in enumerate(self.reviewer_names)}
+        query_indices = np.array([name_to_index[name] for name in reviewer_names], dtype=np.int64)
+        rows = np.argsort(self._ids)[query_indices]
+        indices, distances = self.search(self._embeddings[rows], k + 1, num_probes, batch_size)
+        similar = []
+        for query_index, reviewer_indices, reviewer_distances in zip(query_indices, indices, distances):
+            similar.append([(self.reviewer_names[index], float(distance))
+                            for index, distance in zip(reviewer_indices.tolist(), reviewer_distances.tolist())
+                            if index != query_index and index >= 0][:k])
+        return similar
+
+    def save(self, directory: Union[Path, str]):
+        """
+        Saves the index, the embeddings are stored grouped by centroid, ready to be memory mapped.
+
+        Args:
+            directory: The directory to write the index to.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory.joinpath(_EMBEDDINGS_FILE), self._embeddings)
+        np.save(directory.joinpath(_SQUARED_NORMS_FILE), self._squared_norms)
+        np.save(directory.joinpath(_IDS_FILE), self._ids)
+        np.save(directory.joinpath(_LIST_OFFSETS_FILE), self._list_offsets)
+        if self._centroids is not None:
+            np.save(directory.joinpath(_CENTROIDS_FILE), self._centroids)
+        _write_names(directory.joinpath(_NAMES_FILE), self.reviewer_names)
+        with directory.joinpath(_INDEX_FILE).open("w") as index_file:
+            json.dump({"metric": self.metric, "num_reviewers": len(self)}, index_file)
+
+    @classmethod
+    def load(cls, directory: Union[Path, str]) -> "ReviewerSimilarityIndex":
+        """
+        Loads an index saved by `save` with the embeddings memory mapped, so only the parts a
+        search reads are loaded.
+
+        Args:
+            directory: The directory the index was saved to.
+
+        Returns:
+            The index.
+        """
+        directory = Path(directory)
+        with directory.joinpath(_INDEX_FILE).open("r") as index_file:
+            metadata = json.load(index_file)
+        index = cls.__new__(cls)
+        index.metric = metadata["metric"]
+        index.reviewer_names = directory.joinpath(_NAMES_FILE).read_bytes().decode("utf-8").split("\n")[:-1]
+        index._embeddings = np.load(directory.joinpath(_EMBEDDINGS_FILE), mmap_mode="r")
+        index._squared_norms = np.load(directory.joinpath(_SQUARED_NORMS_FILE), mmap_mode="r")
+        index._ids = np.load(directory.joinpath(_IDS_FILE))
+        index._list_offsets = np.load(directory.joinpath(_LIST_OFFSETS_FILE))
+        centroids_location = directory.joinpath(_CENTROIDS_FILE)
+        index._centroids = np.load(centroids_location) if centroids_location.exists() else None
+        return index
+
+    def _prepare(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            The embeddings as real vectors, normalised for the cosine metric.
+        """
+        if np.iscomplexobj(embeddings):
+            # The euclidean distance of complex vectors is that of their real and imaginary parts.
+            embeddings = np.concatenate([embeddings.real, embeddings.imag], axis=1)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms > 0, norms, 1)
+        return embeddings
+
+    def _nearest_centroids(self, embeddings: np.ndarray, batch_size: int) -> np.ndarray:
+        """
+        Returns:
+            The nearest centroid of each embedding, the embeddings are read and prepared
+            `batch_size` at a time.
+        """
+        centroid_squared_norms = np.einsum("ij,ij->i", self._centroids, self._centroids)
+        labels = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), batch_size):
+            batch = self._prepare(np.asarray(embeddings[start:start + batch_size]))
+            labels[start:start + batch_size] = _squared_euclidean(batch, np.einsum("ij,ij->i", batch, batch),
+                                                                  self._centroids,
+                                                                  centroid_squared_norms).argmin(axis=1)
+        return labels
+
+    def _to_distances(self, squared_distances: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            # For unit vectors the squared euclidean distance is twice 1 minus the cosine similarity.
+            return squared_distances / 2
+        return np.sqrt(squared_distances)
+
+    def _search_exact(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            The rows of the nearest k embeddings of each query, in no order, and their squared
+            distances.
+        """
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_distances = np.full((len(queries), k), np.inf)
+        for start in range(0, len(self), _BLOCK_SIZE):
+            rows = np.arange(start, min(start + _BLOCK_SIZE, len(self)))
+            best_rows, best_distances = _merge_nearest(best_rows, best_distances, rows,
+                                                       self._squared_distances(queries, rows), k)
+        return best_rows, best_distances
+
+    def _search_lists(self, queries: np.ndarray, k: int, num_probes: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compares each query with the embeddings of its `num_probes` nearest centroids, the
+        queries probing a centroid are compared with its embeddings together.
+
+        Returns:
+            The rows of the nearest k embeddings of each query, in no order, and their squared
+            distances.
+        """
+        centroid_distances = _squared_euclidean(queries, np.einsum("ij,ij->i", queries, queries),
+                                                self._centroids, np.einsum("ij,ij->i", self._centroids,
+                                                                           self._centroids))
+        probes = np.argpartition(centroid_distances, num_probes - 1, axis=1)[:, :num_probes]
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_distances = np.full((len(queries), k), np.inf)
+        for centroid in np.unique(probes):
+            probing = np.flatnonzero((probes == centroid).any(axis=1))
+            list_start, list_end = self._list_offsets[centroid], self._list_offsets[centroid + 1]
+            for start in range(list_start, list_end, _BLOCK_SIZE):
+                rows = np.arange(start, min(start + _BLOCK_SIZE, list_end))
+                best_rows[probing], best_distances[probing] = _merge_nearest(
+                    best_rows[probing], best_distances[probing], rows,
+                    self._squared_distances(queries[probing], rows), k)
+        return best_rows, best_distances
+
+    def _squared_distances(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # The rows are contiguous, so a memory mapped index reads them as a single slice.
+        block = slice(rows[0], rows[-1] + 1)
+        return _squared_euclidean(queries, np.einsum("ij,ij->i", queries, queries),
+                                  np.asarray(self._embeddings[block]), np.asarray(self._squared_norms[block]))
+
+
+def _squared_euclidean(queries: np.ndarray,
+                       query_squared_norms: np.ndarray,
+                       embeddings: np.ndarray,
+                       squared_norms: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        The (q, n) squared euclidean distances between each query and each embedding.
+    """
+    squared_distances = query_squared_norms[:, None] - 2 * queries @ embeddings.T + squared_norms[None, :]
+    return np.maximum(squared_distances, 0)
+
+
+def _merge_nearest(best_rows: np.ndarray,
+                   best_distances: np.ndarray,
+                   rows: np.ndarray,
+                   squared_distances: np.ndarray,
+                   k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges the nearest rows found so far with the squared distances to a block of rows.
+
+    Returns:
+        The nearest k rows of each query, in no order, and their squared distances.
+    """
+    all_rows = np.concatenate([best_rows, np.broadcast_to(rows, squared_distances.shape)], axis=1)
+    all_distances = np.concatenate([best_distances, squared_distances], axis=1)
+    nearest = np.argpartition(all_distances, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(all_rows, nearest, axis=1), np.take_along_axis(all_distances, nearest, axis=1)
@@ -0,0 +1,313 @@
+"""
+Runs a hyper-parameter sweep over the rate beer triples with the trials in parallel
+"""
+import csv
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from clustering.preprocessing_cache import PreprocessingCache
+
+logger = logging.getLogger(__name__)
+
+_SPLIT_NAMES = ("training", "testing", "validation")
+_TRIPLES_DIRECTORY = "triples"
+_SUMMARY_FILE = "summary.tsv"
+
+# The training, testing and validation factories each worker process runs its trials on, these
+# are set once per worker rather than being sent with every trial.
+_worker_factories = None
+
+
+class RateBeerSweep:
+    """
+    Trains a model for every combination of the parameter grid. The rate beer file is loaded and
+    split once, and the split triples are saved as `.npy` files that every worker memory maps, so
+    the workers share the same pages rather than each holding a copy.
+
+    The trials are run in a process pool sized to the available cores, `threads_per_trial` torch
+    threads each. Each trial's early stopper reports its validation metric, and a trial is pruned
+    when its metric is worse than the median of the other trials at the same epoch.
+
+    The parameters are the pipeline arguments they set, with a "." reaching into the keyword
+    argument dictionaries, for example {"model_kwargs.embedding_dim": [32, 64],
+    "lr_scheduler": ["ExponentialLR"], "lr_scheduler_kwargs.gamma": [0.99, 0.9, 0.8]}.
+    """
+
+    def __init__(self,
+                 file_location: Union[str, Path],
+                 parameter_grid: Dict[str, Sequence[Any]],
+                 output_directory: Union[str, Path] = "rate_beer_sweep",
+                 model: str = "TransE",
+                 num_epochs: int = 500,
+                 split_ratios: Sequence[float] = (0.8, 0.1, 0.1),
+                 stopper_kwargs: Optional[Dict[str, Any]] = None,
+                 prune: bool = True,
+                 min_trials_to_prune: int = 2,
+                 num_workers: Optional[int] = None,
+                 threads_per_trial: int = 1,
+                 random_seed: int = 100,
+                 save_models: bool = False,
+                 loader_kwargs: Optional[Dict[str, Any]] = None,
+                 pipeline_kwargs: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            file_location: The rate beer file.
+            parameter_grid: The values of each parameter to try.
+            output_directory: Where to write the shared triples, the summary and the models.
+            model: The model of every trial, unless it is in the grid.
+            num_epochs: The most epochs of each trial.
+            split_ratios: The training, testing and validation ratios of the triples.
+            stopper_kwargs: The arguments of the early stopper.
+            prune: Whether to stop trials whose validation metric is below the median.
+            min_trials_to_prune: The number of other trials that must have reached an epoch before
+                a trial is compared with them.
+            num_workers: The number of trials run at a time, by default the available cores
+                divided by `threads_per_trial`.
+            threads_per_trial: The torch threads of each trial.
+            random_seed: The seed of the split and of every trial.
+            save_models: Whether to save each trial's model to its own directory.
+            loader_kwargs: The arguments of the `RateBeerLoaderPykeen`.
+            pipeline_kwargs: The pipeline arguments shared by every trial.
+        """
+        self._file_location = Path(file_location)
+        self._parameter_grid = parameter_grid
+        self._output_directory = Path(output_directory)
+        self._model = model
+        self._num_epochs = num_epochs
+        self._split_ratios = split_ratios
+        self._stopper_kwargs = dict(frequency=2, patience=2, relative_delta=0.002)
+        self._stopper_kwargs.update(stopper_kwargs or {})
+        self._prune = prune
+        self._min_trials_to_prune = min_trials_to_prune
+        self._threads_per_trial = threads_per_trial
+        self._num_workers = num_workers if num_workers is not None \
+            else max(1, _get_available_cores() // threads_per_trial)
+        self._random_seed = random_seed
+        self._save_models = save_models
+        self._loader_kwargs = loader_kwargs or {}
+        self._pipeline_kwargs = pipeline_kwargs or {}
+
+    def get_trials(self) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            The parameters of each trial, every combination of the grid.
+        """
+        names = list(self._parameter_grid)
+        return [dict(zip(names, values)) for values in itertools.product(*self._parameter_grid.values())]
+
+    def run(self) -> List[Dict[str, Any]]:
+        """
+        Runs every trial and writes the summary table to `summary.tsv` in the output directory.
+
+        Returns:
+            The summary of each trial in trial order.
+        """
+        trials = self.get_trials()
+        self._output_directory.mkdir(parents=True, exist_ok=True)
+        triples_directory = self._save_split_triples()
+        larger_is_better = self._stopper_kwargs.get("larger_is_better", True)
+
+        if self._num_workers <= 1:
+            _set_worker_factories(triples_directory, self._threads_per_trial)
+            pruner = _MedianPruner({}, None, self._min_trials_to_prune, larger_is_better) if self._prune else None
+            summaries = [self._run_trial_safely(index, parameters, pruner) for index, parameters in enumerate(trials)]
+        else:
+            with Manager() as manager, ProcessPoolExecutor(max_workers=self._num_workers,
+                                                           initializer=_set_worker_factories,
+                                                           initargs=(triples_directory, self._threads_per_trial)
+                                                           ) as executor:
+                pruner = _MedianPruner(manager.dict(), manager.Lock(), self._min_trials_to_prune,
+                                       larger_is_better) if self._prune else None
+                futures = [executor.submit(_run_trial, self._create_trial_kwargs(index, parameters, pruner))
+                           for index, parameters in enumerate(trials)]
+                summaries = []
+                for index, (parameters, future) in enumerate(zip(trials, futures)):
+                    try:
+                        summaries.append(future.result())
+                    except Exception as error:
+                        summaries.append(_create_failed_summary(index, parameters, error))
+        self._write_summary(summaries)
+        return summaries
+
+    def _run_trial_safely(self, index: int, parameters: Dict[str, Any], pruner) -> Dict[str, Any]:
+        try:
+            return _run_trial(self._create_trial_kwargs(index, parameters, pruner))
+        except Exception as error:
+            return _create_failed_summary(index, parameters, error)
+
+    def _save_split_triples(self) -> Path:
+        """
+        Loads and splits the triples once, saving each split for the workers to memory map.
+
+        Returns:
+            The directory of the split triples.
+        """
+        from clustering.rate_beer_loader import RateBeerLoaderPykeen
+
+        loader = RateBeerLoaderPykeen(self._file_location, checkpoint_name=f"{self._output_directory.name}.pt",
+                                      **self._loader_kwargs)
+        splits = loader.get_rate_beer().split(list(self._split_ratios), random_state=self._random_seed)
+        triples_directory = self._output_directory.joinpath(_TRIPLES_DIRECTORY)
+        cache = PreprocessingCache(triples_directory)
+        for name, factory in zip(_SPLIT_NAMES, splits):
+            cache.save(name, factory.mapped_triples.numpy(), factory.entity_to_id, factory.relation_to_id)
+        return triples_directory
+
+    def _create_trial_kwargs(self, index: int, parameters: Dict[str, Any], pruner) -> Dict[str, Any]:
+        """
+        Returns:
+            The arguments of `_run_trial`.
+        """
+        pipeline_kwargs = dict(model=self._model,
+                               training_loop="sLCWA",
+                               random_seed=self._random_seed,
+                               stopper="early",
+                               stopper_kwargs=dict(self._stopper_kwargs))
+        pipeline_kwargs = _merge_parameters(pipeline_kwargs, self._pipeline_kwargs)
+        pipeline_kwargs = _merge_parameters(pipeline_kwargs, _expand_parameters(parameters))
+        pipeline_kwargs.setdefault("training_kwargs", {}).setdefault("num_epochs", self._num_epochs)
+        model_directory = self._output_directory.joinpath(f"trial_{index}") if self._save_models else None
+        return dict(index=index, parameters=parameters, pipeline_kwargs=pipeline_kwargs, pruner=pruner,
+                    model_directory=model_directory)
+
+    def _write_summary(self, summaries: List[Dict[str, Any]]):
+        columns = []
+        for summary in summaries:
+            columns.extend(column for column in summary if column not in columns)
+        with self._output_directory.joinpath(_SUMMARY_FILE).open("w", newline="") as summary_file:
+            writer = csv.DictWriter(summary_file, fieldnames=columns, delimiter="\t")
+            writer.writeheader()
+            writer.writerows(summaries)
+
+
+class _MedianPruner:
+    """
+    Decides whether a trial should be pruned from the validation metrics the trials reported at
+    the same epoch. The metrics are kept in a dictionary shared by the workers.
+    """
+
+    def __init__(self, epoch_metrics, lock, min_trials: int, larger_is_better: bool):
+        self._epoch_metrics = epoch_metrics
+        self._lock = lock
+        self._min_trials = min_trials
+        self._larger_is_better = larger_is_better
+
+    def __call__(self, epoch: int, metric: float) -> bool:
+        if self._lock is not None:
+            with self._lock:
+                others = self._report(epoch, metric)
+        else:
+            others = self._report(epoch, metric)
+        if len(others) < self._min_trials:
+            return False
+        median = float(np.median(others))
+        return metric < median if self._larger_is_better else metric > median
+
+    def _report(self, epoch: int, metric: float) -> List[float]:
+        """
+        Returns:
+            The metrics the other trials reported at the epoch.
+        """
+        others = list(self._epoch_metrics.get(epoch, []))
+        # Proxied dictionaries only see a change when the value is assigned.
+        self._epoch_metrics[epoch] = others + [metric]
+        return others
+
+
+def _set_worker_factories(triples_directory: Path, threads_per_trial: int):
+    """
+    Memory maps the split triples in a worker process.
+    """
+    global _worker_factories
+    import torch
+
+    from clustering.rate_beer_loader import _create_triples_factory
+
+    torch.set_num_threads(threads_per_trial)
+    cache = PreprocessingCache(triples_directory)
+    _worker_factories = tuple(_create_triples_factory(*cache.load(name)) for name in _SPLIT_NAMES)
+
+
+def _run_trial(trial_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Trains the model of a trial on the worker's triples.
+
+    Returns:
+        The summary of the trial.
+    """
+    from pykeen.pipeline import pipeline
+
+    from clustering.training_callbacks import PruningEarlyStopper
+
+    index = trial_kwargs["index"]
+    pipeline_kwargs = dict(trial_kwargs["pipeline_kwargs"])
+    if pipeline_kwargs.get("stopper") == "early":
+        pipeline_kwargs["stopper"] = PruningEarlyStopper
+        pipeline_kwargs["stopper_kwargs"] = dict(pipeline_kwargs["stopper_kwargs"], should_prune=trial_kwargs["pruner"])
+    training, testing, validation = _worker_factories
+    start = time.perf_counter()
+    result = pipeline(training=training, testing=testing, validation=validation, **pipeline_kwargs)
+    seconds = time.perf_counter() - start
+    if trial_kwargs["model_directory"] is not None:
+        result.save_to_directory(trial_kwargs["model_directory"])
+
+    stopper = result.stopper
+    summary = dict(trial=index, **trial_kwargs["parameters"])
+    summary["status"] = "pruned" if getattr(stopper, "pruned", False) else "completed"
+    summary["epochs"] = len(result.losses)
+    summary["seconds"] = round(seconds, 3)
+    summary["final_loss"] = result.losses[-1] if result.losses else None
+    if isinstance(stopper, PruningEarlyStopper) and stopper.results:
+        summary["best_epoch"] = stopper.best_epoch
+        summary[f"validation_{stopper.metric}"] = stopper.best_metric
+    for metric in ("inverse_harmonic_mean_rank", "hits_at_10"):
+        summary[f"test_{metric}"] = result.metric_results.get_metric(metric)
+    logger.info("Trial %d %s after %d epochs.", index, summary["status"], summary["epochs"])
+    return summary
+
+
+def _create_failed_summary(index: int, parameters: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    logger.warning("Trial %d failed: %r", index, error)
+    return dict(trial=index, **parameters, status="failed", error=repr(error))
+
+
+def _expand_parameters(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turns the "." separated parameter names into nested dictionaries.
+    """
+    expanded: Dict[str, Any] = {}
+    for name, value in parameters.items():
+        *outer_names, inner_name = name.split(".")
+        nested = expanded
+        for outer_name in outer_names:
+            nested = nested.setdefault(outer_name, {})
+        nested[inner_name] = value
+    return expanded
+
+
+def _merge_parameters(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns:
+        The base arguments with the overrides, merging nested dictionaries.
+    """
+    merged = dict(base)
+    for name, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(name), dict):
+            merged[name] = _merge_parameters(merged[name], value)
+        else:
+            merged[name] = value
+    return merged
+
+
+def _get_available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
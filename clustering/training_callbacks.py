@@ -0,0 +1,78 @@
+"""
+PyKEEN training callbacks and stoppers, these are kept apart from the training configuration as
+they need PyKEEN
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from pykeen.stoppers import EarlyStopper
+from pykeen.training.callbacks import TrainingCallback
+
+logger = logging.getLogger(__name__)
+
+
+class ThroughputCallback(TrainingCallback):
+    """
+    Logs the number of training triples processed per second of each epoch. The time of an
+    epoch is from its first batch to its last, so evaluation by a stopper isn't counted.
+    """
+
+    def __init__(self,
+                 num_triples: int,
+                 callback: Optional[Callable[[int, float], None]] = None):
+        """
+        Args:
+            num_triples: The number of training triples of each epoch.
+            callback: Called with the epoch and the triples per second after each epoch.
+        """
+        super().__init__()
+        self._num_triples = num_triples
+        self._callback = callback
+        self._epoch_start: Optional[float] = None
+        self._last_batch_end: Optional[float] = None
+        self.triples_per_second: List[float] = []
+
+    def pre_batch(self, **kwargs):
+        if self._epoch_start is None:
+            self._epoch_start = time.perf_counter()
+
+    def post_batch(self, epoch: int, batch, **kwargs):
+        self._last_batch_end = time.perf_counter()
+
+    def post_epoch(self, epoch: int, epoch_loss: float, **kwargs):
+        if self._epoch_start is None or self._last_batch_end is None:
+            return
+        seconds = self._last_batch_end - self._epoch_start
+        throughput = self._num_triples / seconds if seconds > 0 else float("inf")
+        self.triples_per_second.append(throughput)
+        self._epoch_start = None
+        logger.info("Epoch %d: %.0f triples per second, loss %.4f", epoch, throughput, epoch_loss)
+        if self._callback is not None:
+            self._callback(epoch, throughput)
+
+
+@dataclass
+class PruningEarlyStopper(EarlyStopper):
+    """
+    An early stopper that also stops when `should_prune` decides, from the validation metric of
+    an evaluation, that the training isn't worth continuing.
+    """
+
+    #: Called with the epoch and the validation metric of each evaluation, returns True to stop.
+    should_prune: Optional[Callable[[int, float], bool]] = None
+    #: Whether the training was stopped by `should_prune`.
+    pruned: bool = False
+
+    def should_stop(self, epoch: int) -> bool:
+        if super().should_stop(epoch):
+            return True
+        if self.should_prune is None or not self.should_prune(epoch, self.results[-1]):
+            return False
+        logger.info("Pruned at epoch %d with a validation %s of %f.", epoch, self.metric, self.results[-1])
+        self.stopped = True
+        self.pruned = True
+        if self.clean_up_checkpoint and self.best_model_path is not None:
+            self.best_model_path.unlink(missing_ok=True)
+        return True
@@ -0,0 +1,170 @@
+"""
+Tuning of the PyKEEN training for machines without a GPU
+"""
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Per scored triple, the embedding rows gathered for it and their gradients, as measured on CPU
+# for TransE, DistMult and ComplEx with some allowance.
+_ACTIVATION_FACTOR = 2
+# Each parameter also has a gradient and the two moments of Adam, PyKEEN's default optimizer.
+_COPIES_PER_PARAMETER = 4
+
+
+class CPUTrainingConfig:
+    """
+    The settings that decide how fast the model trains on CPU, kept in one place rather than
+    found by hand for every model size.
+
+    Leaving `batch_size` as None with a `memory_budget_bytes` sets the batch size to the largest
+    power of two whose estimated memory fits in the budget. PyKEEN's own batch size search only
+    works on a GPU, on CPU it falls back to a small fixed batch size.
+    """
+
+    def __init__(self,
+                 num_threads: Optional[int] = None,
+                 num_interop_threads: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 memory_budget_bytes: Optional[int] = None,
+                 max_batch_size: int = 65536,
+                 slice_size: Optional[int] = None,
+                 sub_batch_size: Optional[int] = None,
+                 num_workers: int = 0,
+                 random_seed: Optional[int] = None,
+                 log_throughput: bool = True,
+                 throughput_callback: Optional[Callable[[int, float], None]] = None):
+        """
+        Args:
+            num_threads: The number of threads torch uses within an operation, None keeps the
+                torch default of one per core.
+            num_interop_threads: The number of threads torch runs independent operations on,
+                this can only be set before torch first runs in parallel.
+            batch_size: The number of positive triples of each batch.
+            memory_budget_bytes: The memory the batch size is chosen to fit in when `batch_size`
+                is None.
+            max_batch_size: The largest batch size chosen from the memory budget.
+            slice_size: Scores are computed this many entities at a time, lowering the memory of
+                models that score against every entity.
+            sub_batch_size: Batches are accumulated from sub-batches of this size, giving the
+                results of a large batch with the memory of a small one.
+            num_workers: The number of processes creating the batches and negative samples.
+            random_seed: The seed of torch, NumPy and Python's random numbers.
+            log_throughput: Whether to log the triples per second of each epoch.
+            throughput_callback: Called with the epoch and the triples per second of each epoch.
+        """
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.batch_size = batch_size
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_batch_size = max_batch_size
+        self.slice_size = slice_size
+        self.sub_batch_size = sub_batch_size
+        self.num_workers = num_workers
+        self.random_seed = random_seed
+        self.log_throughput = log_throughput
+        self.throughput_callback = throughput_callback
+
+    def apply(self):
+        """
+        Sets the torch threads and the random seed.
+        """
+        import torch
+
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        if self.num_interop_threads is not None and torch.get_num_interop_threads() != self.num_interop_threads:
+            try:
+                torch.set_num_interop_threads(self.num_interop_threads)
+            except RuntimeError:
+                logger.warning("The interop threads can't be changed once torch has run in parallel, "
+                               "keeping %d.", torch.get_num_interop_threads())
+        if self.random_seed is not None:
+            from pykeen.utils import set_random_seed
+
+            set_random_seed(self.random_seed)
+
+    def get_batch_size(self, model, num_training_triples: int, num_negatives_per_positive: int = 1) -> Optional[int]:
+        """
+        Args:
+            model: The model to train.
+            num_training_triples: The number of training triples, the batch size is never larger.
+            num_negatives_per_positive: The number of negative triples scored with each positive.
+
+        Returns:
+            The batch size, None leaves it to PyKEEN.
+        """
+        if self.batch_size is not None or self.memory_budget_bytes is None:
+            return self.batch_size
+        batch_size = estimate_batch_size(model, self.memory_budget_bytes, num_negatives_per_positive,
+                                         max_batch_size=min(self.max_batch_size, num_training_triples))
+        logger.info("Using a batch size of %d for a memory budget of %d bytes.", batch_size,
+                    self.memory_budget_bytes)
+        return batch_size
+
+    def get_training_kwargs(self, batch_size: Optional[int], num_training_triples: int) -> Dict[str, Any]:
+        """
+        Args:
+            batch_size: The batch size from `get_batch_size`.
+            num_training_triples: The number of training triples, to work out the throughput.
+
+        Returns:
+            The arguments to PyKEEN's `TrainingLoop.train`, or the pipeline's `training_kwargs`.
+        """
+        training_kwargs: Dict[str, Any] = dict(batch_size=batch_size,
+                                               slice_size=self.slice_size,
+                                               sub_batch_size=self.sub_batch_size,
+                                               num_workers=self.num_workers,
+                                               # Pinned memory only speeds up copying to a GPU.
+                                               pin_memory=False)
+        if self.log_throughput or self.throughput_callback is not None:
+            from clustering.training_callbacks import ThroughputCallback
+
+            training_kwargs["callbacks"] = [ThroughputCallback(num_training_triples, self.throughput_callback)]
+        return training_kwargs
+
+
+def estimate_batch_size(model,
+                        memory_budget_bytes: int,
+                        num_negatives_per_positive: int = 1,
+                        max_batch_size: int = 65536) -> int:
+    """
+    Estimates the largest power of two batch size of the sLCWA training whose memory fits in the
+    budget. The parameters, their gradients and the optimizer state take a fixed amount of
+    memory, and each positive triple and its negatives take the memory of the embedding rows
+    they gather and their gradients.
+
+    Args:
+        model: The PyKEEN model to train.
+        memory_budget_bytes: The memory the training may use.
+        num_negatives_per_positive: The number of negative triples scored with each positive.
+        max_batch_size: The largest batch size to return.
+
+    Returns:
+        The batch size, at least 1.
+    """
+    parameter_bytes = sum(parameter.numel() * parameter.element_size() for parameter in model.parameters())
+    fixed_bytes = _COPIES_PER_PARAMETER * parameter_bytes
+    entity_row_bytes = sum(_get_row_bytes(representation) for representation in model.entity_representations)
+    relation_row_bytes = sum(_get_row_bytes(representation) for representation in model.relation_representations)
+    bytes_per_positive = _ACTIVATION_FACTOR * (1 + num_negatives_per_positive) \
+        * (2 * entity_row_bytes + relation_row_bytes)
+    available_bytes = memory_budget_bytes - fixed_bytes
+    if available_bytes < bytes_per_positive:
+        logger.warning("The parameters alone need about %d bytes, more than the memory budget allows.",
+                       fixed_bytes)
+        return 1
+    batch_size = 1
+    while batch_size * 2 <= min(available_bytes // bytes_per_positive, max_batch_size):
+        batch_size *= 2
+    return batch_size
+
+
+def _get_row_bytes(representation) -> int:
+    """
+    Returns:
+        The bytes of a single row of the representation's parameters.
+    """
+    return sum(parameter.numel() * parameter.element_size() for parameter in representation.parameters()) \
+        // max(representation.max_id, 1)
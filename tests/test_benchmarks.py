@@ -0,0 +1,46 @@
+"""
+Test the synthetic rate beer files used by the benchmarks
+"""
+from benchmarks.synthetic_rate_beer import write_synthetic_rate_beer
+from clustering.rate_beer_loader import RateBeerLoader
+
+
+def test_synthetic_file_is_loaded(tmp_path):
+    """
+    The synthetic file is in the rate beer format, with only the given reviewers and beers.
+    """
+    location = write_synthetic_rate_beer(tmp_path.joinpath("synthetic.txt"), number_of_reviews=500,
+                                         number_of_reviewers=20, number_of_beers=50, seed=1)
+    rate_beer = RateBeerLoader(location).load_rate_beer()
+    assert len(rate_beer) == 500
+    assert len({review["review"]["profileName"] for review in rate_beer}) <= 20
+    assert len({review["beer"]["beerId"] for review in rate_beer}) <= 50
+    assert set(rate_beer[0]["review"]) >= {"appearance", "aroma", "palate", "taste", "overall", "profileName",
+                                           "Year", "Month", "DayOfWeek"}
+
+
+def test_synthetic_file_is_reproducible(tmp_path):
+    """
+    The same seed writes the same file and a larger skew gives the most active reviewer more reviews.
+    """
+    first = write_synthetic_rate_beer(tmp_path.joinpath("first.txt"), 300, 30, 30, seed=2)
+    second = write_synthetic_rate_beer(tmp_path.joinpath("second.txt"), 300, 30, 30, seed=2)
+    assert first.read_bytes() == second.read_bytes()
+
+    even = RateBeerLoader(write_synthetic_rate_beer(tmp_path.joinpath("even.txt"), 3000, 30, 30,
+                                                    reviewer_skew=0.0, seed=2))
+    skewed = RateBeerLoader(write_synthetic_rate_beer(tmp_path.joinpath("skewed.txt"), 3000, 30, 30,
+                                                      reviewer_skew=2.0, seed=2))
+    even.load_rate_beer()
+    skewed.load_rate_beer()
+    assert max(skewed.all_reviewers.values()) > max(even.all_reviewers.values())
+
+
+def test_core_modules_do_not_import_backends():
+    """
+    Parsing the file and building the graph never imports PyTorch, PyKEEN or sklearn.
+    """
+    from benchmarks.import_time import CORE_MODULES, measure_import
+
+    for module in CORE_MODULES:
+        assert measure_import(module)["backends"] == [], module
@@ -0,0 +1,51 @@
+"""
+Test the customer clustering
+"""
+import numpy as np
+
+from clustering.customerclustering import RateBeerCustomerClusterCreator
+
+cluster_centres = np.array([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]])
+
+
+def _create_embeddings(points_per_cluster=50):
+    random_generator = np.random.default_rng(100)
+    embeddings = np.vstack([centre + random_generator.normal(scale=0.5, size=(points_per_cluster, 3))
+                            for centre in cluster_centres])
+    names = [f"reviewer_{i}" for i in range(len(embeddings))]
+    return embeddings, names
+
+
+def test_finds_elbow():
+    """
+    The elbow is found at the number of clusters the embeddings were created with, whether the
+    clusters are fitted in parallel or warm started.
+    """
+    embeddings, names = _create_embeddings()
+    for options in [dict(num_workers=1), dict(num_workers=2), dict(warm_start=True)]:
+        creator = RateBeerCustomerClusterCreator(embeddings, names, random_state=100, **options)
+        labels, centroids = creator.fit()
+        assert creator.number_of_clusters == len(cluster_centres)
+        assert centroids.shape == cluster_centres.shape
+        assert len(set(labels[:50])) == 1
+        assert len(set(labels)) == len(cluster_centres)
+        assert creator.get_clusters()["reviewer_0"] == labels[0]
+        assert list(creator.inertias) == list(range(2, 10))
+
+
+def test_mini_batch_from_memory_mapped_file(tmp_path):
+    """
+    Mini-batch k-means over a memory mapped file finds the same clusters, and new reviewers are
+    assigned to the fitted centroids.
+    """
+    embeddings, names = _create_embeddings()
+    embeddings_location = tmp_path.joinpath("reviewer_embeddings.npy")
+    np.save(embeddings_location, embeddings)
+    for options in [dict(num_workers=1), dict(num_workers=2), dict(warm_start=True)]:
+        creator = RateBeerCustomerClusterCreator(embeddings_location, names, random_state=100,
+                                                 batch_size=64, mini_batch_passes=3, **options)
+        labels, centroids = creator.fit()
+        assert creator.number_of_clusters == len(cluster_centres)
+        assert len(set(labels)) == len(cluster_centres)
+        np.testing.assert_array_equal(creator.assign(embeddings, batch_size=32), labels)
+        assert creator.assign(cluster_centres[:1])[0] == labels[0]
@@ -0,0 +1,50 @@
+"""
+Test the date fields created from the review times
+"""
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pytest
+
+from clustering.dates import create_date_columns, expand_times
+from clustering.rate_beer_loader import _create_date_details
+
+
+@pytest.mark.parametrize("timezone_name", ["UTC", "America/New_York", "Australia/Lord_Howe"])
+def test_matches_datetime(timezone_name):
+    """
+    The vectorised dates match datetime, including the hours around daylight saving changes.
+    """
+    # Every 7 minutes over two years, covering several daylight saving changes.
+    times = np.arange(1136073600, 1199145600, 7 * 60, dtype=np.int64)
+    year, month, day_of_week = expand_times(times, timezone_name)
+    expected = [datetime.fromtimestamp(time, ZoneInfo(timezone_name)) for time in times.tolist()]
+    assert year.tolist() == [date.year for date in expected]
+    assert month.tolist() == [date.month for date in expected]
+    assert day_of_week.tolist() == [date.weekday() for date in expected]
+
+
+def test_timezone_is_explicit():
+    """
+    The default is UTC whatever the local timezone, a review late in the UTC day is the next day
+    further east.
+    """
+    time = 1157587200 + 23 * 3600
+    assert [value.tolist() for value in expand_times(np.array([time]))] == [[2006], [9], [3]]
+    assert [value.tolist() for value in expand_times(np.array([time]), "Asia/Tokyo")] == [[2006], [9], [4]]
+    assert [value.tolist() for value in expand_times(np.array([time]), timezone.utc)] == [[2006], [9], [3]]
+
+
+def test_entity_names_are_shared():
+    """
+    The date fields are integer coded and each distinct value has a single entity name.
+    """
+    date_columns = create_date_columns(np.array([1157587200, 1157587200 + 86400, 1157587200]))
+    codes, names = date_columns["DayOfWeek"]
+    assert codes.tolist() == [0, 1, 0]
+    assert names == ["wk_3", "wk_4"]
+
+    reviews = _create_date_details([{"review": {"time": "1157587200"}} for _ in range(3)])
+    assert reviews[0]["review"] == {"time": "1157587200", "Year": "yr_2006", "DayOfWeek": "wk_3", "Month": "mon_9"}
+    assert reviews[0]["review"]["Year"] is reviews[2]["review"]["Year"]
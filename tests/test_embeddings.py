@@ -0,0 +1,58 @@
+"""
+Test the reviewer embedding extraction
+"""
+from pathlib import Path
+
+import numpy as np
+import torch
+from pykeen.models import TransE
+from pykeen.triples import TriplesFactory
+
+from clustering.embeddings import (extract_reviewer_embeddings, find_reviewer_entities, load_reviewer_embeddings,
+                                   read_entity_to_id, read_training_triples)
+from clustering.rate_beer_loader import RateBeerLoaderPykeen, RateBeerLoader
+
+beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+
+def test_extract_reviewer_embeddings(tmp_path):
+    """
+    The embeddings of every reviewer are written in batches and match the model's embeddings.
+    """
+    torch.manual_seed(100)
+    loader = RateBeerLoaderPykeen(beer_location, "test_embeddings_checkpoint.pt", write_training_file=False,
+                                  cache_directory=tmp_path.joinpath("cache"))
+    training_factory = loader.get_rate_beer()
+    model = TransE(triples_factory=training_factory, embedding_dim=8)
+
+    training_factory.to_path_binary(tmp_path.joinpath("training_triples"))
+    entity_to_id = read_entity_to_id(tmp_path)
+    assert entity_to_id == training_factory.entity_to_id
+
+    embeddings, reviewer_names = extract_reviewer_embeddings(model, read_training_triples(tmp_path),
+                                                             tmp_path.joinpath("reviewers"), batch_size=7)
+    reviewers = RateBeerLoader(beer_location)
+    reviewers.load_rate_beer()
+    assert set(reviewer_names) == set(reviewers.all_reviewers)
+
+    loaded_embeddings, loaded_names = load_reviewer_embeddings(tmp_path.joinpath("reviewers"))
+    assert loaded_names == reviewer_names
+    indices = torch.tensor([entity_to_id["pro" + name] for name in reviewer_names])
+    with torch.no_grad():
+        expected = model.entity_representations[0](indices=indices).numpy()
+    np.testing.assert_allclose(loaded_embeddings, expected)
+
+
+def test_reviewers_are_the_profile_name_tails():
+    """
+    Only the tails of the profileName triples are reviewers, whatever the other entities are
+    called.
+    """
+    factory = TriplesFactory.from_labeled_triples(np.array([["0", "profileName", "proalice"],
+                                                            ["1", "profileName", "probob"],
+                                                            ["0", "beerId", "bee7"],
+                                                            ["bee7", "style", "proper lager"],
+                                                            ["1", "overall", "pro"]]))
+    reviewer_names, reviewer_ids = find_reviewer_entities(factory)
+    assert sorted(reviewer_names) == ["alice", "bob"]
+    assert sorted(reviewer_ids.tolist()) == sorted([factory.entity_to_id["proalice"], factory.entity_to_id["probob"]])
@@ -0,0 +1,103 @@
+"""
+Test the type restricted evaluation
+"""
+from pathlib import Path
+
+import torch
+from pykeen.constants import PYKEEN_CHECKPOINTS
+from pykeen.models import TransE
+
+from clustering.evaluation import TypeRestrictedEvaluator, subsample_triples
+from clustering.pykeen_version import RateBeerPykeen
+from clustering.rate_beer_loader import REVIEWER_PREFIX, RateBeerLoaderPykeen
+
+beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+
+def test_reviewers_are_only_profile_name_candidates(tmp_path):
+    """
+    The candidate tails of profileName are the reviewers, and the reviewers are the candidates
+    of no other relation.
+    """
+    loader = RateBeerLoaderPykeen(beer_location, "test_evaluation_checkpoint.pt", write_training_file=False,
+                                  cache_directory=tmp_path)
+    factory = loader.get_rate_beer()
+    evaluator = TypeRestrictedEvaluator(factory.mapped_triples)
+    reviewers = {entity_id for entity, entity_id in factory.entity_to_id.items() if entity.startswith(REVIEWER_PREFIX)}
+    for relation, relation_id in factory.relation_to_id.items():
+        for target in ("head", "tail"):
+            candidates = set(evaluator.get_candidates(relation_id, target).tolist())
+            if relation == "profileName" and target == "tail":
+                assert candidates == reviewers
+            else:
+                assert not candidates & reviewers
+
+
+def test_sampled_evaluation_is_repeatable(tmp_path):
+    """
+    Each evaluation draws the same negatives, so an unchanged model gets the same metrics.
+    """
+    torch.manual_seed(100)
+    loader = RateBeerLoaderPykeen(beer_location, "test_evaluation_checkpoint.pt", write_training_file=False,
+                                  cache_directory=tmp_path)
+    factory = loader.get_rate_beer()
+    training, testing = factory.split([0.9, 0.1], random_state=100)
+    model = TransE(triples_factory=training, embedding_dim=8, random_seed=100)
+    evaluator = TypeRestrictedEvaluator([training.mapped_triples, testing.mapped_triples], num_negatives=5)
+    results = [evaluator.evaluate(model, testing.mapped_triples, additional_filter_triples=[training.mapped_triples],
+                                  batch_size=64, use_tqdm=False).get_metric("inverse_harmonic_mean_rank")
+               for _ in range(2)]
+    assert results[0] == results[1]
+    assert 0 < results[0] <= 1
+
+
+def test_matches_pykeen_when_every_entity_is_a_candidate():
+    """
+    When every entity is a candidate of every relation the ranks are those of PyKEEN's filtered
+    rank-based evaluation.
+    """
+    from pykeen.evaluation import RankBasedEvaluator
+    from pykeen.triples import CoreTriplesFactory
+
+    entities = torch.arange(6)
+    training = torch.cat([torch.stack([entities, torch.full_like(entities, relation), (entities + 1) % 6], dim=1)
+                          for relation in range(2)])
+    testing = torch.tensor([[0, 0, 2], [3, 1, 5], [4, 0, 1]])
+    factory = CoreTriplesFactory.create(training, num_entities=6, num_relations=2)
+    model = TransE(triples_factory=factory, embedding_dim=4, random_seed=100)
+    evaluate_kwargs = dict(additional_filter_triples=[training], batch_size=2, use_tqdm=False)
+    restricted = TypeRestrictedEvaluator([training, testing]).evaluate(model, testing, **evaluate_kwargs)
+    pykeen = RankBasedEvaluator(filtered=True).evaluate(model, testing, **evaluate_kwargs)
+    for metric in ("arithmetic_mean_rank", "inverse_harmonic_mean_rank", "hits_at_1"):
+        assert abs(restricted.get_metric(metric) - pykeen.get_metric(metric)) < 1e-6
+
+
+def test_subsample_triples(tmp_path):
+    """
+    The subsample keeps the entities and relations of the factory.
+    """
+    loader = RateBeerLoaderPykeen(beer_location, "test_evaluation_checkpoint.pt", write_training_file=False,
+                                  cache_directory=tmp_path)
+    factory = loader.get_rate_beer()
+    subsample = subsample_triples(factory, 20, random_seed=100)
+    assert subsample.num_triples == 20
+    assert subsample.num_entities == factory.num_entities
+    assert subsample_triples(factory, None) is factory
+
+
+def test_fit_with_type_restricted_evaluation(tmp_path):
+    """
+    The early stopper checks the validation subsample with the type restricted evaluator.
+    """
+    checkpoint_name = "test_rate_beer_pykeen_evaluation.pt"
+    engine = RateBeerPykeen(beer_location, checkpoint_name=checkpoint_name, embedding_dim=8, num_epochs=4,
+                            batch_size=256, num_threads=1, random_seed=100, num_evaluation_negatives=10,
+                            num_validation_triples=50,
+                            loader_kwargs=dict(write_training_file=False, cache_directory=tmp_path))
+    try:
+        trained = engine.fit()
+    finally:
+        PYKEEN_CHECKPOINTS.joinpath(checkpoint_name).unlink(missing_ok=True)
+    assert isinstance(trained.pipeline_result.stopper.evaluator, TypeRestrictedEvaluator)
+    assert trained.pipeline_result.stopper.evaluation_triples_factory.num_triples == 50
+    assert 0 < trained.pipeline_result.metric_results.get_metric("hits_at_10") <= 1
@@ -0,0 +1,91 @@
+"""
+Test appending reviews to the graph
+"""
+from pathlib import Path
+
+from clustering.incremental import IncrementalRateBeerGraph
+from clustering.rate_beer_loader import RateBeerLoaderPykeen
+
+beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+
+def _labelled_triples(mapped_triples, entity_to_id, relation_to_id):
+    id_to_entity = {entity_id: entity for entity, entity_id in entity_to_id.items()}
+    id_to_relation = {relation_id: relation for relation, relation_id in relation_to_id.items()}
+    return {(id_to_entity[head], id_to_relation[relation], id_to_entity[tail])
+            for head, relation, tail in mapped_triples.tolist()}
+
+
+def test_single_batch_matches_loader(tmp_path):
+    """
+    Adding every review at once gives the same graph as the loader.
+    """
+    graph = IncrementalRateBeerGraph(tmp_path.joinpath("graph"))
+    graph.add_reviews(beer_location)
+    loader = RateBeerLoaderPykeen(beer_location, "test_incremental_checkpoint.pt", write_training_file=False,
+                                  cache_directory=tmp_path.joinpath("cache"))
+    factory = loader.get_rate_beer()
+    assert _labelled_triples(graph.mapped_triples, graph.entity_to_id, graph.relation_to_id) == \
+        _labelled_triples(factory.mapped_triples, factory.entity_to_id, factory.relation_to_id)
+
+
+def test_append_keeps_ids_and_links_reviewers(tmp_path):
+    """
+    Reviews added later keep the earlier entity ids and are linked to the reviewer's latest review.
+    """
+    review_blocks = beer_location.read_text(encoding="utf-8", errors="replace").strip().split("\n\n")
+    first_file = tmp_path.joinpath("first.txt")
+    second_file = tmp_path.joinpath("second.txt")
+    first_file.write_text("\n\n".join(review_blocks[:100]) + "\n", encoding="utf-8")
+    second_file.write_text("\n\n".join(review_blocks[100:]) + "\n", encoding="utf-8")
+
+    graph = IncrementalRateBeerGraph(tmp_path.joinpath("graph"))
+    graph.add_reviews(first_file)
+    first_entities = dict(graph.entity_to_id)
+    first_triples = graph.mapped_triples.copy()
+    first_reviewers = {line for block in review_blocks[:100] for line in block.split("\n")
+                       if line.startswith("review/profileName")}
+    reviewer = next(line for block in review_blocks[100:] for line in block.split("\n")
+                    if line in first_reviewers)[len("review/profileName: "):]
+    latest_review, _ = graph.get_latest_review(reviewer)
+
+    reloaded = IncrementalRateBeerGraph(tmp_path.joinpath("graph"))
+    appended = reloaded.add_reviews(second_file)
+    assert len(reloaded) == len(review_blocks)
+    assert all(reloaded.entity_to_id[entity] == entity_id for entity, entity_id in first_entities.items())
+    assert (reloaded.mapped_triples[:len(first_triples)] == first_triples).all()
+
+    new_latest_review, _ = reloaded.get_latest_review(reviewer)
+    assert new_latest_review != latest_review
+    labelled = _labelled_triples(appended, reloaded.entity_to_id, reloaded.relation_to_id)
+    assert any(head == latest_review and relation == "pre" for head, relation, _ in labelled)
+    assert reloaded.get_triples_factory().num_triples == len(reloaded.mapped_triples)
+
+
+def test_seed_from_loader(tmp_path):
+    """
+    A graph seeded from the loader's cached factory extends it the same as a graph built from
+    every batch, and isn't evicted by a loader sharing its cache directory.
+    """
+    review_blocks = beer_location.read_text(encoding="utf-8", errors="replace").strip().split("\n\n")
+    first_file = tmp_path.joinpath("first.txt")
+    second_file = tmp_path.joinpath("second.txt")
+    first_file.write_text("\n\n".join(review_blocks[:100]) + "\n", encoding="utf-8")
+    second_file.write_text("\n\n".join(review_blocks[100:]) + "\n", encoding="utf-8")
+
+    built = IncrementalRateBeerGraph(tmp_path.joinpath("built"))
+    built.add_reviews(first_file)
+    built.add_reviews(second_file)
+
+    cache_directory = tmp_path.joinpath("cache")
+    loader = RateBeerLoaderPykeen(first_file, "test_incremental_checkpoint.pt", write_training_file=False,
+                                  cache_directory=cache_directory)
+    seeded = IncrementalRateBeerGraph.from_loader(loader, cache_directory)
+    assert len(seeded) == 100
+    seeded.add_reviews(second_file)
+    assert _labelled_triples(seeded.mapped_triples, seeded.entity_to_id, seeded.relation_to_id) == \
+        _labelled_triples(built.mapped_triples, built.entity_to_id, built.relation_to_id)
+
+    RateBeerLoaderPykeen(second_file, "test_incremental_checkpoint.pt", write_training_file=False,
+                         cache_directory=cache_directory, cache_size_limit=1)
+    assert len(IncrementalRateBeerGraph(cache_directory)) == len(review_blocks)
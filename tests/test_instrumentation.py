@@ -0,0 +1,47 @@
+"""
+Test the stages of loading are measured
+"""
+import logging
+from pathlib import Path
+
+from clustering.instrumentation import PipelineInstrumentation
+from clustering.rate_beer_loader import RateBeerLoader, RateBeerLoaderPykeen
+
+beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+
+def test_stages_are_passed_to_callback():
+    """
+    Each stage of `load_rate_beer` is measured in order and passed to the callback.
+    """
+    exported = []
+    loader = RateBeerLoader(beer_location, instrumentation=PipelineInstrumentation(callback=exported.append))
+    rate_beer = loader.load_rate_beer()
+
+    assert [metrics.stage for metrics in exported] == ["process_rate_beer_file", "create_review_id",
+                                                       "connect_reviews_using_id"]
+    assert exported == loader.instrumentation.stages
+    for metrics in exported:
+        assert metrics.seconds >= 0
+        assert metrics.reviews == len(rate_beer)
+        assert metrics.peak_rss_bytes is None or metrics.peak_rss_bytes > 0
+    assert exported[0].reviewers == len(loader.all_reviewers)
+    assert set(exported[0].as_dict()) >= {"stage", "seconds", "reviews", "reviewers"}
+
+
+def test_triple_stages_are_logged(tmp_path, caplog):
+    """
+    The stages building the triples record the number of entities and triples, and are logged.
+    """
+    with caplog.at_level(logging.INFO, logger="clustering.instrumentation"):
+        loader = RateBeerLoaderPykeen(beer_location, "test_instrumentation_checkpoint.pt",
+                                      write_training_file=False, cache_directory=tmp_path,
+                                      min_reviews_per_reviewer=2)
+    training_factory = loader.get_rate_beer()
+
+    created = loader.instrumentation.get_stage("create_training_factory")
+    assert created.entities == training_factory.num_entities
+    assert created.triples == training_factory.num_triples
+    assert loader.instrumentation.get_stage("count_reviewers").reviewers > len(loader.all_reviewers)
+    assert loader.instrumentation.get_stage("load_cached_triples").triples is None
+    assert "create_training_factory" in caplog.text
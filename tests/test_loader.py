@@ -166,3 +166,76 @@ def test_load_beer_file():
         unittest.TestCase().assertDictEqual(review_value, expected_result)
 
 
+def test_iterate_rate_beer_streams_reviews():
+    """
+    The reviews are streamed one at a time with the text skipped and the date fields created.
+    """
+    streamed_reviews = list(rb_loader.RateBeerLoader(location_for_file).iterate_rate_beer())
+    assert len(streamed_reviews) == len(expected_beer_results)
+    for review in streamed_reviews:
+        assert "text" not in review["review"]
+        assert {"Year", "Month", "DayOfWeek", "time"} <= review["review"].keys()
+        assert review["beer"].keys() == {"beerId", "style"}
+
+
+def test_load_rate_beer_table_matches_reviews():
+    """
+    The columnar table holds the same reviews, ids and links as the list of dictionaries.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    reviews = rb_loader.RateBeerLoader(beer_location, limit_reviews_per_reviewer=3)
+    table_loader = rb_loader.RateBeerLoader(beer_location, limit_reviews_per_reviewer=3)
+    table = table_loader.load_rate_beer_table()
+    assert table.to_reviews() == reviews.load_rate_beer()
+    assert table_loader.all_reviewers == reviews.all_reviewers
+
+
+def test_parallel_load_matches_serial():
+    """
+    Parsing the file in byte ranges across processes gives the same reviews as reading it in one.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    serial = rb_loader.RateBeerLoader(beer_location, limit_reviews_per_reviewer=3)
+    parallel = rb_loader.RateBeerLoader(beer_location, limit_reviews_per_reviewer=3, num_workers=3)
+    assert parallel.load_rate_beer() == serial.load_rate_beer()
+    assert parallel.all_reviewers == serial.all_reviewers
+
+    parallel_table = rb_loader.RateBeerLoader(beer_location, num_workers=3).load_rate_beer_table()
+    serial_table = rb_loader.RateBeerLoader(beer_location).load_rate_beer_table()
+    assert parallel_table.to_reviews() == serial_table.to_reviews()
+
+
+def test_reviewer_filters():
+    """
+    Only the reviews of reviewers within the review count filters are kept.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    all_reviews = rb_loader.RateBeerLoader(beer_location)
+    all_reviews.load_rate_beer()
+
+    filtered = rb_loader.RateBeerLoader(beer_location, limit_reviews_per_reviewer=4, min_reviews_per_reviewer=2)
+    filtered_reviews = filtered.load_rate_beer()
+    expected_reviewers = {reviewer: count for reviewer, count in all_reviews.all_reviewers.items()
+                          if 2 <= count <= 4}
+    assert dict(filtered.all_reviewers) == expected_reviewers
+    assert len(filtered_reviews) == sum(expected_reviewers.values())
+
+    top = rb_loader.RateBeerLoader(beer_location, top_reviewers=1, num_workers=2)
+    top_reviews = top.load_rate_beer()
+    assert top.all_reviewers.most_common() == all_reviews.all_reviewers.most_common(1)
+    assert len(top_reviews) == all_reviews.all_reviewers.most_common(1)[0][1]
+
+
+def test_reloading_keeps_reviewer_counts():
+    """
+    Loading again counts the reviewers of that load rather than adding to the earlier counts.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    for loader_kwargs in ({}, {"limit_reviews_per_reviewer": 4}):
+        loader = rb_loader.RateBeerLoader(beer_location, **loader_kwargs)
+        loader.load_rate_beer()
+        counts = dict(loader.all_reviewers)
+        loader.load_rate_beer()
+        assert dict(loader.all_reviewers) == counts
+        loader.load_rate_beer_table()
+        assert dict(loader.all_reviewers) == counts
@@ -0,0 +1,71 @@
+"""
+Test the reviewer sequences for the LSTM
+"""
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from clustering.rate_beer_loader import RateBeerLoader, RateBeerLoaderLSTM
+
+beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+
+def test_sequences_follow_connected_reviews():
+    """
+    Each reviewer's sequence is their reviews in the order they are connected by precedes.
+    """
+    sequences = RateBeerLoaderLSTM(beer_location).get_sequences()
+    rate_beer = RateBeerLoader(beer_location).load_rate_beer()
+    reviewer_index = {reviewer: i for i, reviewer in enumerate(sequences.reviewers)}
+    # The beers are coded in the order they are first seen in the file, 0 being padding.
+    beer_index = {}
+    for review in RateBeerLoader(beer_location).iterate_rate_beer():
+        beer_index.setdefault(review["beer"]["beerId"], len(beer_index) + 1)
+
+    assert sequences.offsets[-1] == len(rate_beer) == len(sequences.features)
+    first_reviews = [review for review in rate_beer if "succeeds" not in review]
+    assert len(first_reviews) == len(sequences)
+    for review in first_reviews:
+        beers = [beer_index[review["beer"]["beerId"]]]
+        while "precedes" in review:
+            review = rate_beer[int(review["precedes"])]
+            beers.append(beer_index[review["beer"]["beerId"]])
+        sequence = sequences.get_sequence(reviewer_index[review["review"]["profileName"]])
+        assert sequence[:, sequences.feature_names.index("beerId")].tolist() == beers
+    assert (sequences.features > 0).all(axis=0)[:2].all()
+    assert (sequences.features < np.array(sequences.vocabulary_sizes)).all()
+
+
+def test_batches_cover_every_review_once():
+    """
+    The padded batches hold every review once, long sequences are split at max_length.
+    """
+    loader = RateBeerLoaderLSTM(beer_location)
+    sequences = loader.get_sequences()
+    dataset = loader.get_dataset(batch_size=4, max_length=3, bucket_batches=2, seed=1)
+    seen = {i: [] for i in range(len(sequences))}
+    number_of_batches = 0
+    for features, lengths, reviewers in DataLoader(dataset, batch_size=None):
+        number_of_batches += 1
+        assert features.shape[1] == lengths.max() <= 3
+        for segment, length, reviewer in zip(features, lengths.tolist(), reviewers.tolist()):
+            assert (segment[length:] == 0).all()
+            seen[reviewer].append(segment[:length])
+    assert number_of_batches == len(dataset)
+    for reviewer, segments in seen.items():
+        reviews = torch.cat(segments).numpy()
+        expected = sequences.get_sequence(reviewer)
+        assert sorted(map(tuple, reviews.tolist())) == sorted(map(tuple, expected.tolist()))
+
+
+def test_batches_are_reproducible():
+    """
+    The same seed and epoch gives the same batches, another epoch is shuffled differently.
+    """
+    dataset = RateBeerLoaderLSTM(beer_location).get_dataset(batch_size=8, max_length=None, seed=2)
+    first = [reviewers.tolist() for _, _, reviewers in dataset]
+    assert first == [reviewers.tolist() for _, _, reviewers in dataset]
+    dataset.set_epoch(1)
+    assert first != [reviewers.tolist() for _, _, reviewers in dataset]
@@ -0,0 +1,59 @@
+"""
+Test the preprocessing cache
+"""
+import numpy as np
+
+from clustering.preprocessing_cache import PreprocessingCache
+
+entity_to_id = {"hopdog": 0, "0": 1, "1": 2}
+relation_to_id = {"pre": 0, "profileName": 1}
+mapped_triples = np.array([[1, 0, 2], [1, 1, 0]], dtype=np.int64)
+
+
+def test_save_and_load(tmp_path):
+    """
+    An entry is loaded back the same as it was saved, and a missing entry is None.
+    """
+    input_file = tmp_path.joinpath("ratebeer.txt")
+    input_file.write_text("review/profileName: hopdog\n")
+    cache = PreprocessingCache(tmp_path.joinpath("cache"))
+    key = cache.get_key(input_file, limit_reviews_per_reviewer=None)
+    assert cache.load(key) is None
+
+    cache.save(key, mapped_triples, entity_to_id, relation_to_id)
+    loaded_triples, loaded_entities, loaded_relations = cache.load(key)
+    np.testing.assert_array_equal(loaded_triples, mapped_triples)
+    assert loaded_entities == entity_to_id
+    assert loaded_relations == relation_to_id
+
+
+def test_key_changes_with_file_and_parameters(tmp_path):
+    """
+    The key changes when the input file or the parameters change.
+    """
+    input_file = tmp_path.joinpath("ratebeer.txt")
+    input_file.write_text("review/profileName: hopdog\n")
+    cache = PreprocessingCache(tmp_path.joinpath("cache"))
+    key = cache.get_key(input_file, limit_reviews_per_reviewer=None)
+    assert key == cache.get_key(input_file, limit_reviews_per_reviewer=None)
+    assert key != cache.get_key(input_file, limit_reviews_per_reviewer=500)
+
+    input_file.write_text("review/profileName: hopdog\n\nreview/profileName: TomDecapolis\n")
+    assert key != cache.get_key(input_file, limit_reviews_per_reviewer=None)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    """
+    Once over the size limit the least recently used entries are removed.
+    """
+    cache_directory = tmp_path.joinpath("cache")
+    PreprocessingCache(cache_directory).save("first", mapped_triples, entity_to_id, relation_to_id)
+    entry_size = sum(file.stat().st_size for file in cache_directory.joinpath("first").iterdir())
+
+    cache = PreprocessingCache(cache_directory, max_size_bytes=int(2.5 * entry_size))
+    cache.save("second", mapped_triples, entity_to_id, relation_to_id)
+    assert cache.load("first") is not None
+    cache.save("third", mapped_triples, entity_to_id, relation_to_id)
+    assert cache.load("second") is None
+    assert cache.load("first") is not None
+    assert cache.load("third") is not None
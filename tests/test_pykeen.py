@@ -1,13 +1,13 @@
 from pathlib import Path
 
+import numpy as np
 import torch
 from pykeen.triples import TriplesFactory
 
 from clustering.rate_beer_loader import RateBeerLoaderPykeen
 
 
-
-def test_get_rate_beer_plain_no_checkpoint():
+def test_get_rate_beer_plain_no_checkpoint(tmp_path):
     """
     This will test the Pykeen rate beer loader to ensure it can load the data
     in the format needed.
@@ -16,12 +16,12 @@ def test_get_rate_beer_plain_no_checkpoint():
     beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
 
     checkpoint_name = "test_pykeen_plain_checkpoint.pt"
-    loader = RateBeerLoaderPykeen(beer_location, checkpoint_name)
+    loader = RateBeerLoaderPykeen(beer_location, checkpoint_name, cache_directory=tmp_path.joinpath("cache"))
     rate_beer_res = loader.get_rate_beer()
-    _run_training(rate_beer_res, checkpoint_name=checkpoint_name)
+    _run_training(rate_beer_res, checkpoint_name=checkpoint_name, checkpoint_directory=tmp_path)
 
 
-def _run_training(training_data, checkpoint_name):
+def _run_training(training_data, checkpoint_name, checkpoint_directory):
     from pykeen.pipeline import pipeline
     from pykeen.models import TransE
 
@@ -30,12 +30,16 @@ def _run_training(training_data, checkpoint_name):
                                              training_loop='sLCWA', model=TransE,
                                              model_kwargs={"embedding_dim": 50},
                                              training_kwargs=dict(checkpoint_name=checkpoint_name,
+                                                                  checkpoint_directory=checkpoint_directory,
                                                                   checkpoint_frequency=1, num_epochs=200),
                                              stopper="early",
                                              stopper_kwargs=dict(frequency=2, patience=2, relative_delta=0.002,
-                                                                 metric="mean_reciprocal_rank"))
+                                                                 metric="mean_reciprocal_rank",
+                                                                 best_model_path=checkpoint_directory.joinpath(
+                                                                     "best-model-weights.pt")))
     return transe_model_pipeline_results
 
+
 def test_loads_previous_values():
     """
     Tests that the pipeline will load again and that the loaded model is not `None`.
@@ -43,6 +47,196 @@ def test_loads_previous_values():
     from pykeen.constants import PYKEEN_CHECKPOINTS
     torch.manual_seed(100)
     previous_checkpoint = PYKEEN_CHECKPOINTS.joinpath("torch_pipeline_checkpoints.pt")
-    loaded = torch.load(previous_checkpoint)
+    loaded = torch.load(previous_checkpoint, weights_only=False)
     entity_to_id = loaded["entity_to_id_dict"]
-    relationship_to_id = loaded["relation_to_id_dict"]
\ No newline at end of file
+    relationship_to_id = loaded["relation_to_id_dict"]
+
+
+def test_mapped_triples_match_training_file(tmp_path, monkeypatch):
+    """
+    Building the TriplesFactory from the mapped triples gives the same triples as the
+    training file, which is deleted rather than left in the working directory.
+    """
+    working_directory = tmp_path.joinpath("working")
+    working_directory.mkdir()
+    monkeypatch.chdir(working_directory)
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    checkpoint_name = "test_pykeen_mapped_checkpoint.pt"
+    from_file = RateBeerLoaderPykeen(beer_location, checkpoint_name, accept_previous_saves=False,
+                                     cache_directory=tmp_path.joinpath("file"))
+    from_mapped = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                       cache_directory=tmp_path.joinpath("mapped"))
+    file_triples = from_file.get_rate_beer().triples.tolist()
+    mapped_triples = from_mapped.get_rate_beer().triples.tolist()
+    assert sorted(map(tuple, file_triples)) == sorted(map(tuple, mapped_triples))
+    assert from_mapped.get_rate_beer().relation_to_id["pre"] == 0
+    assert not any(working_directory.iterdir())
+
+
+def test_triples_are_generated_once(tmp_path):
+    """
+    The style of each beer is only generated once and no triple is repeated, so the mapped
+    triples need no deduplication.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    loader = RateBeerLoaderPykeen(beer_location, "test_pykeen_unique_checkpoint.pt", write_training_file=False,
+                                  cache_directory=tmp_path)
+    loader._rate_beer_processed = loader.load_rate_beer()
+    triples = loader._create_hrt_list()
+    style_triples = [triple for triple in triples if triple[1] == "style"]
+    beers = {review["beer"]["beerId"] for review in loader.get_rate_beer_raw()}
+    assert len(style_triples) == len(beers)
+    assert len(set(map(tuple, triples))) == len(triples) == loader.num_triples
+    assert loader.num_entities == len({entity for head, _, tail in triples for entity in (head, tail)})
+
+
+def test_reuses_cached_triples(tmp_path):
+    """
+    A second loader with the same file and parameters uses the cached triples.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    checkpoint_name = "test_pykeen_cache_checkpoint.pt"
+    first = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                 cache_directory=tmp_path)
+    second = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                  cache_directory=tmp_path)
+    assert not second.get_rate_beer_raw()
+    assert torch.equal(first.get_rate_beer().mapped_triples, second.get_rate_beer().mapped_triples)
+    assert first.get_rate_beer().entity_to_id == second.get_rate_beer().entity_to_id
+
+    limited = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                   cache_directory=tmp_path, limit_reviews_per_reviewer=3)
+    assert limited.get_rate_beer_raw()
+
+
+def test_cache_key_follows_checkpoint_mappings(tmp_path):
+    """
+    Saving a checkpoint again with the same ids keeps the cached triples, changing the ids
+    doesn't.
+    """
+    from pykeen.constants import PYKEEN_CHECKPOINTS
+
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    checkpoint_name = "test_pykeen_cache_mappings_checkpoint.pt"
+    checkpoint = PYKEEN_CHECKPOINTS.joinpath(checkpoint_name)
+    factory = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                   cache_directory=tmp_path.joinpath("first")).get_rate_beer()
+    entity_to_id = dict(factory.entity_to_id)
+    try:
+        torch.save({"entity_to_id_dict": entity_to_id, "relation_to_id_dict": factory.relation_to_id}, checkpoint)
+        first = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                     cache_directory=tmp_path)
+        assert first.get_rate_beer_raw()
+        torch.save({"entity_to_id_dict": entity_to_id, "relation_to_id_dict": factory.relation_to_id}, checkpoint)
+        same_ids = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                        cache_directory=tmp_path)
+        assert not same_ids.get_rate_beer_raw()
+
+        first_entity, second_entity = list(entity_to_id)[:2]
+        entity_to_id[first_entity], entity_to_id[second_entity] = \
+            entity_to_id[second_entity], entity_to_id[first_entity]
+        torch.save({"entity_to_id_dict": entity_to_id, "relation_to_id_dict": factory.relation_to_id}, checkpoint)
+        changed_ids = RateBeerLoaderPykeen(beer_location, checkpoint_name, write_training_file=False,
+                                           cache_directory=tmp_path)
+        assert changed_ids.get_rate_beer_raw()
+        assert changed_ids.get_rate_beer().entity_to_id == entity_to_id
+    finally:
+        checkpoint.unlink(missing_ok=True)
+
+
+def test_rate_beer_pykeen_fit(tmp_path):
+    """
+    Creating the engine does no work, fitting trains a model that the reviewers can be clustered with.
+    """
+    from pykeen.constants import PYKEEN_CHECKPOINTS
+    from clustering.pykeen_version import RateBeerPykeen
+
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    checkpoint_name = "test_rate_beer_pykeen_fit.pt"
+    engine = RateBeerPykeen(beer_location, checkpoint_name=checkpoint_name, embedding_dim=8, num_epochs=2,
+                            batch_size=256, num_threads=1, stopper=None, random_seed=100,
+                            loader_kwargs=dict(write_training_file=False, cache_directory=tmp_path))
+    assert not any(tmp_path.iterdir())
+    try:
+        trained = engine.fit()
+    finally:
+        PYKEEN_CHECKPOINTS.joinpath(checkpoint_name).unlink(missing_ok=True)
+    cluster_creator = trained.create_cluster_creator(tmp_path, cluster_range=range(2, 5), random_state=100)
+    labels, centroids = cluster_creator.fit()
+    assert len(labels) == len(cluster_creator.get_clusters())
+    assert centroids.shape[1] == 8
+
+
+def test_affected_entities_come_from_the_triples():
+    """
+    The affected reviewers are the new profileName tails and the affected reviews the previous
+    reviews the new triples connect to, a style named like a reviewer or a numeric score isn't
+    taken for either.
+    """
+    from clustering.pykeen_version import _find_affected_entities
+
+    previous = [["0", "profileName", "proalice"], ["0", "overall", "5"], ["0", "beerId", "bee7"],
+                ["bee7", "style", "Lager"]]
+    new = [["1", "profileName", "proalice"], ["1", "overall", "5"], ["1", "beerId", "bee8"],
+           ["bee8", "style", "proper lager"], ["0", "pre", "1"], ["1", "suc", "0"]]
+    entity_to_id = {}
+    for head, _, tail in previous + new:
+        entity_to_id.setdefault(head, len(entity_to_id))
+        entity_to_id.setdefault(tail, len(entity_to_id))
+    relation_to_id = {relation: i for i, relation in enumerate(dict.fromkeys(r for _, r, _ in previous + new))}
+    mapped = np.array([[entity_to_id[h], relation_to_id[r], entity_to_id[t]] for h, r, t in previous + new])
+    factory = TriplesFactory(torch.as_tensor(mapped), entity_to_id=entity_to_id, relation_to_id=relation_to_id)
+    affected_entities, affected_reviewers = _find_affected_entities(mapped[len(previous):], factory, 5)
+    assert affected_reviewers == ["alice"]
+    assert sorted(affected_entities.tolist()) == sorted([entity_to_id["proalice"], entity_to_id["0"]])
+
+
+def test_refresh_grows_model_and_assigns_reviewers(tmp_path):
+    """
+    Refreshing keeps the trained embeddings of the existing entities, adds embeddings for the new
+    entities and assigns the updated reviewers to the existing clusters.
+    """
+    from pykeen.constants import PYKEEN_CHECKPOINTS
+    from pykeen.models import TransE
+    from clustering.customerclustering import RateBeerCustomerClusterCreator
+    from clustering.incremental import IncrementalRateBeerGraph
+    from clustering.pykeen_version import RateBeerPykeen
+
+    torch.manual_seed(100)
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    review_blocks = beer_location.read_text(encoding="utf-8", errors="replace").strip().split("\n\n")
+    first_file = tmp_path.joinpath("first.txt")
+    second_file = tmp_path.joinpath("second.txt")
+    first_file.write_text("\n\n".join(review_blocks[:100]) + "\n", encoding="utf-8")
+    second_file.write_text("\n\n".join(review_blocks[100:]) + "\n", encoding="utf-8")
+
+    graph = IncrementalRateBeerGraph(tmp_path.joinpath("graph"))
+    graph.add_reviews(first_file)
+    first_factory = graph.get_triples_factory()
+    model = TransE(triples_factory=first_factory, embedding_dim=8)
+    checkpoint_name = "test_refresh_checkpoint.pt"
+    refreshed_checkpoint_name = "test_refreshed_checkpoint.pt"
+    torch.save({"model_state_dict": model.state_dict(),
+                "entity_to_id_dict": first_factory.entity_to_id,
+                "relation_to_id_dict": first_factory.relation_to_id},
+               PYKEEN_CHECKPOINTS.joinpath(checkpoint_name))
+
+    new_triples = graph.add_reviews(second_file)
+    engine = RateBeerPykeen(beer_location, checkpoint_name=checkpoint_name, embedding_dim=8, batch_size=64)
+    try:
+        refreshed, updated_reviewers = engine.refresh(graph, new_triples, num_epochs=1,
+                                                      refreshed_checkpoint_name=refreshed_checkpoint_name)
+        assert PYKEEN_CHECKPOINTS.joinpath(refreshed_checkpoint_name).exists()
+    finally:
+        PYKEEN_CHECKPOINTS.joinpath(checkpoint_name).unlink(missing_ok=True)
+        PYKEEN_CHECKPOINTS.joinpath(refreshed_checkpoint_name).unlink(missing_ok=True)
+
+    assert refreshed.model.num_entities == len(graph.entity_to_id) > first_factory.num_entities
+    assert updated_reviewers
+
+    embeddings = np.random.default_rng(100).normal(size=(20, 8))
+    cluster_creator = RateBeerCustomerClusterCreator(embeddings, cluster_range=range(2, 4), random_state=100)
+    cluster_creator.fit()
+    assigned = refreshed.assign_reviewers(updated_reviewers, cluster_creator)
+    assert set(assigned) == set(updated_reviewers)
+    assert set(assigned.values()) <= set(range(cluster_creator.number_of_clusters))
@@ -0,0 +1,92 @@
+"""
+Test reading compressed files and the record formats
+"""
+import bz2
+import gzip
+import lzma
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import clustering.rate_beer_loader as rb_loader
+from clustering.compression import is_compressed, open_input
+from clustering.record_formats import UNKNOWN_GENRE, AnimeListRecordFormat, read_anime_genres
+
+BEER_LOCATION = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+ANIME_LIST = """username,anime_id,my_watched_episodes,my_start_date,my_finish_date,my_score,my_status,my_rewatching,my_rewatching_ep,my_last_updated,my_tags
+karthiga,21,586,0000-00-00,0000-00-00,9,1,,0,2013-03-03 10:52:53,
+karthiga,59,26,0000-00-00,0000-00-00,7,2,,0,2013-03-10 13:54:51,
+karthiga,74,0,0000-00-00,0000-00-00,0,6,,0,2013-04-27 16:43:35,
+RedvelvetDaisuki,21,12,0000-00-00,0000-00-00,0,1,,0,2014-01-02 08:00:00,"action, long"
+RedvelvetDaisuki,120,26,0000-00-00,0000-00-00,8,2,0,0,0000-00-00 00:00:00,
+Damonashu,59,3,2011-01-01,0000-00-00,6,1,0,0,1293840000,
+"""
+ANIME_GENRES = """anime_id,title,genre
+21,One Piece,"Action, Adventure, Comedy"
+59,Chobits,"Sci-Fi, Comedy"
+74,Gakuen Alice,
+"""
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, bz2.compress, lzma.compress])
+def test_compressed_files_are_read_the_same(tmp_path, compress):
+    """
+    A compressed copy of the file is read into the same reviews, also when filtering reviewers
+    and with several workers, which read the compressed file in a single process.
+    """
+    compressed_location = tmp_path.joinpath("ratebeer.compressed")
+    compressed_location.write_bytes(compress(BEER_LOCATION.read_bytes()))
+    assert is_compressed(compressed_location) and not is_compressed(BEER_LOCATION)
+
+    plain = rb_loader.RateBeerLoader(BEER_LOCATION, limit_reviews_per_reviewer=3)
+    compressed = rb_loader.RateBeerLoader(compressed_location, limit_reviews_per_reviewer=3, num_workers=2)
+    assert compressed.load_rate_beer() == plain.load_rate_beer()
+    assert compressed.all_reviewers == plain.all_reviewers
+    assert list(rb_loader.RateBeerLoader(compressed_location).iterate_rate_beer()) \
+        == list(rb_loader.RateBeerLoader(BEER_LOCATION).iterate_rate_beer())
+
+
+def test_stop_reading_early(tmp_path):
+    """
+    Closing a compressed file part way through stops its decompression thread.
+    """
+    compressed_location = tmp_path.joinpath("ratebeer.txt.gz")
+    compressed_location.write_bytes(gzip.compress(BEER_LOCATION.read_bytes() * 200))
+    with open_input(compressed_location) as compressed_file:
+        assert compressed_file.readline() == BEER_LOCATION.read_bytes().splitlines(keepends=True)[0]
+        assert not compressed_file.seekable()
+
+
+def test_anime_list(tmp_path):
+    """
+    The watched anime with valid times become reviews with their genre as the style, and the
+    rows are split between workers the same as they are read by one.
+    """
+    anime_location = tmp_path.joinpath("UserAnimeList.csv")
+    anime_location.write_text(ANIME_LIST * 3, encoding="utf-8")
+    genres_location = tmp_path.joinpath("AnimeList.csv.xz")
+    genres_location.write_bytes(lzma.compress(ANIME_GENRES.encode("utf-8")))
+    with open_input(genres_location) as genres_file:
+        genres = read_anime_genres(genres_file)
+    assert genres == {"21": "Action", "59": "Sci-Fi"}
+
+    record_format = AnimeListRecordFormat(genres)
+    table = rb_loader.RateBeerLoader(anime_location, record_format=record_format).load_rate_beer_table()
+    assert len(table) == 12
+    assert sorted(table.profile_vocabulary) == ["Damonashu", "RedvelvetDaisuki", "karthiga"]
+    assert sorted(table.style_vocabulary) == ["Action", "Sci-Fi"]
+    scored = table.score_denominators[:, -1] == 10
+    assert sorted(set(table.scores[scored, -1].tolist())) == [6, 7, 9]
+    assert (~scored).sum() == 3
+    assert table.time[0] == 1293840000
+
+    parallel = rb_loader.RateBeerLoader(anime_location, record_format=record_format, num_workers=3)
+    np.testing.assert_array_equal(parallel.load_rate_beer_table().time, table.time)
+
+    reviews = rb_loader.RateBeerLoader(anime_location, record_format=AnimeListRecordFormat(),
+                                       limit_reviews_per_reviewer=3).load_rate_beer()
+    assert {review["review"]["profileName"] for review in reviews} == {"Damonashu", "RedvelvetDaisuki"}
+    assert {review["beer"]["style"] for review in reviews} == {UNKNOWN_GENRE}
+    assert sum("precedes" in review for review in reviews) == 4
@@ -0,0 +1,90 @@
+"""
+Test the segment service
+"""
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.segment_service_load import run_load
+from clustering.segment_service import SegmentService
+
+
+def _create_service(**kwargs):
+    random_generator = np.random.default_rng(0)
+    embeddings = random_generator.normal(size=(50, 4))
+    centroids = random_generator.normal(size=(5, 4))
+    gathers = []
+
+    def gather(ids):
+        gathers.append(ids.tolist())
+        return embeddings[ids]
+
+    service = SegmentService(gather, {f"pro{i}": i for i in range(len(embeddings))}, centroids, **kwargs)
+    return service, embeddings, centroids, gathers
+
+
+def test_concurrent_lookups_are_gathered_together():
+    """
+    Concurrent lookups share one gather and are assigned to their nearest centroids.
+    """
+    service, embeddings, centroids, gathers = _create_service(num_nearest=2)
+    names = [f"pro{i}" for i in range(20)] + ["pro3"]
+    assignments = asyncio.run(service.assign_many(names))
+    assert len(gathers) == 1 and sorted(gathers[0]) == list(range(20))
+
+    distances = np.linalg.norm(embeddings[:20, None] - centroids[None], axis=2)
+    assert [assignment["segment"] for assignment in assignments[:20]] == distances.argmin(axis=1).tolist()
+    assert assignments[0]["nearest_segments"] == np.argsort(distances[0])[:2].tolist()
+    np.testing.assert_allclose(assignments[0]["distances"], np.sort(distances[0])[:2])
+    assert assignments[3] == assignments[20]
+
+
+def test_cache_and_unknown_reviewers():
+    """
+    Cached reviewers aren't gathered again, the least recently used are evicted and unknown
+    reviewers raise a KeyError.
+    """
+    service, _, _, gathers = _create_service(cache_size=2)
+
+    async def look_up():
+        for name in ["pro1", "pro2", "pro1", "pro3", "pro1", "pro2"]:
+            await service.assign(name)
+        with pytest.raises(KeyError):
+            await service.assign("unknown")
+
+    asyncio.run(look_up())
+    assert gathers == [[1], [2], [3], [2]]
+    statistics = service.get_statistics()
+    assert statistics["lookups"] == 7
+    assert statistics["cache_hits"] == 2
+    assert statistics["batches"] == 4
+    assert statistics["latency_p50_seconds"] <= statistics["latency_p99_seconds"]
+
+
+def test_serve_over_tcp():
+    """
+    The load test client gets an answer to each request and unknown reviewers are answered
+    with an error.
+    """
+    service, _, _, _ = _create_service()
+
+    async def load_test():
+        server = await service.serve()
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            result = await run_load("127.0.0.1", port, [f"pro{i}" for i in range(50)],
+                                    num_clients=4, requests_per_client=25, zipf_exponent=0)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"unknown\npro7\n")
+            responses = [json.loads(await reader.readline()) for _ in range(2)]
+            writer.close()
+            await writer.wait_closed()
+        return result, responses
+
+    result, responses = asyncio.run(load_test())
+    assert result["requests"] == 100 and result["errors"] == 0
+    assert responses[0] == {"profileName": "unknown", "error": "unknown reviewer"}
+    assert responses[1]["profileName"] == "pro7"
+    assert service.get_statistics()["lookups"] == 102
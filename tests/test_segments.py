@@ -0,0 +1,84 @@
+"""
+Test the segment profiles
+"""
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+import clustering.rate_beer_loader as rb_loader
+from clustering.segments import UNASSIGNED_SEGMENT, SegmentProfile, profile_segments
+
+BEER_LOCATION = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+
+
+def _get_labels(table):
+    # Every third reviewer is left out of the segments.
+    labels = np.arange(len(table.profile_vocabulary)) % 3
+    labels[labels == 2] = UNASSIGNED_SEGMENT
+    return labels
+
+
+def test_profile_matches_reviews():
+    """
+    The grouped aggregates match counting the reviews of each segment one by one.
+    """
+    table = rb_loader.RateBeerLoader(BEER_LOCATION).load_rate_beer_table()
+    labels = _get_labels(table)
+    profile = profile_segments(table, labels, top_n=3)
+    np.testing.assert_array_equal(profile.segments, [0, 1])
+
+    segment_of = dict(zip(table.profile_vocabulary, labels.tolist()))
+    for segment in profile.segments.tolist():
+        reviews = [review for review in table.to_reviews()
+                   if segment_of[review["review"]["profileName"]] == segment]
+        details = profile.get_segment(segment)
+        assert details["reviews"] == len(reviews)
+        assert details["reviewers"] == len({review["review"]["profileName"] for review in reviews})
+        overall = [int(review["review"]["overall"].split("/")[0]) / int(review["review"]["overall"].split("/")[1])
+                   for review in reviews if "overall" in review["review"]]
+        assert np.isclose(details["mean_scores"]["overall"], np.mean(overall))
+        styles = Counter(review["beer"]["style"] for review in reviews)
+        assert [count for _, count in details["top_styles"]] == sorted(styles.values(), reverse=True)[:3]
+        assert all(styles[style] == count for style, count in details["top_styles"])
+        assert sum(details["months"].values()) == len(reviews)
+        assert sum(details["days_of_week"].values()) == len(reviews)
+        assert {int(review["review"]["Year"][3:]) for review in reviews} \
+            == {year for year, count in details["years"].items() if count}
+
+
+def test_profile_by_reviewer_names(tmp_path):
+    """
+    Labels given by name only count the named reviewers, and a saved profile loads back the same.
+    """
+    table = rb_loader.RateBeerLoader(BEER_LOCATION).load_rate_beer_table()
+    names = table.profile_vocabulary[:2]
+    profile = profile_segments(table, np.array([5, 5]), reviewer_names=names)
+    assert profile.segments.tolist() == [5]
+    assert profile.reviewer_counts.tolist() == [2]
+    assert profile.review_counts.tolist() == [int(np.isin(table.profile_names, [0, 1]).sum())]
+
+    profile.save(tmp_path.joinpath("profile.npz"))
+    loaded = SegmentProfile.load(tmp_path.joinpath("profile.npz"))
+    assert loaded.get_segment(5) == profile.get_segment(5)
+
+
+def test_segment_profile_cache(tmp_path):
+    """
+    The second profile of the same labels is loaded from the cache without reading the file.
+    """
+    table = rb_loader.RateBeerLoader(BEER_LOCATION).load_rate_beer_table()
+    labels = _get_labels(table)
+    first_loader = rb_loader.RateBeerLoader(BEER_LOCATION)
+    first = first_loader.get_segment_profile(labels, cache_directory=tmp_path)
+    assert first_loader.instrumentation.get_stage("profile_segments") is not None
+
+    second_loader = rb_loader.RateBeerLoader(BEER_LOCATION)
+    second = second_loader.get_segment_profile(labels, cache_directory=tmp_path)
+    assert second_loader.instrumentation.get_stage("profile_segments") is None
+    assert second_loader.instrumentation.get_stage("load_segment_profile") is not None
+    assert second.get_segment(1) == first.get_segment(1)
+
+    other_loader = rb_loader.RateBeerLoader(BEER_LOCATION)
+    other_loader.get_segment_profile(np.zeros_like(labels), cache_directory=tmp_path)
+    assert other_loader.instrumentation.get_stage("profile_segments") is not None
@@ -0,0 +1,74 @@
+"""
+Test the reviewer similarity index
+"""
+import numpy as np
+
+from clustering.customerclustering import RateBeerCustomerClusterCreator
+from clustering.similarity import ReviewerSimilarityIndex
+
+
+def _create_embeddings(number_of_reviewers: int = 600, seed: int = 0):
+    random_generator = np.random.default_rng(seed)
+    centres = random_generator.normal(size=(6, 8)) * 4
+    embeddings = centres[random_generator.integers(len(centres), size=number_of_reviewers)] \
+        + random_generator.normal(size=(number_of_reviewers, 8))
+    return embeddings.astype(np.float32), [f"pro{i}" for i in range(number_of_reviewers)]
+
+
+def test_exact_search_matches_brute_force():
+    """
+    The blocked search finds the same nearest reviewers as comparing every pair.
+    """
+    embeddings, names = _create_embeddings()
+    index = ReviewerSimilarityIndex(embeddings, names)
+    indices, distances = index.search(embeddings[:40], k=5, batch_size=16)
+    pairwise = np.linalg.norm(embeddings[:40, None].astype(np.float64) - embeddings[None], axis=2)
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(np.argsort(pairwise, axis=1)[:, :5], axis=1))
+    np.testing.assert_allclose(distances, np.sort(pairwise, axis=1)[:, :5], atol=1e-2)
+
+
+def test_inverted_file_search():
+    """
+    Probing every centroid is exact and probing fewer only finds reviewers of the probed clusters.
+    """
+    embeddings, names = _create_embeddings()
+    cluster_creator = RateBeerCustomerClusterCreator(embeddings, names, cluster_range=[6], random_state=0)
+    cluster_creator.fit()
+    exact = ReviewerSimilarityIndex(embeddings, names)
+    index = ReviewerSimilarityIndex(embeddings, names, centroids=cluster_creator.centroids,
+                                    labels=cluster_creator.labels)
+    assert index.num_lists == 6
+    np.testing.assert_array_equal(index.search(embeddings[:20], k=5, num_probes=6)[0],
+                                  exact.search(embeddings[:20], k=5)[0])
+    indices, _ = index.search(embeddings[:20], k=5, num_probes=1)
+    assert all(len(set(cluster_creator.labels[row])) == 1 for row in indices)
+
+
+def test_save_and_load(tmp_path):
+    """
+    A loaded index is memory mapped and finds the same reviewers, leaving out the reviewer itself.
+    """
+    embeddings, names = _create_embeddings()
+    index = ReviewerSimilarityIndex(embeddings, names, metric="cosine", centroids=embeddings[:4])
+    index.save(tmp_path)
+    loaded = ReviewerSimilarityIndex.load(tmp_path)
+    assert isinstance(loaded._embeddings, np.memmap)
+    np.testing.assert_array_equal(loaded.search(embeddings[:10], k=3, num_probes=2)[0],
+                                  index.search(embeddings[:10], k=3, num_probes=2)[0])
+    similar = loaded.search_reviewers(["pro0", "pro1"], k=4)
+    assert [len(reviewers) for reviewers in similar] == [4, 4]
+    assert all(name not in [reviewer for reviewer, _ in reviewers]
+               for name, reviewers in zip(["pro0", "pro1"], similar))
+    assert all(0 <= distance <= 2 for reviewers in similar for _, distance in reviewers)
+
+
+def test_assigns_embeddings_to_nearest_centroids():
+    """
+    Without labels each embedding is listed under its nearest centroid.
+    """
+    embeddings, names = _create_embeddings()
+    centroids = embeddings[:5].astype(np.float64)
+    index = ReviewerSimilarityIndex(embeddings, names, centroids=centroids, batch_size=64)
+    nearest = np.linalg.norm(embeddings[:, None] - centroids[None], axis=2).argmin(axis=1)
+    np.testing.assert_array_equal(np.diff(index._list_offsets), np.bincount(nearest, minlength=5))
+    np.testing.assert_array_equal(index._ids, np.argsort(nearest, kind="stable"))
@@ -0,0 +1,45 @@
+import csv
+from pathlib import Path
+
+from clustering.sweep import RateBeerSweep, _MedianPruner, _expand_parameters
+
+
+def test_expand_parameters():
+    """
+    The "." separated parameters are nested into the pipeline's keyword argument dictionaries.
+    """
+    expanded = _expand_parameters({"model_kwargs.embedding_dim": 8, "lr_scheduler": "ExponentialLR",
+                                   "lr_scheduler_kwargs.gamma": 0.9})
+    assert expanded == {"model_kwargs": {"embedding_dim": 8}, "lr_scheduler": "ExponentialLR",
+                        "lr_scheduler_kwargs": {"gamma": 0.9}}
+
+
+def test_median_pruner():
+    """
+    A trial is pruned once enough other trials reached the epoch and its metric is below their median.
+    """
+    pruner = _MedianPruner({}, None, min_trials=2, larger_is_better=True)
+    assert not pruner(2, 0.5)
+    assert not pruner(2, 0.3)
+    assert pruner(2, 0.1)
+    assert not pruner(2, 0.6)
+
+
+def test_sweep_writes_summary(tmp_path):
+    """
+    Every trial of the grid is run on the shared triples and summarised.
+    """
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    sweep = RateBeerSweep(beer_location,
+                          {"model_kwargs.embedding_dim": [4, 8]},
+                          output_directory=tmp_path.joinpath("sweep"),
+                          num_epochs=4,
+                          num_workers=2,
+                          loader_kwargs=dict(write_training_file=False, cache_directory=tmp_path.joinpath("cache")),
+                          pipeline_kwargs=dict(training_kwargs=dict(batch_size=256)))
+    summaries = sweep.run()
+    assert [summary["trial"] for summary in summaries] == [0, 1]
+    assert all(summary["status"] in ("completed", "pruned") for summary in summaries)
+    with tmp_path.joinpath("sweep", "summary.tsv").open() as summary_file:
+        rows = list(csv.DictReader(summary_file, delimiter="\t"))
+    assert [row["model_kwargs.embedding_dim"] for row in rows] == ["4", "8"]
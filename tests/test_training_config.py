@@ -0,0 +1,59 @@
+"""
+Test the CPU training configuration
+"""
+from pathlib import Path
+
+import torch
+from pykeen.models import ComplEx, TransE
+from pykeen.triples import CoreTriplesFactory
+
+from clustering.training_config import CPUTrainingConfig, estimate_batch_size
+
+
+def _create_factory(num_entities: int = 1000) -> CoreTriplesFactory:
+    mapped_triples = torch.stack([torch.arange(num_entities), torch.zeros(num_entities, dtype=torch.long),
+                                  torch.arange(num_entities).roll(1)], dim=1)
+    return CoreTriplesFactory(mapped_triples=mapped_triples, num_entities=num_entities, num_relations=2)
+
+
+def test_batch_size_fits_memory_budget():
+    """
+    The batch size is a power of two that grows with the budget and shrinks with the model size.
+    """
+    model = TransE(triples_factory=_create_factory(), embedding_dim=32, random_seed=1)
+    small = estimate_batch_size(model, memory_budget_bytes=2 ** 20)
+    large = estimate_batch_size(model, memory_budget_bytes=2 ** 24)
+    assert 1 <= small < large <= 65536
+    assert large & (large - 1) == 0
+    assert estimate_batch_size(model, 2 ** 24, num_negatives_per_positive=8) < large
+    larger_model = ComplEx(triples_factory=_create_factory(), embedding_dim=32, random_seed=1)
+    assert estimate_batch_size(larger_model, 2 ** 24) < large
+    assert estimate_batch_size(model, 10) == 1
+
+    config = CPUTrainingConfig(memory_budget_bytes=2 ** 24)
+    assert config.get_batch_size(model, num_training_triples=100) == 64
+    assert CPUTrainingConfig(batch_size=32, memory_budget_bytes=2 ** 24).get_batch_size(model, 100) == 32
+
+
+def test_fit_reports_throughput(tmp_path):
+    """
+    The training uses the configured seed and reports the triples per second of every epoch.
+    """
+    from pykeen.constants import PYKEEN_CHECKPOINTS
+    from clustering.pykeen_version import RateBeerPykeen
+
+    beer_location = Path(__file__).parent.joinpath("ratebeer_test_data.txt").absolute()
+    checkpoint_name = "test_training_config_checkpoint.pt"
+    throughputs = []
+    config = CPUTrainingConfig(num_threads=1, memory_budget_bytes=2 ** 26, random_seed=100,
+                               throughput_callback=lambda epoch, throughput: throughputs.append((epoch, throughput)))
+    engine = RateBeerPykeen(beer_location, checkpoint_name=checkpoint_name, embedding_dim=8, num_epochs=3,
+                            stopper=None, training_config=config,
+                            loader_kwargs=dict(write_training_file=False, cache_directory=tmp_path))
+    try:
+        engine.fit()
+    finally:
+        PYKEEN_CHECKPOINTS.joinpath(checkpoint_name).unlink(missing_ok=True)
+    assert [epoch for epoch, _ in throughputs] == [1, 2, 3]
+    assert all(throughput > 0 for _, throughput in throughputs)
+    assert torch.get_num_threads() == 1